@@ -1,6 +1,7 @@
 import streamlit as st
 import os
-from translate_book import translate_file, create_interactive_html_block
+from translate_book import (translate_document, estimate_billable_characters,
+                            has_translation_errors, effective_glosses, GLOSS_WORDS, GLOSS_ALIGNMENT)
 from io import BytesIO
 from password_manager import PasswordManager
 import pandas as pd
@@ -9,16 +10,38 @@
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 import streamlit.components.v1 as components
-import jieba
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import math
-from translator import Translator
+import threading
+from translator import Translator, LANGUAGES
+from text_ingest import ingest
+from result_store import ResultStore, make_result_key
+from job_queue import JobManager, COMPLETED, QUEUED, CANCELLED
+from perf_stats import perf_stats, timed
+from profiling import profiling_switch
+from translation_context import TranslationContext, use_context
+import psutil
 import plotly.graph_objects as go
 
 
 # Initialize password manager only when needed
 pm = None
 
+# Seconds between job status refreshes while a translation is running
+JOB_POLL_INTERVAL = 2
+MAX_LISTED_JOBS = 10
+
+# Uploads up to this many characters are shown in an editable text area
+UPLOAD_EDIT_MAX_CHARS = 100_000
+
+# Shown by "Try Example"; its translations are precomputed at startup
+EXAMPLE_TEXT = """第37届中国电影金鸡奖是2024年11月16日在中国厦门举的中国电影颁奖礼[2]，该届颁奖礼由中国文学艺术界联合会、中国电影家协会与厦门市人民政府共同主办。2024年10月27日公布评委会名名单[3][4]，颁奖典礼主持人由电影频道主持人蓝羽与演员佟大为担任[5]。
+
+张艺执导的《第二十条》获最佳故事片奖，陈凯歌凭借《志愿军：雄兵出击》获得最佳导演，音、李庚希分别凭借《第二十条》和《我们一起太阳》获得最佳男主角奖[6]，李庚希亦成为中电影金鸡奖的第一位"00后"影后[7]。
+"""
+
+# Users per page in the admin dashboard
+ADMIN_PAGE_SIZE = 25
+
 
 def init_password_manager():
     global pm
@@ -32,6 +55,20 @@ def init_password_manager():
     return True
 
 
+def ingest_upload(uploaded_file):
+    """Decode an uploaded file once per upload, keeping it in the session"""
+    upload_id = getattr(uploaded_file, 'file_id', None) or (uploaded_file.name, uploaded_file.size)
+    cached = st.session_state.get('ingested_upload')
+    if cached is not None and cached[0] == upload_id:
+        return cached[1]
+
+    uploaded_file.seek(0)
+    upload = ingest(uploaded_file, name=uploaded_file.name)
+    # Running jobs keep their own reference; the old file goes away with the last one
+    st.session_state.ingested_upload = (upload_id, upload)
+    return upload
+
+
 def init_translator():
     if 'translator' not in st.session_state:
         st.session_state.translator = Translator()
@@ -47,9 +84,14 @@ def show_user_interface(user_password=None):
     col1, col2 = st.columns([10, 1])
     with col2:
         if st.button("Logout"):
+            # Nobody is left to see them; stop this user's translations
+            get_job_manager().cancel_owner(pm.get_key_name(st.session_state.current_user), "Logged out")
             st.session_state.user_logged_in = False
             st.session_state.current_user = None
             st.session_state.is_admin = False
+            st.session_state.pop('last_translation', None)
+            st.session_state.pop('previous_document', None)
+            st.session_state.pop('ingested_upload', None)
             st.rerun()
 
     if user_password is None:
@@ -73,6 +115,15 @@ def show_user_interface(user_password=None):
         help="Standard Translation: Full sentence translation with pinyin\nInteractive Word-by-Word: Click on individual words to see translations and hear pronunciation"
     )
 
+    glosses = GLOSS_WORDS
+    if translation_mode == "Interactive Word-by-Word":
+        if st.checkbox(
+            "Word meanings in context",
+            value=True,
+            help="Translate each sentence once and show each word's part of the sentence translation. Available for English and Japanese; words that can't be matched are translated on their own."
+        ):
+            glosses = GLOSS_ALIGNMENT
+
     col1, col2, col3 = st.columns([1, 2, 1])
 
     with col1:
@@ -83,26 +134,9 @@ def show_user_interface(user_password=None):
         )
 
     with col2:
-        languages = {
-            "Arabic": "ar",
-            "English": "en",
-            "French": "fr",
-            "Indonesian": "id",
-            "Italian": "it",
-            "Japanese": "ja",
-            "Korean": "ko",
-            "Persian": "fa",
-            "Portuguese": "pt",
-            "Russian": "ru",
-            "Spanish": "es",
-            "Thai": "th",
-            "Uzbek": "uz",
-            "Vietnamese": "vi"
-        }
-
         second_language = st.selectbox(
             "Select Second Language (Required)",
-            options=list(languages.keys()),
+            options=list(LANGUAGES.keys()),
             index=None,
             placeholder="Choose a language..."
         )
@@ -148,31 +182,49 @@ def show_user_interface(user_password=None):
         )
         if uploaded_file:
             try:
-                text_input = uploaded_file.getvalue().decode('utf-8')
-                # Show the uploaded text in a text area that can be edited
-                text_input = st.text_area(
-                    "Edit uploaded text if needed:",
-                    value=text_input,
-                    height=300,
-                    key="uploaded_text_area"
-                )
+                upload = ingest_upload(uploaded_file)
+                edit_max_chars = st.secrets.get("uploads", {}).get("edit_max_chars", UPLOAD_EDIT_MAX_CHARS)
+                if upload.chars <= edit_max_chars:
+                    # Show the uploaded text in a text area that can be edited
+                    text_input = st.text_area(
+                        "Edit uploaded text if needed:",
+                        value=upload.read(),
+                        height=300,
+                        key="uploaded_text_area"
+                    )
+                else:
+                    # Too large to echo into the browser; it's translated as uploaded
+                    st.info(
+                        f"{upload.name}: {upload.chars:,} characters ({upload.encoding}). "
+                        "Large files are translated as uploaded and can't be edited here."
+                    )
+                    st.text(upload.preview + "…")
+                    text_input = upload
             except Exception as e:
                 st.error(f"Error reading file: {str(e)}")
 
     else:  # Try Example
-        example_text = """第37届中国电影金鸡奖是2024年11月16日在中国厦门举的中国电影颁奖礼[2]，该届颁奖礼由中国文学艺术界联合会、中国电影家协会与厦门市人民政府共同主办。2024年10月27日公布评委会名名单[3][4]，颁奖典礼主持人由电影频道主持人蓝羽与演员佟大为担任[5]。
-
-张艺执导的《第二十条》获最佳故事片奖，陈凯歌凭借《志愿军：雄兵出击》获得最佳导演，音、李庚希分别凭借《第二十条》和《我们一起太阳》获得最佳男主角奖[6]，李庚希亦成为中电影金鸡奖的第一位"00后"影后[7]。
-"""
         text_input = st.text_area(
             "Example text (you can edit):",
-            value=example_text,
+            value=EXAMPLE_TEXT,
             height=300,
             key="example_text_area"
         )
 
-    # Initialize translator
-    translator = init_translator()
+    options = {
+        'include_english': include_english,
+        'second_language': LANGUAGES.get(second_language),
+        'pinyin_style': pinyin_style,
+        'translation_mode': translation_mode,
+        # Alignment is only available for some languages; the others use word lookups
+        'glosses': effective_glosses(glosses, LANGUAGES.get(second_language))
+    }
+
+    # A translation started with different options is no longer wanted
+    active_job = get_job_manager().get(st.session_state.get('active_job_id'))
+    if active_job is not None and active_job.is_active and active_job.options != options:
+        get_job_manager().cancel(active_job.id, "Options changed")
+        st.session_state.active_job_id = None
 
     # Translation Button
     if st.button("Translate", key="translate_button"):
@@ -180,223 +232,277 @@ def show_user_interface(user_password=None):
             st.error("Please select a second language before translating!")
             return
 
-        if not text_input.strip():
+        if not (text_input.strip() if isinstance(text_input, str) else text_input.chars):
             st.error("Please enter or upload some text first!")
             return
 
         try:
-            # Check usage limit before translation using Azure counting rules
-            chars_count = count_characters(text_input, include_english, second_language)
-            if not pm.check_usage_limit(st.session_state.current_user, chars_count):
-                daily_limit = pm.get_user_limit(st.session_state.current_user)
-                st.error(f"You have exceeded your daily translation limit ({daily_limit:,} characters). Please try again tomorrow.")
-                return
-            
-            # Track usage if translation succeeds
-            pm.track_usage(st.session_state.current_user, chars_count)
-            
-            # Show current usage with premium status
-            daily_usage = pm.get_daily_usage(st.session_state.current_user)
-            daily_limit = pm.get_user_limit(st.session_state.current_user)
-            
-            # Get user's tier
-            key_name = pm.get_key_name(st.session_state.current_user)
-            user_tier = pm.user_tiers.get(key_name, "default")
-            
-            if user_tier == "premium" or pm.is_admin(st.session_state.current_user):
-                st.markdown(
-                    f"""
-                    <div style="padding: 10px;">
-                        Today's usage: {daily_usage:,}/{daily_limit:,} characters 
-                        <span style="
-                            background: linear-gradient(45deg, #FFD700, #FFA500);
-                            -webkit-background-clip: text;
-                            -webkit-text-fill-color: transparent;
-                            font-weight: bold;
-                            padding: 0 10px;
-                            text-shadow: 0px 0px 10px rgba(255,215,0,0.3);
-                            border: 1px solid #FFD700;
-                            border-radius: 15px;
-                            margin-left: 10px;
-                        ">
-                            Premium Account
-                        </span>
-                    </div>
-                    """,
-                    unsafe_allow_html=True
-                )
-            else:
-                st.info(f"Today's usage: {daily_usage:,}/{daily_limit:,} characters")
-            
-            if translation_mode == "Interactive Word-by-Word":
-                try:
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-                    
-                    # Step 1: Word segmentation with paragraph preservation
-                    status_text.text("Step 1/3: Segmenting text...")
-                    progress_bar.progress(10)
-                    
-                    # Split text into paragraphs first
-                    paragraphs = text_input.split('\n')
-                    all_words = []
-                    paragraph_breaks = []  # Track where paragraphs end
-                    
-                    for paragraph in paragraphs:
-                        if paragraph.strip():  # If paragraph is not empty
-                            # Use jieba.tokenize to get position information
-                            tokens = list(jieba.tokenize(paragraph))
-                            # Sort tokens by their start position to maintain order
-                            tokens.sort(key=lambda x: x[1])
-                            # Extract just the words while maintaining order
-                            words = [token[0] for token in tokens]
-                            all_words.extend(words)
-                            paragraph_breaks.append(len(all_words))
-                        else:
-                            # Add a special marker for empty paragraphs
-                            all_words.append('\n')
-                            paragraph_breaks.append(len(all_words))
-                    
-                    total_words = len(all_words)
-                    
-                    # Step 2: Processing words in parallel while maintaining order
-                    status_text.text("Step 2/3: Processing words in parallel...")
-                    processed_words = [None] * total_words  # Pre-allocate list with correct size
-                    
-                    # Function to process a batch of words
-                    def process_word_batch(word_batch, start_index, translator):
-                        results = []
-                        for i, word in enumerate(word_batch):
-                            try:
-                                if word == '\n':
-                                    results.append((start_index + i, {'word': '\n'}))
-                                elif word.strip():
-                                    result = translator.process_chinese_text(
-                                        word, 
-                                        languages[second_language]
-                                    )
-                                    # Create a properly structured dictionary even if translation fails
-                                    word_dict = {
-                                        'word': word,
-                                        'pinyin': '',
-                                        'translations': []
-                                    }
-                                    if result and len(result) > 0:
-                                        word_dict.update(result[0])  # Only update if we have valid results
-                                    results.append((start_index + i, word_dict))
-                                else:
-                                    # Handle empty strings
-                                    results.append((start_index + i, {'word': '', 'pinyin': '', 'translations': []}))
-                            except Exception as e:
-                                print(f"Error processing word '{word}': {str(e)}")
-                                # Always return a valid dictionary structure
-                                results.append((start_index + i, {'word': word, 'pinyin': '', 'translations': []}))
-                        return results
-                    
-                    # Create batches while preserving order
-                    batch_size = 5
-                    batches = []
-                    for i in range(0, len(all_words), batch_size):
-                        batch = all_words[i:i + batch_size]
-                        batches.append((i, batch))
-                    
-                    # Process batches in parallel
-                    with ThreadPoolExecutor(max_workers=3) as executor:
-                        futures = []
-                        for start_idx, batch in batches:
-                            future = executor.submit(
-                                process_word_batch, 
-                                batch,
-                                start_idx,
-                                translator
-                            )
-                            futures.append(future)
-                        
-                        completed = 0
-                        for future in as_completed(futures):
-                            try:
-                                # Get results and place them in the correct positions
-                                for idx, result in future.result():
-                                    processed_words[idx] = result
-                                
-                                completed += 1
-                                progress = 10 + (completed / len(batches) * 60)
-                                progress_bar.progress(int(progress))
-                                status_text.text(
-                                    f"Step 2/3: Processing words... "
-                                    f"(Batch {completed}/{len(batches)})"
-                                )
-                            except Exception as e:
-                                st.error(f"Error processing batch: {str(e)}")
-                    
-                    # Step 3: Generating HTML
-                    status_text.text("Step 3/3: Generating interactive HTML...")
-                    progress_bar.progress(80)
-                    
-                    # Add error checking before generating HTML
-                    if any(word is None for word in processed_words):
-                        raise ValueError("Some words failed to process")
-                    
-                    html_content = translate_file(
-                        text_input,
-                        None,
-                        include_english,
-                        languages[second_language],
-                        pinyin_style,
-                        translation_mode,
-                        processed_words=[word for word in processed_words if word is not None]  # Filter None values
-                    )
-                    
-                    # Complete
-                    progress_bar.progress(100)
-                    status_text.text("Translation completed!")
-                    
-                    # Move download button right after success message
-                    st.success("Translation completed!")
-                    st.download_button(
-                        label="Download HTML",
-                        data=html_content.encode('utf-8'),
-                        file_name="translation.html",
-                        mime="text/html; charset=utf-8"
-                    )
-                    # Display translation result
-                    components.html(html_content, height=800, scrolling=True)
-                    
-                except Exception as e:
-                    st.error(f"Translation error: {str(e)}")
-            else:
-                # Standard translation mode
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-                
-                html_content = translate_file(
+            result_key = make_result_key(text_input, **options)
+            html_content = get_result_store().get(result_key)
+            if html_content is not None and has_translation_errors(html_content):
+                # Stored before failed pages were kept out of the store
+                get_result_store().discard(result_key)
+                html_content = None
+
+            # Identical requests are served from the store without billing again
+            if html_content is None:
+                # Estimate what will actually reach Azure; cached text is free
+                estimated_chars = estimate_billable_characters(
                     text_input,
-                    lambda p: update_progress(p, progress_bar, status_text),
                     include_english,
-                    languages[second_language],
-                    pinyin_style,
-                    translation_mode
+                    LANGUAGES[second_language],
+                    translation_mode,
+                    glosses
                 )
-                # Move download button right after success message
-                st.success("Translation completed!")
-                st.download_button(
-                    label="Download HTML",
-                    data=html_content,
-                    file_name="translation.html",
-                    mime="text/html"
+                if not pm.check_usage_limit(st.session_state.current_user, estimated_chars):
+                    daily_limit = pm.get_user_limit(st.session_state.current_user)
+                    st.error(f"You have exceeded your daily translation limit ({daily_limit:,} characters). Please try again tomorrow.")
+                    return
+                
+                # Run the translation as a background job so reruns and
+                # disconnects don't interrupt it. Usage is metered as chunks
+                # are sent to Azure, up to today's limit.
+                job_id = get_job_manager().submit(
+                    pm.get_key_name(st.session_state.current_user),
+                    text_input,
+                    options,
+                    result_key,
+                    tier=pm.get_user_tier(st.session_state.current_user),
+                    meter=pm.create_usage_meter(st.session_state.current_user),
+                    # The switch is only used up by a job that actually starts
+                    profile=profiling_switch.take,
+                    # Unchanged sentences of the last translated text are reused
+                    previous=st.session_state.get('previous_document')
                 )
-                # Display translation result
-                components.html(html_content, height=800, scrolling=True)
+                
+                show_usage_status(st.session_state.current_user)
+                st.caption(f"Estimated usage for this translation: {estimated_chars:,} characters")
+                
+                st.session_state.active_job_id = job_id
+                st.session_state.pop('last_translation', None)
+            else:
+                # Keep the result across reruns (e.g. clicking the download button)
+                st.session_state.last_translation = {
+                    'key': result_key,
+                    'html': html_content
+                }
             
         except Exception as e:
             st.error(f"Translation error: {str(e)}")
 
+    show_translation_jobs(pm.get_key_name(st.session_state.current_user))
+
+    last_translation = st.session_state.get('last_translation')
+    if last_translation:
+        show_translation_result(last_translation['html'])
 
-def update_progress(progress, progress_bar, status_text):
-    """Update the progress bar and status text"""
-    progress_bar.progress(progress/100)  # Convert percentage to 0-1 range
-    status_text.text(f"Processing... {progress:.1f}% completed")
-    st.session_state.translation_progress = progress
+
+def show_usage_status(user_key):
+    """Show today's usage with premium status"""
+    daily_usage = pm.get_daily_usage(user_key)
+    daily_limit = pm.get_user_limit(user_key)
+    
+    if pm.get_user_tier(user_key) == "premium":
+        st.markdown(
+            f"""
+            <div style="padding: 10px;">
+                Today's usage: {daily_usage:,}/{daily_limit:,} characters 
+                <span style="
+                    background: linear-gradient(45deg, #FFD700, #FFA500);
+                    -webkit-background-clip: text;
+                    -webkit-text-fill-color: transparent;
+                    font-weight: bold;
+                    padding: 0 10px;
+                    text-shadow: 0px 0px 10px rgba(255,215,0,0.3);
+                    border: 1px solid #FFD700;
+                    border-radius: 15px;
+                    margin-left: 10px;
+                ">
+                    Premium Account
+                </span>
+            </div>
+            """,
+            unsafe_allow_html=True
+        )
+    else:
+        st.info(f"Today's usage: {daily_usage:,}/{daily_limit:,} characters")
+
+
+def show_translation_result(html_content):
+    """Show the download button and the rendered translation"""
+    st.success("Translation completed!")
+    st.download_button(
+        label="Download HTML",
+        data=html_content.encode('utf-8'),
+        file_name="translation.html",
+        mime="text/html; charset=utf-8",
+        key="download_translation"
+    )
+    # Display translation result
+    with timed('render.components_html'):
+        components.html(html_content, height=800, scrolling=True)
+
+
+def show_translation_jobs(owner):
+    """List the user's translation jobs, polling while any of them is running"""
+    jobs = get_job_manager().list_jobs(owner)
+    if not jobs:
+        return
+
+    poll_interval = JOB_POLL_INTERVAL if any(job.is_active for job in jobs) else None
+    st.fragment(run_every=poll_interval)(render_translation_jobs)(owner)
+
+
+def render_translation_jobs(owner):
+    """Render job status; finished jobs can be opened without translating again"""
+    job_manager = get_job_manager()
+    jobs = job_manager.list_jobs(owner)[:MAX_LISTED_JOBS]
+
+    st.subheader("Your Translations")
+    for job in jobs:
+        mode = job.options.get('translation_mode', '')
+        label = f"{job.created_at} · {mode} · {job.chars:,} characters"
+        if job.is_active:
+            col1, col2 = st.columns([4, 1])
+            with col1:
+                st.text(f"{label} — {describe_job_progress(job)}")
+                st.progress(int(job.progress))
+            with col2:
+                if st.button("Cancel", key=f"cancel_job_{job.id}"):
+                    job_manager.cancel(job.id)
+                    st.rerun()
+        elif job.status == COMPLETED and not job_manager.has_result(job.id):
+            # The result store evicted the page since
+            st.info(f"{label} — no longer stored, please translate it again")
+        elif job.status == COMPLETED:
+            # Open the job the user just started as soon as it finishes
+            if job.id == st.session_state.get('active_job_id'):
+                st.session_state.active_job_id = None
+                open_job_result(job)
+                st.rerun()
+
+            col1, col2 = st.columns([4, 1])
+            with col1:
+                st.text(f"{label} — completed")
+            with col2:
+                if st.button("Show", key=f"show_job_{job.id}"):
+                    open_job_result(job)
+                    st.rerun()
+        elif job.status == CANCELLED:
+            st.warning(f"{label} — cancelled: {job.error}")
+        else:
+            st.error(f"{label} — failed: {job.error}")
+
+
+def describe_job_progress(job):
+    """Human readable progress for a running job"""
+    if job.status == QUEUED:
+        return "Waiting for a free worker..."
+    if job.options.get('translation_mode') == "Interactive Word-by-Word":
+        if job.progress < 10:
+            return "Step 1/3: Segmenting text..."
+        if job.progress < 80:
+            return "Step 2/3: Translating vocabulary..."
+        return "Step 3/3: Generating interactive HTML..."
+    return f"Processing... {job.progress:.1f}% completed"
+
+
+def open_job_result(job):
+    """Make a finished job's result the one displayed in this session"""
+    html_content = get_job_manager().get_result(job.id)
+    if html_content is not None:
+        st.session_state.last_translation = {
+            'key': job.result_key,
+            'html': html_content
+        }
+        # Keep the chunk results so an edit of this text only translates what changed
+        document = get_job_manager().take_document(job.id)
+        if document is not None:
+            st.session_state.previous_document = document
+
+
+@st.cache_resource
+def get_process():
+    """This process, shared so cpu_percent() measures the time since the previous dashboard render"""
+    process = psutil.Process()
+    # The first call only starts the measurement
+    process.cpu_percent(interval=None)
+    return process
+
+
+@st.cache_resource
+def get_job_manager():
+    """Process-level job manager shared by every session"""
+    job_settings = st.secrets.get("jobs", {})
+    return JobManager(
+        jobs_dir=job_settings.get("jobs_dir", "data/jobs"),
+        max_concurrent_jobs=job_settings.get("max_concurrent_jobs", 8),
+        max_jobs_per_user=job_settings.get("max_jobs_per_user", 5),
+        result_store=get_result_store(),
+        job_timeout=job_settings.get("job_timeout", 3600),
+        job_retention=job_settings.get("job_retention", 7 * 24 * 3600),
+        kept_jobs_per_user=job_settings.get("kept_jobs_per_user", MAX_LISTED_JOBS),
+        document_ttl=job_settings.get("document_ttl", 900)
+    )
+
+
+@st.cache_resource
+def precompute_example():
+    """Translate the example text in the background, once per process
+
+    Both modes in every language, with the default settings, go into the
+    result store, so "Try Example" is served without translating. Results
+    already on disk from an earlier run are skipped.
+    """
+    thread = threading.Thread(target=_precompute_example, args=(get_result_store(),),
+                              name="precompute-example", daemon=True)
+    thread.start()
+    return thread
+
+
+def _precompute_example(store):
+    for translation_mode in ["Standard Translation", "Interactive Word-by-Word"]:
+        for language_code in dict.fromkeys(LANGUAGES.values()):
+            options = {
+                # English as the second language replaces the English checkbox
+                'include_english': language_code != "en",
+                'second_language': language_code,
+                'pinyin_style': 'tone_marks',
+                'translation_mode': translation_mode,
+                # The defaults of the user interface
+                'glosses': effective_glosses(
+                    GLOSS_ALIGNMENT if translation_mode == "Interactive Word-by-Word" else GLOSS_WORDS,
+                    language_code
+                )
+            }
+            result_key = make_result_key(EXAMPLE_TEXT, **options)
+            stored = store.get(result_key)
+            if stored is not None and not has_translation_errors(stored):
+                continue
+            try:
+                # Azure spend shows up in the ledger under this name
+                with use_context(TranslationContext("example")):
+                    html_content, document = translate_document(EXAMPLE_TEXT, **options)
+                if document.failures:
+                    print(f"Example not stored ({translation_mode}, {language_code}): "
+                          f"{document.failures} failed translations")
+                    continue
+                store.put(result_key, html_content)
+            except Exception as e:
+                print(f"Error precomputing example ({translation_mode}, {language_code}): {str(e)}")
+    print("Example translations precomputed")
+
+
+@st.cache_resource
+def get_result_store():
+    """Process-level store of finished translations, shared across sessions and reruns"""
+    store_settings = st.secrets.get("result_store", {})
+    return ResultStore(
+        max_entries=store_settings.get("max_entries", 200),
+        max_memory_bytes=store_settings.get("max_memory_megabytes", 200) * 1024 * 1024,
+        directory=store_settings.get("directory", "data/results"),
+        max_bytes=store_settings.get("max_megabytes", 500) * 1024 * 1024
+    )
 
 
 def init_session():
@@ -432,99 +538,6 @@ def check_admin_password(password_attempt):
     return password_attempt == st.secrets["admin_password"]
 
 
-def create_word_tooltip_html(processed_words, target_lang):
-    """Create HTML with hover tooltips for each word"""
-    # 添加类型检查
-    if not processed_words or not isinstance(processed_words, (list, tuple)):
-        raise ValueError("processed_words must be a non-empty list or tuple")
-        
-    with open('template.html', 'r', encoding='utf-8') as template_file:
-        template_content = template_file.read()
-    
-    is_dark_theme = 'dark' in st.config.get_option('theme.base')
-    
-    content_html = f"""
-    <div class="interactive-text" data-theme="{is_dark_theme}">
-    """
-    
-    current_paragraph = []
-    paragraphs = []
-    
-    # 添加错误处理
-    try:
-        # 按段落分组
-        for word_data in processed_words:
-            if not isinstance(word_data, dict):
-                continue
-                
-            if word_data.get('word') == '\n':
-                if current_paragraph:
-                    paragraphs.append(current_paragraph)
-                    current_paragraph = []
-            else:
-                current_paragraph.append(word_data)
-        
-        # 添加最后一个段落
-        if current_paragraph:
-            paragraphs.append(current_paragraph)
-        
-        # 生成 HTML
-        for paragraph in paragraphs:
-            content_html += "<p>"
-            for word_data in paragraph:
-                # 检查是否是标点符号
-                is_punctuation = len(word_data.get('word', '')) == 1 and not word_data.get('pinyin')
-                
-                if is_punctuation:
-                    content_html += f"""
-                    <span class="non-chinese">{word_data['word']}</span>
-                    """
-                else:
-                    content_html += f"""
-                    <span class="interactive-word" 
-                          onclick="speak('{word_data.get('word', '')}')"
-                          data-tooltip="{word_data.get('pinyin', '')}&#10;{word_data.get('translation', '...')}">
-                        {word_data.get('word', '')}
-                    </span>
-                    """
-            content_html += "</p>"
-        
-    except Exception as e:
-        st.error(f"Error processing text: {str(e)}")
-        return None
-    
-    content_html += "</div>"
-    
-    final_html = template_content.replace('{{content}}', content_html)
-    return final_html
-
-
-def create_interactive_html(processed_words, include_english):
-    """Create HTML content for interactive translation"""
-    try:
-        with open('template.html', 'r', encoding='utf-8') as template_file:
-            html_content = template_file.read()
-        
-        # Add error checking for processed_words
-        if processed_words is None:
-            raise ValueError("processed_words cannot be None")
-            
-        # Create translation content with error handling
-        translation_content = create_interactive_html_block(
-            (None, [word for word in processed_words if word is not None]),  # Filter out None values
-            include_english
-        )
-        
-        if translation_content is None:
-            raise ValueError("Failed to generate translation content")
-            
-        return html_content.replace('{{content}}', translation_content)
-        
-    except Exception as e:
-        st.error(f"Error creating interactive HTML: {str(e)}")
-        return None
-
-
 def show_admin_interface():
     """Show admin interface with usage statistics"""
     st.title("Admin Dashboard")
@@ -536,21 +549,20 @@ def show_admin_interface():
         
     # Get usage statistics
     try:
-        stats = pm.get_usage_stats()
+        overview = pm.get_usage_overview()
         
         # Display overall statistics
         st.header("Overall Statistics")
         col1, col2 = st.columns(2)
         with col1:
-            st.metric("Total Users", stats['total_users'])
+            st.metric("Total Users", overview['total_users'])
         with col2:
-            total_chars = sum(stats['daily_stats'].values())
-            st.metric("Total Characters Translated", f"{total_chars:,}")
+            st.metric("Total Characters Translated", f"{overview['total_chars']:,}")
         
         # Daily usage graph
         st.header("Daily Usage")
         daily_df = pd.DataFrame(
-            list(stats['daily_stats'].items()),
+            list(overview['daily_totals'].items()),
             columns=['Date', 'Characters']
         )
         if not daily_df.empty:
@@ -568,47 +580,175 @@ def show_admin_interface():
             )
             st.plotly_chart(fig)
         
-        # User statistics
-        st.header("User Statistics")
-        for user, dates in stats['user_stats'].items():
-            with st.expander(f"User: {user}"):
-                user_df = pd.DataFrame(
-                    list(dates.items()),
-                    columns=['Date', 'Characters']
-                )
-                st.dataframe(user_df)
-                
-                # User usage graph
-                fig = go.Figure(data=[
-                    go.Scatter(
-                        x=user_df['Date'],
-                        y=user_df['Characters'],
-                        mode='lines+markers',
-                        name='Usage'
-                    )
-                ])
-                fig.update_layout(
-                    title=f'Usage Over Time - {user}',
-                    xaxis_title='Date',
-                    yaxis_title='Characters'
-                )
-                st.plotly_chart(fig)
+        show_user_statistics()
     except Exception as e:
         st.error(f"Error loading statistics: {str(e)}")
 
+    show_performance_panel()
+    show_profiling_panel()
+
 
-def count_characters(text, include_english=True, second_language=None):
-    """Count characters according to Azure Translator rules"""
-    # Remove spaces and newlines
-    text = text.replace(" ", "").replace("\n", "")
-    # Count base characters
-    char_count = len(text)
+def show_profiling_panel():
+    """Profile the next translation and download the resulting reports"""
+    st.header("Profiling")
+    armed, armed_owner = profiling_switch.status()
     
-    # If both English and another language are selected, count twice
-    if include_english and second_language and second_language != "English":
-        char_count *= 2
-        
-    return char_count
+    if armed:
+        target = f"from user '{armed_owner}'" if armed_owner else "from any user"
+        st.info(f"The next translation {target} will be profiled.")
+        if st.button("Cancel profiling", key="disarm_profiling"):
+            profiling_switch.disarm()
+            st.rerun()
+    else:
+        owner = st.text_input(
+            "Only profile translations from user (optional)",
+            key="profile_owner",
+            help="Key name as shown in User Statistics. Leave empty to profile the next translation from anyone."
+        )
+        if st.button("Profile next translation", key="arm_profiling"):
+            profiling_switch.arm(owner.strip())
+            st.rerun()
+    
+    for i, report in enumerate(profiling_switch.reports()):
+        with st.expander(f"{report.created_at} · {report.label}"):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.download_button(
+                    "Profile (.prof)",
+                    data=report.profile_bytes(),
+                    file_name=f"translation-{i}.prof",
+                    mime="application/octet-stream",
+                    key=f"profile_prof_{i}"
+                )
+            with col2:
+                st.download_button(
+                    "Top functions",
+                    data=report.functions_report(),
+                    file_name=f"translation-{i}-functions.txt",
+                    mime="text/plain",
+                    key=f"profile_functions_{i}"
+                )
+            with col3:
+                st.download_button(
+                    "Top allocations",
+                    data=report.allocations_report(),
+                    file_name=f"translation-{i}-allocations.txt",
+                    mime="text/plain",
+                    key=f"profile_allocations_{i}"
+                )
+
+
+def show_performance_panel():
+    """Per-stage latency, cache hit rate and process resource usage"""
+    st.header("Performance")
+    
+    process = get_process()
+    hit_rate = perf_stats.cache_hit_rate()
+    governor = init_translator().governor.stats()
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Cache Hit Rate", f"{hit_rate:.1%}" if hit_rate is not None else "n/a")
+    with col2:
+        st.metric("Process RSS", f"{process.memory_info().rss / 1024 / 1024:,.0f} MB")
+    with col3:
+        st.metric("Process CPU", f"{process.cpu_percent(interval=None):.0f}%")
+    with col4:
+        st.metric("Azure Requests", f"{governor['active']}/{governor['max_concurrent']}",
+                  help=f"Waiting: {governor['waiting']}")
+    
+    breaker = init_translator().breaker.stats()
+    breaker_caption = (
+        f"Azure circuit breaker: {breaker['state'].replace('_', '-')} · "
+        f"{breaker['consecutive_failures']} consecutive failures · "
+        f"{breaker['rejected']:,} requests rejected"
+    )
+    if breaker['retry_in'] > 0:
+        breaker_caption += f" · next attempt in {breaker['retry_in']:.0f}s"
+    if breaker['state'] == 'closed':
+        st.caption(breaker_caption)
+    else:
+        st.warning(breaker_caption)
+    
+    memory = init_translator().memory
+    if memory is not None:
+        st.caption(
+            f"Translation memory: {len(memory):,} sentences · "
+            f"{perf_stats.get_counter('memory_served'):,} served · "
+            f"{perf_stats.get_counter('memory_flagged'):,} flagged as similar"
+        )
+    
+    rows = perf_stats.summary()
+    if not rows:
+        st.info("No timings recorded yet")
+        return
+    
+    st.dataframe(
+        pd.DataFrame(rows).rename(columns={
+            'stage': 'Stage',
+            'count': 'Calls',
+            'mean_ms': 'Mean (ms)',
+            'p50_ms': 'p50 (ms)',
+            'p95_ms': 'p95 (ms)'
+        }),
+        hide_index=True
+    )
+    if st.button("Reset timings", key="reset_perf_stats"):
+        perf_stats.reset()
+        st.rerun()
+
+
+def show_user_statistics():
+    """Paginated, searchable user table; a chart is built only for the selected user"""
+    st.header("User Statistics")
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        search = st.text_input("Search users", key="admin_user_search")
+    with col2:
+        page = st.number_input("Page", min_value=1, value=1, step=1, key="admin_user_page")
+    
+    rows, matching_users = pm.get_user_usage_page(search, page - 1, ADMIN_PAGE_SIZE)
+    page_count = max(1, math.ceil(matching_users / ADMIN_PAGE_SIZE))
+    st.caption(f"{matching_users:,} users · page {page} of {page_count}")
+    if not rows:
+        return
+    
+    st.dataframe(
+        pd.DataFrame(rows, columns=['User', 'Total Characters', 'Last Active']),
+        hide_index=True
+    )
+    
+    user = st.selectbox(
+        "Show usage over time for",
+        options=[row[0] for row in rows],
+        index=None,
+        placeholder="Choose a user...",
+        key="admin_selected_user"
+    )
+    if not user:
+        return
+    
+    user_df = pd.DataFrame(
+        list(pm.get_user_usage_history(user).items()),
+        columns=['Date', 'Characters']
+    )
+    st.dataframe(user_df)
+    
+    # User usage graph
+    fig = go.Figure(data=[
+        go.Scatter(
+            x=user_df['Date'],
+            y=user_df['Characters'],
+            mode='lines+markers',
+            name='Usage'
+        )
+    ])
+    fig.update_layout(
+        title=f'Usage Over Time - {user}',
+        xaxis_title='Date',
+        yaxis_title='Characters'
+    )
+    st.plotly_chart(fig)
 
 
 def main():
@@ -618,6 +758,9 @@ def main():
         initial_sidebar_state="collapsed"
     )
 
+    if st.secrets.get("result_store", {}).get("precompute_example", True):
+        precompute_example()
+
     # Get URL parameters using st.query_params
     url_key = st.query_params.get('key', None)
 
@@ -677,10 +820,13 @@ def main():
         admin_password = st.text_input("Enter admin key", type="password", key="admin_key")
         if st.button("Login as Admin"):
             if init_password_manager():
-                if pm.is_admin(admin_password):
+                record = pm.authenticate(admin_password)
+                if record is not None and record.is_admin:
                     st.session_state.user_logged_in = True
-                    st.session_state.current_user = admin_password
+                    st.session_state.current_user = record.digest
                     st.session_state.is_admin = True
+                    # Don't keep the plaintext key in the widget state
+                    st.session_state.pop("admin_key", None)
                     st.rerun()
                 else:
                     st.sidebar.error("Invalid admin key")
@@ -689,9 +835,10 @@ def main():
     if not st.session_state.get('user_logged_in', False):
         # Try to login with URL key if present
         if url_key and init_password_manager():
-            if pm.check_password(url_key) and not pm.is_admin(url_key):
+            record = pm.authenticate(url_key)
+            if record is not None and not record.is_admin:
                 st.session_state.user_logged_in = True
-                st.session_state.current_user = url_key
+                st.session_state.current_user = record.digest
                 st.session_state.is_admin = False
                 st.rerun()
             else:
@@ -702,10 +849,13 @@ def main():
         user_password = st.text_input("Enter your access key", type="password", key="user_key")
         if st.button("Login"):
             if init_password_manager():
-                if pm.check_password(user_password) and not pm.is_admin(user_password):
+                record = pm.authenticate(user_password)
+                if record is not None and not record.is_admin:
                     st.session_state.user_logged_in = True
-                    st.session_state.current_user = user_password
+                    st.session_state.current_user = record.digest
                     st.session_state.is_admin = False
+                    # Don't keep the plaintext key in the widget state
+                    st.session_state.pop("user_key", None)
                     st.rerun()
                 else:
                     st.error("Invalid access key")
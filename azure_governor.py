@@ -0,0 +1,98 @@
+import heapq
+import itertools
+import threading
+
+# Relative share of Azure capacity per user tier
+DEFAULT_TIER_WEIGHTS = {
+    'premium': 3,
+    'default': 1
+}
+
+# How often a waiting request checks whether it was cancelled (seconds)
+CANCEL_POLL_INTERVAL = 0.25
+
+
+class AzureGovernor:
+    """Process-wide limit on concurrent Azure requests with weighted fair sharing
+
+    Every outbound request takes a slot. When all slots are busy, waiting
+    requests are served in start-time fair queueing order: each client's
+    requests advance its virtual clock by 1/weight, so a busy client can't
+    starve the others and premium clients get a larger share.
+    """
+
+    def __init__(self, max_concurrent=6, tier_weights=None):
+        self.max_concurrent = max_concurrent
+        self.tier_weights = tier_weights or DEFAULT_TIER_WEIGHTS
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiting = []
+        self._virtual_time = 0.0
+        self._client_tags = {}
+        self._sequence = itertools.count()
+
+    def acquire(self, client_id, tier="default", cancel_token=None):
+        """Take a slot, waiting in fair order while all are busy
+
+        With a CancellationToken, the wait ends when it is cancelled or
+        reaches its deadline; returns False then, without a slot.
+        """
+        weight = self.tier_weights.get(tier, 1)
+        with self._lock:
+            tag = max(self._virtual_time, self._client_tags.get(client_id, 0.0)) + 1.0 / weight
+            self._client_tags[client_id] = tag
+
+            if self._active < self.max_concurrent and not self._waiting:
+                self._active += 1
+                self._virtual_time = tag
+                return True
+
+            ready = threading.Event()
+            entry = (tag, next(self._sequence), tier, ready)
+            heapq.heappush(self._waiting, entry)
+
+        if cancel_token is None:
+            ready.wait()
+            return True
+        while not ready.wait(CANCEL_POLL_INTERVAL):
+            if cancel_token.cancelled:
+                with self._lock:
+                    # The slot may have been handed over in the meantime
+                    if ready.is_set():
+                        return True
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                return False
+        return True
+
+    def release(self):
+        with self._lock:
+            if self._waiting:
+                # Hand the slot straight to the next request in fair order
+                tag, _, _, ready = heapq.heappop(self._waiting)
+                self._virtual_time = tag
+                ready.set()
+            else:
+                self._active -= 1
+            self._prune_clients()
+
+    def _prune_clients(self):
+        """Forget clients whose clock fell behind; they'd restart from now anyway"""
+        if len(self._client_tags) > 1000:
+            self._client_tags = {
+                client_id: tag for client_id, tag in self._client_tags.items()
+                if tag > self._virtual_time
+            }
+
+    def stats(self):
+        """Current load, for the admin dashboard"""
+        with self._lock:
+            waiting_by_tier = {}
+            for _, _, tier, _ in self._waiting:
+                waiting_by_tier[tier] = waiting_by_tier.get(tier, 0) + 1
+            return {
+                'max_concurrent': self.max_concurrent,
+                'active': self._active,
+                'waiting': len(self._waiting),
+                'waiting_by_tier': waiting_by_tier
+            }
@@ -0,0 +1,179 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from collections import Counter, defaultdict
+from logging.handlers import RotatingFileHandler
+
+
+def text_fingerprint(text):
+    """Short, stable hash so repeated texts can be spotted without storing them"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+class AzureLedger:
+    """Append-only JSONL record of every request sent to Azure, rotated by size"""
+
+    def __init__(self, path="data/azure_ledger.jsonl", max_bytes=20 * 1024 * 1024, backup_count=10,
+                 enabled=True):
+        self.enabled = enabled
+        if not enabled:
+            return
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # A dedicated logger gives us thread-safe writes and size-based rotation
+        self._logger = logging.getLogger(f"azure_ledger.{os.path.abspath(path)}")
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        if not self._logger.handlers:
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self._logger.addHandler(handler)
+
+    def record(self, target_lang, texts, latency, status, key_name):
+        """Log one request: its texts are stored only as (fingerprint, length) pairs"""
+        if not self.enabled:
+            return
+        try:
+            self._logger.info(json.dumps({
+                'ts': round(time.time(), 3),
+                'target_lang': target_lang,
+                'chars': sum(len(text) for text in texts),
+                'elements': len(texts),
+                'latency_ms': round(latency * 1000, 1),
+                'status': status,
+                'key_name': key_name,
+                'texts': [[text_fingerprint(text), len(text)] for text in texts]
+            }, ensure_ascii=False))
+        except Exception as e:
+            print(f"Error writing Azure ledger: {str(e)}")
+
+
+def read_ledger(path):
+    """Yield entries from a ledger and its rotated backups, oldest first"""
+    backups = sorted(
+        glob.glob(f"{glob.escape(path)}.*"),
+        key=lambda name: int(name.rsplit('.', 1)[1]) if name.rsplit('.', 1)[1].isdigit() else 0,
+        reverse=True
+    )
+    for file_path in backups + [path]:
+        if not os.path.exists(file_path):
+            continue
+        with open(file_path, 'r', encoding='utf-8') as ledger_file:
+            for line in ledger_file:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def analyze_ledger(entries):
+    """Summarize spend and waste from ledger entries"""
+    requests_count = 0
+    total_chars = 0
+    chars_per_request = []
+    elements_per_request = []
+    latencies = []
+    statuses = Counter()
+    by_language = defaultdict(int)
+    by_key_name = defaultdict(int)
+    seen_texts = Counter()
+    text_chars = {}
+
+    for entry in entries:
+        requests_count += 1
+        total_chars += entry['chars']
+        chars_per_request.append(entry['chars'])
+        elements_per_request.append(entry['elements'])
+        latencies.append(entry['latency_ms'])
+        statuses[str(entry['status'])] += 1
+        by_language[entry['target_lang']] += entry['chars']
+        by_key_name[entry.get('key_name') or 'unknown'] += entry['chars']
+        for fingerprint, length in entry.get('texts', []):
+            seen_texts[(fingerprint, entry['target_lang'])] += 1
+            text_chars[(fingerprint, entry['target_lang'])] = length
+
+    if not requests_count:
+        return {'requests': 0}
+
+    # Every repeat of the same text into the same language could have been a cache hit
+    repeats = {key: count for key, count in seen_texts.items() if count > 1}
+    redundant_chars = sum(text_chars[key] * (count - 1) for key, count in repeats.items())
+    throttled = statuses.get('429', 0)
+
+    return {
+        'requests': requests_count,
+        'chars': total_chars,
+        'chars_per_request_mean': statistics.mean(chars_per_request),
+        'chars_per_request_median': statistics.median(chars_per_request),
+        'elements_per_request_mean': statistics.mean(elements_per_request),
+        'latency_ms_median': statistics.median(latencies),
+        'statuses': dict(statuses),
+        'throttled': throttled,
+        'throttled_rate': throttled / requests_count,
+        'redundant_texts': len(repeats),
+        'redundant_requests': sum(count - 1 for count in repeats.values()),
+        'redundant_chars': redundant_chars,
+        'missed_cache_savings': redundant_chars / total_chars if total_chars else 0.0,
+        'top_repeats': Counter(repeats).most_common(10),
+        'by_language': dict(by_language),
+        'by_key_name': dict(by_key_name)
+    }
+
+
+def format_report(report):
+    if not report['requests']:
+        return "Ledger is empty"
+
+    lines = [
+        f"Requests:                {report['requests']:,}",
+        f"Characters sent:         {report['chars']:,}",
+        f"Chars/request:           mean {report['chars_per_request_mean']:.1f}, "
+        f"median {report['chars_per_request_median']:.0f}",
+        f"Elements/request:        mean {report['elements_per_request_mean']:.1f}",
+        f"Median latency:          {report['latency_ms_median']:.0f} ms",
+        f"Throttled (429):         {report['throttled']:,} ({report['throttled_rate']:.1%})",
+        f"Statuses:                {report['statuses']}",
+        "",
+        f"Texts sent more than once:  {report['redundant_texts']:,}",
+        f"Redundant requests:         {report['redundant_requests']:,}",
+        f"Redundant characters:       {report['redundant_chars']:,} "
+        f"({report['missed_cache_savings']:.1%} of spend a cache would have saved)",
+        "",
+        "Most repeated texts (fingerprint, language, times sent):"
+    ]
+    for (fingerprint, target_lang), count in report['top_repeats']:
+        lines.append(f"  {fingerprint}  {target_lang:6} {count:,}")
+
+    lines.append("")
+    lines.append("Characters by language:")
+    for target_lang, chars in sorted(report['by_language'].items(), key=lambda item: -item[1]):
+        lines.append(f"  {target_lang:6} {chars:,}")
+
+    lines.append("")
+    lines.append("Characters by key name:")
+    for key_name, chars in sorted(report['by_key_name'].items(), key=lambda item: -item[1]):
+        lines.append(f"  {key_name:20} {chars:,}")
+    return "\n".join(lines)
+
+
+def main():
+    """Command line usage: python azure_ledger.py [ledger_path]"""
+    path = sys.argv[1] if len(sys.argv) > 1 else "data/azure_ledger.jsonl"
+    if not os.path.exists(path):
+        print(f"Error: Ledger '{path}' not found")
+        sys.exit(1)
+    print(format_report(analyze_ledger(read_ledger(path))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""Multi-session load test for app.py
+
+Usage:
+    python benchmarks/load_test.py --users 20 --iterations 3
+    python benchmarks/load_test.py --users 50 --mode interactive --azure-latency-ms 150
+
+Every simulated user drives its own streamlit.testing AppTest session in a
+thread: it logs in with its own key, pastes a text and translates it, then
+polls until the result is shown. All sessions share this process, so they
+share the Translator singleton, the job workers and the Azure governor, like
+real users on one server. Azure is replaced by a local stub at the HTTP layer.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import types
+
+import psutil
+from streamlit.testing.v1 import AppTest
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+# template.html is opened relative to the working directory
+os.chdir(REPO_DIR)
+
+import requests
+import translator
+
+MODES = {
+    'standard': "Standard Translation",
+    'interactive': "Interactive Word-by-Word"
+}
+
+
+class StubResponse:
+    """Just enough of requests.Response for the Translator"""
+
+    def __init__(self, payload):
+        self.status_code = 200
+        self._payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._payload
+
+
+def install_azure_stub(latency):
+    """Answer Azure translate calls locally after a fixed latency"""
+    def post(url, params=None, headers=None, json=None, **kwargs):
+        time.sleep(latency)
+        return StubResponse([
+            {'translations': [{'text': f"[{params['to']}] {item['text']}", 'to': params['to']}]}
+            for item in json
+        ])
+    translator.requests = types.SimpleNamespace(post=post, exceptions=requests.exceptions)
+
+
+def make_secrets(users, data_dir):
+    return {
+        'admin_password': 'load-test-admin',
+        'api_keys': {f"load_user_{i}": f"load-key-{i}" for i in range(users)},
+        'user_tiers': {f"load_user_{i}": "premium" for i in range(0, users, 5)},
+        'usage_limits': {'default_daily_limit': 10_000_000, 'premium_daily_limit': 10_000_000},
+        'usage_store': {'backend': 'memory'},
+        'azure_ledger': {'enabled': False},
+        'translation_cache': {'path': os.path.join(data_dir, 'translations.db')},
+        'jobs': {'jobs_dir': os.path.join(data_dir, 'jobs')},
+        # Each run starts with an empty result store and no background translations
+        'result_store': {'directory': os.path.join(data_dir, 'results'), 'precompute_example': False}
+    }
+
+
+def find_button(at, label):
+    return next(button for button in at.button if button.label == label)
+
+
+class SessionResult:
+    def __init__(self):
+        self.latencies = []
+        self.errors = []
+
+
+def run_session(index, args, secrets, text, barrier, result):
+    """One user: log in, then translate args.iterations times"""
+    try:
+        at = AppTest.from_file(os.path.join(REPO_DIR, "app.py"), default_timeout=args.timeout)
+        for key, value in secrets.items():
+            at.secrets[key] = value
+        at.run()
+        at.text_input(key="user_key").input(f"load-key-{index}")
+        find_button(at, "Login").click()
+        at.run()
+    except Exception as e:
+        result.errors.append(f"login: {e}")
+        barrier.wait()
+        return
+
+    barrier.wait()
+    for iteration in range(args.iterations):
+        mode = MODES[args.mode] if args.mode != 'both' else list(MODES.values())[iteration % 2]
+        # Vary the text so the shared result store can't short-circuit the work
+        session_text = f"{text}\n第{index}位同学的第{iteration}次练习。"
+        started = time.perf_counter()
+        try:
+            at.radio[0].set_value(mode)
+            at.selectbox[0].set_value("Vietnamese")
+            at.text_area(key="simple_text_input").input(session_text)
+            at.button(key="translate_button").click()
+            at.run()
+            if at.exception:
+                raise RuntimeError(at.exception[0].message)
+            if at.error:
+                raise RuntimeError(at.error[0].value)
+
+            deadline = started + args.timeout
+            while 'last_translation' not in at.session_state:
+                if time.perf_counter() > deadline:
+                    raise TimeoutError("translation did not finish in time")
+                time.sleep(args.poll_interval)
+                at.run()
+                if at.error:
+                    raise RuntimeError(at.error[0].value)
+            result.latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            result.errors.append(f"{mode}: {e}")
+
+
+def sample_memory(stop, samples):
+    process = psutil.Process()
+    while not stop.is_set():
+        samples.append(process.memory_info().rss)
+        time.sleep(0.25)
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="Concurrent sessions")
+    parser.add_argument("--iterations", type=int, default=3, help="Translations per session")
+    parser.add_argument("--mode", choices=['standard', 'interactive', 'both'], default='both')
+    parser.add_argument("--corpus", default="news", help="Corpus in benchmarks/corpora to translate")
+    parser.add_argument("--azure-latency-ms", type=float, default=80, help="Simulated Azure round trip")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="Seconds between result polls")
+    parser.add_argument("--timeout", type=float, default=300, help="Per-translation timeout in seconds")
+    args = parser.parse_args()
+
+    with open(os.path.join(BENCH_DIR, "corpora", f"{args.corpus}.txt"), 'r', encoding='utf-8') as corpus_file:
+        text = corpus_file.read()
+
+    install_azure_stub(args.azure_latency_ms / 1000)
+    data_dir = tempfile.mkdtemp(prefix="translator-load-")
+    secrets = make_secrets(args.users, data_dir)
+
+    memory_samples = []
+    stop = threading.Event()
+    sampler = threading.Thread(target=sample_memory, args=(stop, memory_samples), daemon=True)
+    sampler.start()
+    rss_before = psutil.Process().memory_info().rss
+
+    results = [SessionResult() for _ in range(args.users)]
+    barrier = threading.Barrier(args.users + 1)
+    threads = [
+        threading.Thread(target=run_session, args=(i, args, secrets, text, barrier, results[i]))
+        for i in range(args.users)
+    ]
+    for thread in threads:
+        thread.start()
+
+    # Time only the translations, once every session has logged in
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    sampler.join()
+
+    latencies = [latency for result in results for latency in result.latencies]
+    errors = [error for result in results for error in result.errors]
+    attempts = len(latencies) + len(errors)
+    per_session = [statistics.mean(result.latencies) for result in results if result.latencies]
+
+    print(f"Sessions:            {args.users} ({args.mode} mode, {args.iterations} translations each)")
+    print(f"Completed:           {len(latencies)}/{attempts} in {elapsed:.1f} s")
+    print(f"Throughput:          {len(latencies) / elapsed:.2f} translations/s")
+    print(f"Error rate:          {len(errors) / attempts:.1%}" if attempts else "Error rate:          n/a")
+    if latencies:
+        print(f"Latency p50/p95/max: {percentile(latencies, 50):.2f} / {percentile(latencies, 95):.2f} / "
+              f"{max(latencies):.2f} s")
+        print(f"Per-session mean:    fastest {min(per_session):.2f} s, slowest {max(per_session):.2f} s")
+    print(f"Server RSS:          {rss_before / 2**20:,.0f} MB before, "
+          f"{max(memory_samples, default=rss_before) / 2**20:,.0f} MB peak")
+    for error in errors[:10]:
+        print(f"  error: {error}")
+
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
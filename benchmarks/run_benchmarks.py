@@ -0,0 +1,316 @@
+"""Micro-benchmarks for the translation pipeline hot paths
+
+Usage:
+    python benchmarks/run_benchmarks.py                 # run and compare with the baseline
+    python benchmarks/run_benchmarks.py --save          # run and store a new baseline
+    python benchmarks/run_benchmarks.py -k pinyin       # only benchmarks whose name contains "pinyin"
+
+Azure is replaced by an in-process stub, so the numbers measure our own code.
+The run fails (exit code 1) when a benchmark's median is slower than the
+baseline by more than --threshold percent, or when the pinyin table reads a
+sentence of the corpora differently from pypinyin. Baselines are machine
+specific.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import pypinyin
+from pypinyin.constants import PHRASES_DICT
+import streamlit as st
+
+# No secrets outside a Streamlit deployment; keep the ledger and the
+# persistent cache from touching files, so cold runs really are cold
+st.secrets = {"azure_ledger": {"enabled": False}, "translation_cache": {"enabled": False}}
+
+from translator import Translator, is_chinese_word
+from translate_book import (split_sentence, convert_to_pinyin, process_interactive_text,
+                            estimate_billable_characters, segment_paragraphs)
+from html_renderer import create_html_block, create_interactive_html_block
+from translation_memory import TranslationMemory
+from pinyin_table import get_pinyin_table
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+NOVEL_CHARS = 300_000
+# Distinct words the generated novel draws from, and the Zipf exponent of their frequencies
+NOVEL_VOCABULARY = 40_000
+ZIPF_EXPONENT = 1.05
+# Function words every Chinese text is full of; they head the frequency ranking
+COMMON_WORDS = (
+    "的 了 是 在 我 他 她 你 不 和 有 这 那 就 也 都 说 一个 没有 我们 他们 自己 什么 "
+    "时候 知道 还 又 着 把 被 对 到 去 来 上 下 里 看 想"
+).split()
+SENTENCE_ENDS = "。。。！？"
+# Translation memory sizes the lookup is timed at, and the near-duplicate queries per run
+MEMORY_SIZES = (1_000, 10_000, 100_000)
+MEMORY_QUERIES = 200
+
+
+class TextGenerator:
+    """Seeded Chinese text with a realistic vocabulary
+
+    Words come from pypinyin's phrase dictionary and are drawn with Zipf
+    distributed frequencies, so a longer text keeps meeting new words the
+    way a real novel does.
+    """
+
+    def __init__(self, seed=42, vocabulary_size=NOVEL_VOCABULARY):
+        self.rng = random.Random(seed)
+        phrases = sorted(
+            phrase for phrase in PHRASES_DICT
+            if 2 <= len(phrase) <= 4 and all('\u4e00' <= char <= '\u9fff' for char in phrase)
+        )
+        self.words = COMMON_WORDS + [
+            word for word in self.rng.sample(phrases, vocabulary_size) if word not in COMMON_WORDS
+        ]
+        self.cum_weights = list(itertools.accumulate(
+            1 / rank ** ZIPF_EXPONENT for rank in range(1, len(self.words) + 1)
+        ))
+
+    def sentence(self):
+        words = self.rng.choices(self.words, cum_weights=self.cum_weights, k=self.rng.randint(6, 20))
+        if len(words) > 10:
+            words.insert(self.rng.randint(4, len(words) - 4), "，")
+        return ''.join(words) + self.rng.choice(SENTENCE_ENDS)
+
+    def text(self, chars):
+        """Paragraphs of sentences, at least chars characters in all"""
+        paragraphs, length = [], 0
+        while length < chars:
+            paragraph = ''.join(self.sentence() for _ in range(self.rng.randint(2, 8)))
+            paragraphs.append(paragraph)
+            length += len(paragraph)
+        return "\n\n".join(paragraphs)
+
+    def distinct_sentences(self, count):
+        sentences = {}
+        while len(sentences) < count:
+            sentences[self.sentence()] = None
+        return list(sentences)
+
+
+def load_corpora():
+    """Fixed corpora: a short news item, a long article and a novel-sized text"""
+    corpora = {}
+    for name in ("news", "article"):
+        with open(os.path.join(BENCH_DIR, "corpora", f"{name}.txt"), 'r', encoding='utf-8') as corpus_file:
+            corpora[name] = corpus_file.read()
+
+    # The novel is generated, the same text on every run
+    corpora["novel"] = TextGenerator(seed=42).text(NOVEL_CHARS)
+    return corpora
+
+
+def describe_corpora(corpora):
+    """Size and unique Chinese words of each corpus, as the segmenter sees them"""
+    return {
+        name: {
+            'chars': len(text),
+            'unique_words': len(set(word for word in segment_paragraphs(text) if is_chinese_word(word)))
+        }
+        for name, text in corpora.items()
+    }
+
+
+def stub_translator():
+    """Translator whose Azure calls are answered in-process"""
+    translator = Translator()
+
+    def fake_batch(texts, target_lang):
+        return [f"[{target_lang}] {text}" for text in texts]
+
+    translator._call_azure_translate_batch = fake_batch
+    return translator
+
+
+def check_pinyin(corpora):
+    """Sentences of the fixed corpora the pinyin table reads differently from pypinyin.pinyin()"""
+    table = get_pinyin_table()
+    mismatches = []
+    for name in ("news", "article"):
+        for chunk in split_sentence(corpora[name]):
+            expected = (
+                ' '.join(item[0] for item in pypinyin.pinyin(chunk, style=pypinyin.TONE)),
+                ' '.join(item[0] for item in pypinyin.pinyin(chunk, style=pypinyin.TONE3))
+            )
+            if table.convert(chunk) != expected:
+                mismatches.append((name, chunk))
+    return mismatches
+
+
+def build_benchmarks(corpora):
+    translator = stub_translator()
+    article_chunks = split_sentence(corpora["article"])
+    standard_results = [
+        (i, chunk, convert_to_pinyin(chunk), f"[en] {chunk}", f"[vi] {chunk}")
+        for i, chunk in enumerate(article_chunks)
+    ]
+    translator.translated_words.clear()
+    article_words = process_interactive_text(corpora["article"], "vi")
+
+    def cold(fn):
+        # Start every iteration with an empty translation cache
+        def run():
+            translator.translated_words.clear()
+            fn()
+        return run
+
+    benchmarks = {}
+    for name, text in corpora.items():
+        benchmarks[f"split_sentence[{name}]"] = lambda text=text: split_sentence(text)
+        # The estimate the app bills against before a job is queued
+        benchmarks[f"estimate_billable_characters[{name},cold]"] = cold(
+            lambda text=text: estimate_billable_characters(text, True, "vi")
+        )
+    for style in ("tone_marks", "tone_numbers"):
+        benchmarks[f"convert_to_pinyin[article,{style}]"] = (
+            lambda style=style: [convert_to_pinyin(chunk, style) for chunk in article_chunks]
+        )
+    benchmarks["create_html_block[article]"] = (
+        lambda: [create_html_block(result, True) for result in standard_results]
+    )
+    benchmarks["create_interactive_html_block[article]"] = (
+        lambda: create_interactive_html_block((None, article_words), False)
+    )
+    for name in ("news", "article"):
+        text = corpora[name]
+        benchmarks[f"process_chinese_text[{name},cold]"] = cold(
+            lambda text=text: translator.process_chinese_text(text, "vi")
+        )
+        benchmarks[f"process_chinese_text[{name},warm]"] = (
+            lambda text=text: translator.process_chinese_text(text, "vi")
+        )
+    benchmarks["process_interactive_text[novel,cold]"] = cold(
+        lambda: process_interactive_text(corpora["novel"], "vi")
+    )
+
+    # Distinct generated sentences, so lookup cost is measured against memory size
+    generator = TextGenerator(seed=7)
+    sentences = generator.distinct_sentences(max(MEMORY_SIZES))
+    for size in MEMORY_SIZES:
+        memory = TranslationMemory(max_entries=size)
+        for sentence in sentences[:size]:
+            memory.add(sentence, "vi", f"[vi] {sentence}")
+        # Near-duplicates: stored sentences with the punctuation dropped and one character added
+        stored = generator.rng.sample(sentences[:size], MEMORY_QUERIES)
+        queries = [sentence.rstrip("。！？") + "了" for sentence in stored]
+        benchmarks[f"translation_memory.lookup[{size:,} sentences]"] = (
+            lambda memory=memory, queries=queries: [memory.lookup(query, "vi") for query in queries]
+        )
+    return benchmarks
+
+
+def measure(fn, min_time=0.2, repeats=5):
+    """Median and best seconds per call over several timed rounds"""
+    fn()  # warm up
+
+    # Pick a loop count so each round takes at least min_time
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1_000_000:
+            break
+        loops *= 2 if elapsed == 0 else max(2, int(min_time / elapsed) + 1)
+
+    rounds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        rounds.append((time.perf_counter() - start) / loops)
+    return {'median': statistics.median(rounds), 'best': min(rounds), 'loops': loops}
+
+
+def machine_info():
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'node': platform.node()
+    }
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("µs", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:8.2f} {unit}"
+    return f"{seconds / 1e-9:8.0f} ns"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--save", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=15.0,
+                        help="Allowed slowdown of the median, in percent (default: 15)")
+    parser.add_argument("-k", dest="keyword", default="", help="Only run benchmarks containing this text")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Minimum seconds per timed round")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline, 'r', encoding='utf-8') as baseline_file:
+            saved = json.load(baseline_file)
+        baseline = saved.get('results', {})
+        if saved.get('machine') != machine_info():
+            print("Warning: baseline was recorded on a different machine or Python version")
+
+    corpora = load_corpora()
+    corpus_info = describe_corpora(corpora)
+    for name, info in corpus_info.items():
+        print(f"Corpus {name}: {info['chars']:,} characters, {info['unique_words']:,} unique words")
+    if baseline and saved.get('corpora') != corpus_info:
+        print("Warning: baseline was recorded on different corpora")
+    # The fast path is only worth measuring while it gives pypinyin's answers
+    mismatches = check_pinyin(corpora)
+    for name, chunk in mismatches:
+        print(f"Pinyin differs from pypinyin [{name}]: {chunk}")
+
+    results = {}
+    regressions = []
+    for name, fn in build_benchmarks(corpora).items():
+        if args.keyword not in name:
+            continue
+        result = measure(fn, min_time=args.min_time)
+        results[name] = result
+
+        line = f"{name:48} {format_time(result['median'])}  (best {format_time(result['best']).strip()})"
+        if name in baseline:
+            change = (result['median'] / baseline[name]['median'] - 1) * 100
+            line += f"  {change:+6.1f}%"
+            if change > args.threshold:
+                line += "  REGRESSION"
+                regressions.append(name)
+        print(line)
+
+    if args.save:
+        with open(args.baseline, 'w', encoding='utf-8') as baseline_file:
+            json.dump({'machine': machine_info(), 'corpora': corpus_info, 'results': results},
+                      baseline_file, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) slower than baseline by more than {args.threshold:.0f}%:")
+        for name in regressions:
+            print(f"  {name}")
+    if mismatches:
+        print(f"\n{len(mismatches)} sentence(s) where the pinyin table disagrees with pypinyin")
+    if regressions or mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import threading
+import time
+
+# Breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Stops calling a failing service and probes it until it recovers
+
+    After failure_threshold consecutive failures the breaker opens and
+    allow_request() refuses calls, so callers fail fast. Once reset_timeout
+    seconds have passed it goes half-open and lets a single probe through:
+    a success closes it, a failure opens it again. A probe whose outcome is
+    never recorded expires after another reset_timeout.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probe_started = None
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and now - self._opened_at >= self.reset_timeout:
+                self._state = HALF_OPEN
+                self._probe_started = None
+            if self._state == HALF_OPEN and (
+                self._probe_started is None or now - self._probe_started >= self.reset_timeout
+            ):
+                self._probe_started = now
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                print("Azure circuit breaker closed")
+            self._state = CLOSED
+            self._failures = 0
+            self._opened_at = None
+            self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or (
+                self._state == CLOSED and self._failures >= self.failure_threshold
+            ):
+                if self._state == CLOSED:
+                    print(f"Azure circuit breaker opened after {self._failures} consecutive failures")
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._probe_started = None
+
+    def retry_in(self):
+        """Seconds until a request would be let through again (0 if now)"""
+        with self._lock:
+            if self._state == CLOSED:
+                return 0.0
+            if self._state == OPEN:
+                return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+            if self._probe_started is None:
+                return 0.0
+            return max(0.0, self._probe_started + self.reset_timeout - time.monotonic())
+
+    def stats(self):
+        retry_in = self.retry_in()
+        with self._lock:
+            return {
+                'state': self._state,
+                'consecutive_failures': self._failures,
+                'rejected': self._rejected,
+                'retry_in': retry_in
+            }
@@ -0,0 +1,140 @@
+import html
+import json
+from functools import lru_cache
+
+import streamlit as st
+
+from perf_stats import timed
+from word_document import WordDocument
+
+TEMPLATE_PATH = 'template.html'
+CONTENT_PLACEHOLDER = '{{content}}'
+
+SPEAK_BUTTON = '''
+        <button class="speak-button" onclick="speakSentence(this.parentElement.textContent.replace('🔊', ''))">
+            <svg viewBox="0 0 24 24">
+                <path d="M3 9v6h4l5 5V4L7 9H3zm13.5 3c0-1.77-1.02-3.29-2.5-4.03v8.05c1.48-.73 2.5-2.25 2.5-4.02zM14 3.23v2.06c2.89.86 5 3.54 5 6.71s-2.11 5.85-5 6.71v2.06c4.01-.91 7-4.49 7-8.77s-2.99-7.86-7-8.77z"/>
+            </svg>
+        </button>
+    '''
+
+
+@lru_cache(maxsize=None)
+def load_template() -> str:
+    """template.html with the speech server URL filled in, read once per process"""
+    with open(TEMPLATE_PATH, 'r', encoding='utf-8') as template_file:
+        template = template_file.read()
+    tts_url = st.secrets.get("tts_server", {}).get("url", "").rstrip('/')
+    # Embedded in a JavaScript string literal
+    return template.replace('{{tts_server_url}}', json.dumps(tts_url)[1:-1])
+
+
+@lru_cache(maxsize=None)
+def template_parts():
+    """The template split around its content placeholder: (prefix, suffix)"""
+    prefix, suffix = load_template().split(CONTENT_PLACEHOLDER, 1)
+    return prefix, suffix
+
+
+class PageWriter:
+    """Collects content blocks and joins them into a page once, in linear time"""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, block):
+        self._parts.append(block)
+
+    def content(self):
+        return ''.join(self._parts)
+
+    def getvalue(self):
+        prefix, suffix = template_parts()
+        return ''.join([prefix, *self._parts, suffix])
+
+
+def render_page(content: str) -> str:
+    """A full page around already rendered content"""
+    prefix, suffix = template_parts()
+    return ''.join([prefix, content, suffix])
+
+
+def escape_text(text) -> str:
+    """Escape text placed between tags; quotes are left alone"""
+    return html.escape(str(text), quote=False)
+
+
+def escape_attribute(text) -> str:
+    """Escape text placed in a double-quoted attribute"""
+    return escape_text(text).replace('"', '&quot;')
+
+
+def escape_js_string(text) -> str:
+    """Escape text placed in a single-quoted JavaScript string inside an attribute"""
+    return escape_attribute(str(text).replace('\\', '\\\\').replace("'", "\\'"))
+
+
+@timed('html.standard_block')
+def create_html_block(results: tuple, include_english: bool) -> str:
+    """HTML for one sentence: the original, its pinyin and translations"""
+    if include_english:
+        index, chunk, pinyin, english, second = results
+        return f'''
+            <div class="sentence-part responsive">
+                <div class="original">{index + 1}. {escape_text(chunk)}{SPEAK_BUTTON}</div>
+                <div class="pinyin">{escape_text(pinyin)}</div>
+                <div class="english">{escape_text(english)}</div>
+                <div class="second-language">{escape_text(second)}</div>
+            </div>
+        '''
+    else:
+        index, chunk, pinyin, second = results
+        return f'''
+            <div class="sentence-part responsive">
+                <div class="original">{index + 1}. {escape_text(chunk)}{SPEAK_BUTTON}</div>
+                <div class="pinyin">{escape_text(pinyin)}</div>
+                <div class="second-language">{escape_text(second)}</div>
+            </div>
+        '''
+
+
+@timed('html.interactive_block')
+def create_interactive_html_block(results: tuple, include_english: bool) -> str:
+    """Create HTML for interactive word-by-word translation"""
+    chunk, word_data = results
+    if not isinstance(word_data, WordDocument):
+        word_data = WordDocument.from_records(word_data)
+
+    # 每个词的HTML只生成一次，重复出现时直接复用
+    word_html = [None] * len(word_data.words)
+    parts = ['<div class="interactive-text">']
+
+    # 生成每个段落的HTML
+    for paragraph in word_data.paragraphs():
+        parts.append('<p class="interactive-paragraph">')
+        for word_id in paragraph:
+            block = word_html[word_id]
+            if block is None:
+                block = word_html[word_id] = create_word_html(
+                    word_data.words[word_id],
+                    word_data.pinyins[word_id],
+                    word_data.translations[word_id]
+                )
+            parts.append(block)
+        parts.append('</p>')
+
+    parts.append('</div>')
+    return ''.join(parts)
+
+
+def create_word_html(word: str, pinyin: str, translations) -> str:
+    """HTML for one word of an interactive document"""
+    if translations:
+        tooltip_content = escape_attribute(f"{pinyin}\n{translations[-1]}")
+        return f'''
+                    <span class="interactive-word" 
+                          onclick="speak('{escape_js_string(word)}')"
+                          data-tooltip="{tooltip_content}">
+                        {escape_text(word)}
+                    </span>'''
+    return f'<span class="non-chinese">{escape_text(word)}</span>'
@@ -0,0 +1,396 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from translate_book import (translate_document, request_speech_pregeneration, speech_texts,
+                            speech_pregeneration_enabled)
+from translation_context import TranslationContext, TranslationCancelled, CancellationToken, use_context
+from usage_meter import QuotaExceededError
+from profiling import profile_call, profiling_switch
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+
+class TranslationJob:
+    """A translation request running outside the Streamlit script thread"""
+
+    def __init__(self, owner, text, options, result_key, job_id=None, tier="default", meter=None,
+                 profile=False, previous=None):
+        self.id = job_id or uuid.uuid4().hex
+        # Checked before every Azure request; also expires at the job's deadline,
+        # which starts when a worker picks the job up
+        self.cancel_token = CancellationToken()
+        self.owner = owner
+        self.tier = tier
+        self.meter = meter
+        self.profile = profile
+        # DocumentResults of the text this one was edited from, and this job's own
+        self.previous = previous
+        self.document = None
+        # time.monotonic() after which the document is dropped if nobody took it
+        self.document_expires = None
+        self.chars_charged = 0
+        # A str, or an IngestedText for a large upload read from disk
+        self.text = text
+        self.chars = len(text)
+        self.options = options
+        self.result_key = result_key
+        self.status = QUEUED
+        self.progress = 0.0
+        self.error = None
+        self.created_at = datetime.now().isoformat(timespec='seconds')
+        self.finished_at = None
+
+    @property
+    def is_active(self):
+        return self.status in ACTIVE_STATES
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'owner': self.owner,
+            'tier': self.tier,
+            'options': self.options,
+            'result_key': self.result_key,
+            'status': self.status,
+            'progress': self.progress,
+            'error': self.error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'chars': self.chars,
+            'chars_charged': self.meter.charged if self.meter else self.chars_charged
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(data['owner'], "", data['options'], data['result_key'],
+                  job_id=data['id'], tier=data.get('tier', "default"))
+        job.chars = data.get('chars', 0)
+        job.chars_charged = data.get('chars_charged', 0)
+        job.status = data['status']
+        job.progress = data['progress']
+        job.error = data.get('error')
+        job.created_at = data['created_at']
+        job.finished_at = data.get('finished_at')
+        return job
+
+
+class JobManager:
+    """Runs translation jobs on a bounded worker pool and persists their state
+
+    Job metadata and progress are written to `jobs_dir/<id>.json`, so a
+    browser tab can disconnect and reattach later, and finished jobs survive a
+    restart. The finished HTML is served from the result store; only a page
+    the store doesn't take (one with failed translations, or no store at all)
+    is kept as `jobs_dir/<id>.html`. Finished jobs are forgotten, files and
+    all, after job_retention seconds or once a user has more than
+    kept_jobs_per_user of them. A finished job's DocumentResults waits for
+    take_document for at most document_ttl seconds, and only until the same
+    user's next job finishes.
+    """
+
+    def __init__(self, jobs_dir="data/jobs", max_concurrent_jobs=8, max_jobs_per_user=5,
+                 result_store=None, job_timeout=3600, job_retention=7 * 24 * 3600,
+                 kept_jobs_per_user=10, document_ttl=900):
+        self.jobs_dir = jobs_dir
+        self.max_jobs_per_user = max_jobs_per_user
+        self.job_timeout = job_timeout
+        self.job_retention = job_retention
+        self.kept_jobs_per_user = kept_jobs_per_user
+        self.document_ttl = document_ttl
+        self.result_store = result_store
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_jobs,
+            thread_name_prefix="translation-job"
+        )
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self._load_jobs()
+
+    def submit(self, owner, text, options, result_key, tier="default", meter=None, profile=False,
+               previous=None):
+        """Queue a translation and return its job id
+
+        An identical request that is already queued or running is reused
+        instead of being translated twice. With a UsageMeter, characters are
+        charged as they go to Azure and the job stops when the quota runs out.
+        With profile=True the job runs under the profiler and its report is
+        handed to profiling_switch; profile can also be a callable, called with
+        the owner only when a new job is created. `previous` is the DocumentResults of an
+        earlier version of the text; only changed sentences are translated.
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if job.owner == owner and job.result_key == result_key and job.is_active:
+                    return job.id
+
+            active = sum(1 for job in self._jobs.values() if job.owner == owner and job.is_active)
+            if active >= self.max_jobs_per_user:
+                raise RuntimeError(
+                    f"You already have {active} translations in progress. "
+                    "Please wait for one to finish."
+                )
+
+            if callable(profile):
+                profile = profile(owner)
+            job = TranslationJob(owner, text, options, result_key, tier=tier, meter=meter,
+                                 profile=profile, previous=previous)
+            self._jobs[job.id] = job
+
+        self._save(job)
+        self._executor.submit(self._run, job)
+        return job.id
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def list_jobs(self, owner):
+        """Jobs for one user, newest first"""
+        now = time.monotonic()
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.owner == owner]
+            for job in jobs:
+                if job.document is not None and now > job.document_expires:
+                    job.document = None
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
+
+    def get_result(self, job_id):
+        """Return the finished HTML for a job, or None once it's no longer stored"""
+        job = self.get(job_id)
+        if job is None or job.status != COMPLETED:
+            return None
+
+        # The job's own copy comes first: it's only there when the store doesn't have the page
+        try:
+            with open(self._path(job_id, 'html'), 'r', encoding='utf-8') as result_file:
+                return result_file.read()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error reading result for job {job_id}: {str(e)}")
+
+        if self.result_store is not None:
+            return self.result_store.get(job.result_key)
+        return None
+
+    def has_result(self, job_id):
+        """Whether a finished job's HTML can still be shown"""
+        job = self.get(job_id)
+        if job is None or job.status != COMPLETED:
+            return False
+        if os.path.exists(self._path(job_id, 'html')):
+            return True
+        return self.result_store is not None and job.result_key in self.result_store
+
+    def cancel(self, job_id, reason="Cancelled"):
+        """Stop a queued or running job; its workers stop before their next Azure request"""
+        job = self.get(job_id)
+        if job is not None and job.is_active:
+            job.cancel_token.cancel(reason)
+
+    def cancel_owner(self, owner, reason="Cancelled"):
+        """Stop every active job of one user, e.g. on logout"""
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.owner == owner and job.is_active]
+        for job in jobs:
+            job.cancel_token.cancel(reason)
+
+    def take_document(self, job_id):
+        """Hand over a finished job's DocumentResults, once, unless it has expired"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        with self._lock:
+            document, job.document = job.document, None
+        if document is not None and time.monotonic() > job.document_expires:
+            return None
+        return document
+
+    def _run(self, job):
+        if job.cancel_token.cancelled:
+            # Cancelled while it was still queued
+            job.status = CANCELLED
+            job.error = job.cancel_token.reason
+            job.text = ""
+            job.previous = None
+            job.finished_at = datetime.now().isoformat(timespec='seconds')
+            self._save(job)
+            return
+
+        # Time spent waiting for a worker doesn't count against job_timeout
+        job.cancel_token.start_deadline(self.job_timeout)
+        job.status = RUNNING
+        self._save(job)
+        last_saved = time.monotonic()
+
+        def update_progress(progress):
+            nonlocal last_saved
+            job.progress = min(100.0, float(progress))
+            # Persist progress at most once per second
+            if time.monotonic() - last_saved >= 1:
+                last_saved = time.monotonic()
+                self._save(job)
+
+        try:
+            # Azure requests made by this job are scheduled under its owner and tier
+            with use_context(TranslationContext(job.owner, job.tier, meter=job.meter,
+                                                cancel_token=job.cancel_token)):
+                if job.profile:
+                    html_content, document = self._run_profiled(job, update_progress)
+                else:
+                    html_content, document = translate_document(
+                        job.text, update_progress, previous=job.previous, **job.options
+                    )
+            # A page with failed translations is only kept for this job, so the
+            # next request for the same text translates it again
+            if self.result_store is not None and document.failures == 0:
+                self.result_store.put(job.result_key, html_content)
+            else:
+                self._write_result(job, html_content)
+            # Sentences and words the page can read aloud; segmenting again is only
+            # worth it when there's a speech server to send them to
+            spoken_texts = speech_texts(
+                job.text, job.options.get('translation_mode', "Standard Translation")
+            ) if speech_pregeneration_enabled() else []
+            self._keep_document(job, document)
+            job.progress = 100.0
+            job.status = COMPLETED
+        except QuotaExceededError as e:
+            print(f"Job {job.id} stopped: {str(e)}")
+            job.error = f"{str(e)}. Please try again tomorrow."
+            job.status = FAILED
+        except TranslationCancelled as e:
+            print(f"Job {job.id} cancelled: {str(e)}")
+            if job.cancel_token.expired:
+                job.error = f"Took longer than {self.job_timeout // 60} minutes"
+                job.status = FAILED
+            else:
+                job.error = str(e)
+                job.status = CANCELLED
+        except Exception as e:
+            print(f"Job {job.id} failed: {str(e)}")
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished_at = datetime.now().isoformat(timespec='seconds')
+            # The source text is no longer needed once the job has finished
+            job.text = ""
+            job.previous = None
+            self._save(job)
+        self._prune()
+
+        if job.status == COMPLETED and spoken_texts:
+            # Warm the speech server's cache so the first click plays straight away
+            request_speech_pregeneration(spoken_texts)
+
+    def _keep_document(self, job, document):
+        """Hold a finished job's document, dropping the ones of the owner's earlier jobs"""
+        with self._lock:
+            for other in self._jobs.values():
+                if other.owner == job.owner and other is not job:
+                    other.document = None
+            job.document = document
+            job.document_expires = time.monotonic() + self.document_ttl
+
+    def _run_profiled(self, job, update_progress):
+        label = f"{job.owner} · {job.options.get('translation_mode', '')} · {job.chars:,} characters"
+        try:
+            (html_content, document), report = profile_call(
+                label, translate_document, job.text, update_progress, previous=job.previous, **job.options
+            )
+        except Exception as e:
+            report = getattr(e, 'profile_report', None)
+            if report is not None:
+                profiling_switch.add_report(report)
+            raise
+        profiling_switch.add_report(report)
+        return html_content, document
+
+    def _path(self, job_id, extension):
+        return os.path.join(self.jobs_dir, f"{job_id}.{extension}")
+
+    def _write_result(self, job, html_content):
+        path = self._path(job.id, 'html')
+        with open(path + '.tmp', 'w', encoding='utf-8') as result_file:
+            result_file.write(html_content)
+        os.replace(path + '.tmp', path)
+
+    def _save(self, job):
+        path = self._path(job.id, 'json')
+        try:
+            with open(path + '.tmp', 'w', encoding='utf-8') as job_file:
+                json.dump(job.to_dict(), job_file, ensure_ascii=False)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print(f"Error saving job {job.id}: {str(e)}")
+
+    def _load_jobs(self):
+        """Reload persisted jobs; anything unfinished was interrupted by a restart"""
+        for file_name in os.listdir(self.jobs_dir):
+            if not file_name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.jobs_dir, file_name), 'r', encoding='utf-8') as job_file:
+                    job = TranslationJob.from_dict(json.load(job_file))
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Error loading job {file_name}: {str(e)}")
+                continue
+
+            if job.is_active:
+                job.status = FAILED
+                job.error = "Interrupted by a server restart"
+                self._save(job)
+            self._jobs[job.id] = job
+
+        self._prune()
+        # Results of jobs that are gone, e.g. left by a crash in the middle of a prune
+        for file_name in os.listdir(self.jobs_dir):
+            job_id = file_name.split('.', 1)[0]
+            if file_name.endswith(('.html', '.tmp')) and job_id not in self._jobs:
+                self._remove_files(job_id)
+
+    def _prune(self):
+        """Forget finished jobs past the retention age or the per-user limit, and delete their files
+
+        Documents nobody took within document_ttl are dropped as well.
+        """
+        cutoff = (datetime.now() - timedelta(seconds=self.job_retention)).isoformat(timespec='seconds')
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            finished = {}
+            for job in self._jobs.values():
+                if job.document is not None and now > job.document_expires:
+                    job.document = None
+                if not job.is_active:
+                    finished.setdefault(job.owner, []).append(job)
+            for jobs in finished.values():
+                jobs.sort(key=lambda job: job.created_at, reverse=True)
+                for index, job in enumerate(jobs):
+                    if index >= self.kept_jobs_per_user or (job.finished_at or job.created_at) < cutoff:
+                        del self._jobs[job.id]
+                        expired.append(job.id)
+
+        for job_id in expired:
+            self._remove_files(job_id)
+
+    def _remove_files(self, job_id):
+        for extension in ('json', 'html', 'json.tmp', 'html.tmp'):
+            try:
+                os.remove(self._path(job_id, extension))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Error removing {extension} file of job {job_id}: {str(e)}")
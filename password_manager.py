@@ -10,92 +10,152 @@
 import time
 import plotly.graph_objects as go
 import pandas as pd
-from collections import defaultdict
 import jieba
 from pypinyin import pinyin, Style
 import requests
+from usage_meter import UsageMeter
+from usage_store import create_usage_store
+
+
+# Seconds before the key index is rebuilt to pick up changed secrets
+KEY_INDEX_TTL = 60
+
+
+@st.cache_resource
+def get_usage_store():
+    """Process-level usage store configured by the [usage_store] secrets section"""
+    return create_usage_store(st.secrets.get("usage_store", {}))
+
+
+def hash_key(key):
+    """SHA-256 digest of an access key; only digests are kept in memory and session state"""
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class KeyRecord:
+    """What an access key resolves to"""
+
+    __slots__ = ('digest', 'key_name', 'tier', 'daily_limit', 'is_admin')
+
+    def __init__(self, digest, key_name, tier, daily_limit, is_admin=False):
+        self.digest = digest
+        self.key_name = key_name
+        self.tier = tier
+        self.daily_limit = daily_limit
+        self.is_admin = is_admin
+
+
+class KeyIndex:
+    """Access keys from secrets, indexed by digest for single-lookup authentication"""
+
+    def __init__(self, api_keys, admin_password, user_tiers, default_limit, premium_limit):
+        self._records = {}
+        for key_name, key_value in api_keys.items():
+            if not key_value:
+                continue
+            tier = user_tiers.get(key_name, "default")
+            digest = hash_key(key_value)
+            self._records[digest] = KeyRecord(
+                digest,
+                key_name,
+                tier,
+                premium_limit if tier == "premium" else default_limit
+            )
+        # Admin gets premium tier and limit
+        if admin_password:
+            digest = hash_key(admin_password)
+            self._records[digest] = KeyRecord(digest, "admin", "premium", premium_limit, is_admin=True)
+
+    def authenticate(self, key):
+        """Return the record for a plaintext key, or None
+
+        The dict lookup isn't constant-time, but it compares SHA-256 digests:
+        how long it takes says nothing an attacker can steer towards a valid key.
+        """
+        if not key:
+            return None
+        return self._records.get(hash_key(key))
+
+    def record_for_digest(self, digest):
+        """Return the record for a key digest kept in session state, or None
+
+        Never call it with user input: that would make a digest a credential.
+        """
+        return self._records.get(digest) if digest else None
+
+
+@st.cache_resource(ttl=KEY_INDEX_TTL)
+def get_key_index():
+    """Process-level key index, rebuilt from secrets every KEY_INDEX_TTL seconds"""
+    usage_limits = st.secrets.get("usage_limits", {})
+    return KeyIndex(
+        api_keys=st.secrets.get("api_keys", {}),
+        admin_password=st.secrets.get("admin_password"),
+        user_tiers=st.secrets.get("user_tiers", {}),
+        default_limit=usage_limits.get("default_daily_limit", 30000),
+        premium_limit=usage_limits.get("premium_daily_limit", 50000)
+    )
 
 
 class PasswordManager:
     def __init__(self):
-        # Get API keys and their metadata from secrets
-        self.api_keys = st.secrets.get("api_keys", {})
-        self.user_tiers = st.secrets.get("user_tiers", {})
+        # Access keys are resolved through a shared, hashed index
+        self.key_index = get_key_index()
         self.default_limit = st.secrets.get("usage_limits", {}).get("default_daily_limit", 30000)
-        self.premium_limit = st.secrets.get("usage_limits", {}).get("premium_daily_limit", 50000)
         
-        # Initialize usage tracking in session state if not exists
-        if 'usage_tracking' not in st.session_state:
-            st.session_state.usage_tracking = {}
-            
-        # Add key name mapping in session state
-        if 'key_name_mapping' not in st.session_state:
-            st.session_state.key_name_mapping = {}
+        # Usage lives in a store shared by every session and kept across restarts
+        self.usage_store = get_usage_store()
+
+    def authenticate(self, password):
+        """Return the key record for a valid plaintext password, or None"""
+        return self.key_index.authenticate(password)
+
+    def record_for_digest(self, user_key):
+        """Return the record of a logged-in user
+
+        user_key here and in the methods below is the record.digest stored in
+        session state at login, never a key typed by the user.
+        """
+        return self.key_index.record_for_digest(user_key)
             
     def check_password(self, password):
-        """Check if password is valid and map key name"""
-        if not password:  # Handle empty password
-            return False
-        
-        # Get admin password and api keys
-        admin_pwd = st.secrets.get("admin_password")
-        api_keys = st.secrets.get("api_keys", {})
-        
-        # For admin login
-        if password == admin_pwd and self.is_admin(password):
-            st.session_state.key_name_mapping[password] = "admin"
-            return True
+        """Check if password is valid"""
+        return self.authenticate(password) is not None
         
-        # For regular user login - check value and store key name
-        for key_name, key_value in api_keys.items():
-            if password == key_value:
-                # Store the mapping of value to key name
-                st.session_state.key_name_mapping[password] = key_name
-                return True
-                
-        return False
-        
-    def is_admin(self, password):
+    def is_admin(self, user_key):
         """Check if the user is admin"""
-        admin_pwd = st.secrets.get("admin_password")
-        if not admin_pwd or not password:  # Handle empty passwords
-            return False
-        return password == admin_pwd
+        record = self.record_for_digest(user_key)
+        return record is not None and record.is_admin
 
     def get_user_limit(self, user_key):
         """Get daily limit for a user based on their tier"""
-        if not user_key:  # Handle empty key
-            return self.default_limit
-            
-        # Admin gets premium limit
-        if user_key == st.secrets.get("admin_password"):
-            return self.premium_limit
-            
-        # Get user's key name
-        key_name = self.get_key_name(user_key)
-        
-        # Check user's tier
-        user_tier = self.user_tiers.get(key_name, "default")
-        
-        # Return limit based on tier
-        if user_tier == "premium":
-            return self.premium_limit
-        return self.default_limit
-
-    def get_usage_stats(self):
-        """Get usage statistics for admin view"""
-        stats = {
-            'total_users': len(st.session_state.usage_tracking),
-            'daily_stats': defaultdict(int),
-            'user_stats': defaultdict(lambda: defaultdict(int))
+        record = self.record_for_digest(user_key)
+        return record.daily_limit if record else self.default_limit
+
+    def get_user_tier(self, user_key):
+        """Get a user's tier; admin counts as premium"""
+        record = self.record_for_digest(user_key)
+        return record.tier if record else "default"
+
+    def get_usage_overview(self):
+        """Totals for the admin dashboard, read from pre-aggregated rollups"""
+        daily_totals = self.usage_store.get_daily_totals()
+        return {
+            'total_users': self.usage_store.count_users(),
+            'total_chars': sum(daily_totals.values()),
+            'daily_totals': daily_totals
         }
-        
-        for user, data in st.session_state.usage_tracking.items():
-            for date, count in data.items():
-                stats['daily_stats'][date] += count
-                stats['user_stats'][user][date] = count
-                
-        return stats
+
+    def get_user_usage_page(self, search="", page=0, page_size=20):
+        """One page of per-user totals plus the number of matching users"""
+        return (
+            self.usage_store.get_user_totals(search, offset=page * page_size, limit=page_size),
+            self.usage_store.count_users(search)
+        )
+
+    def get_user_usage_history(self, key_name):
+        """Daily usage for a single user"""
+        return self.usage_store.get_user_usage(key_name)
 
     def check_usage_limit(self, user_key, new_chars_count):
         """Check if user has exceeded their daily limit"""
@@ -103,31 +163,17 @@ def check_usage_limit(self, user_key, new_chars_count):
         daily_limit = self.get_user_limit(user_key)
         return current_usage + new_chars_count <= daily_limit
 
-    def track_usage(self, user_key, chars_count):
-        """Track translation usage for a user using key name"""
-        if not user_key:
-            return
-            
-        # Use key name instead of password value for tracking
-        key_name = self.get_key_name(user_key)
-        today = datetime.now().date().isoformat()
-        
-        if key_name not in st.session_state.usage_tracking:
-            st.session_state.usage_tracking[key_name] = {}
-            
-        if today not in st.session_state.usage_tracking[key_name]:
-            st.session_state.usage_tracking[key_name][today] = 0
-            
-        st.session_state.usage_tracking[key_name][today] += chars_count
-        
     def get_daily_usage(self, user_key):
         """Get user's translation usage for today using key name"""
         key_name = self.get_key_name(user_key)
         today = datetime.now().date().isoformat()
-        if key_name not in st.session_state.usage_tracking:
-            return 0
-        return st.session_state.usage_tracking[key_name].get(today, 0)
+        return self.usage_store.get_usage(key_name, today)
+
+    def create_usage_meter(self, user_key):
+        """Meter that charges the user's daily quota as text is sent to Azure"""
+        return UsageMeter(self.usage_store, self.get_key_name(user_key), self.get_user_limit(user_key))
 
-    def get_key_name(self, password):
-        """Get the key name for a password"""
-        return st.session_state.key_name_mapping.get(password, password)
+    def get_key_name(self, user_key):
+        """Get the key name for a user key"""
+        record = self.record_for_digest(user_key)
+        return record.key_name if record else "unknown"
@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ContextDecorator
+
+# Most recent samples kept per stage for percentiles
+SAMPLE_SIZE = 2048
+
+
+class PerfStats:
+    """In-process timing histograms and counters for the translation pipeline"""
+
+    def __init__(self, sample_size=SAMPLE_SIZE):
+        self._samples = defaultdict(lambda: deque(maxlen=sample_size))
+        self._counts = defaultdict(int)
+        self._totals = defaultdict(float)
+        self._counters = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self._samples[stage].append(seconds)
+            self._counts[stage] += 1
+            self._totals[stage] += seconds
+
+    def increment(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] += amount
+
+    def get_counter(self, counter):
+        with self._lock:
+            return self._counters.get(counter, 0)
+
+    def cache_hit_rate(self):
+        """Share of translation lookups served from cache, or None before any lookup"""
+        with self._lock:
+            hits = self._counters.get('cache_hits', 0)
+            misses = self._counters.get('cache_misses', 0)
+        return hits / (hits + misses) if hits + misses else None
+
+    def summary(self):
+        """Per-stage count, mean, p50 and p95 in milliseconds"""
+        with self._lock:
+            stages = {stage: sorted(samples) for stage, samples in self._samples.items()}
+            counts = dict(self._counts)
+            totals = dict(self._totals)
+
+        rows = []
+        for stage, samples in sorted(stages.items()):
+            if not samples:
+                continue
+            rows.append({
+                'stage': stage,
+                'count': counts[stage],
+                'mean_ms': totals[stage] / counts[stage] * 1000,
+                'p50_ms': _percentile(samples, 50) * 1000,
+                'p95_ms': _percentile(samples, 95) * 1000
+            })
+        return rows
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+            self._totals.clear()
+            self._counters.clear()
+
+
+def _percentile(sorted_samples, percent):
+    index = min(len(sorted_samples) - 1, int(round(percent / 100 * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+# Shared by every session in the process
+perf_stats = PerfStats()
+
+
+class timed(ContextDecorator):
+    """Record the duration of a block or function call under a stage name"""
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def _recreate_cm(self):
+        # A fresh timer per call, so decorated functions are safe across threads
+        return timed(self.stage)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        perf_stats.record(self.stage, time.perf_counter() - self._start)
+        return False
@@ -0,0 +1,143 @@
+import threading
+
+import numpy as np
+import pypinyin
+from pypinyin.constants import PINYIN_DICT, PHRASES_DICT
+from pypinyin.contrib.tone_convert import to_tone3
+from pypinyin.seg.mmseg import seg
+
+from perf_stats import timed
+
+# Codepoints covered by the table: CJK Extension A through the Unified Ideographs
+TABLE_START = 0x3400
+TABLE_END = 0xA000
+# Anything below this is never a Chinese character
+FIRST_CJK_CODEPOINT = 0x3000
+
+
+class PinyinTable:
+    """Default pinyin of every CJK character, tone marks and tone numbers side by side
+
+    Characters map to syllable ids through a uint16 array indexed by
+    codepoint (id 0 means no reading), so a whole chunk is looked up with one
+    array operation. Where pypinyin's phrase dictionary reads a phrase
+    differently from its characters' defaults (polyphones, neutral tones),
+    the phrase reading wins: runs that contain such a phrase are segmented
+    with pypinyin's own forward maximum matching, so they are read the way
+    pypinyin.pinyin() reads them.
+    """
+
+    def __init__(self):
+        syllable_ids = {'': 0}
+        marks = ['']
+        self.ids = np.zeros(TABLE_END - TABLE_START, dtype=np.uint16)
+        defaults = {}
+        for codepoint, readings in PINYIN_DICT.items():
+            if not TABLE_START <= codepoint < TABLE_END:
+                continue
+            mark = readings.split(',')[0]
+            if mark not in syllable_ids:
+                syllable_ids[mark] = len(marks)
+                marks.append(mark)
+            self.ids[codepoint - TABLE_START] = syllable_ids[mark]
+            defaults[chr(codepoint)] = mark
+
+        self.marks = np.array(marks, dtype=object)
+        self.numbers = np.array([to_tone3(mark) for mark in marks], dtype=object)
+        self._tone3 = dict(zip(marks, self.numbers.tolist()))
+
+        # Flag the characters that start a phrase read differently from its defaults;
+        # only runs containing one need segmenting
+        self.phrase_starts = np.zeros(TABLE_END - TABLE_START, dtype=bool)
+        for phrase, readings in PHRASES_DICT.items():
+            if len(phrase) != len(readings) or phrase[0] not in defaults:
+                continue
+            if any(reading[0] != defaults.get(char) for char, reading in zip(phrase, readings)):
+                self.phrase_starts[ord(phrase[0]) - TABLE_START] = True
+
+    def tone3(self, mark):
+        numbers = self._tone3.get(mark)
+        if numbers is None:
+            numbers = self._tone3[mark] = to_tone3(mark)
+        return numbers
+
+    def char_pinyin(self, char):
+        """Default tone-marked reading of one character, '' if it has none"""
+        offset = ord(char) - TABLE_START
+        if 0 <= offset < len(self.ids):
+            return self.marks[self.ids[offset]]
+        if ord(char) in PINYIN_DICT:
+            return PINYIN_DICT[ord(char)].split(',')[0]
+        return ''
+
+    def convert(self, text):
+        """Pinyin for text in both styles from one pass: (tone_marks, tone_numbers)
+
+        Output follows pypinyin.pinyin() joined with spaces: one syllable per
+        character and each run of non-Chinese text kept as one item. The one
+        known difference: a character in the table's range that has no reading
+        splits the Chinese text around it, where pypinyin segments across it.
+        benchmarks/run_benchmarks.py compares the two on its corpora.
+        """
+        if not text:
+            return '', ''
+        codes = np.frombuffer(text.encode('utf-32-le'), dtype='<u4')
+        offsets = codes.astype(np.int64) - TABLE_START
+        in_table = (offsets >= 0) & (offsets < len(self.ids))
+
+        # Rare characters outside the table (e.g. Extension B) go through pypinyin
+        outside = codes[~in_table & (codes >= FIRST_CJK_CODEPOINT)]
+        if any(int(code) in PINYIN_DICT for code in outside):
+            return (
+                ' '.join(item[0] for item in pypinyin.pinyin(text, style=pypinyin.TONE)),
+                ' '.join(item[0] for item in pypinyin.pinyin(text, style=pypinyin.TONE3))
+            )
+
+        ids = np.zeros(len(codes), dtype=np.uint16)
+        ids[in_table] = self.ids[offsets[in_table]]
+        chinese = ids > 0
+        boundaries = (np.flatnonzero(chinese[1:] != chinese[:-1]) + 1).tolist()
+
+        marks, numbers = [], []
+        for start, end in zip([0] + boundaries, boundaries + [len(codes)]):
+            if not chinese[start]:
+                marks.append(text[start:end])
+                numbers.append(text[start:end])
+                continue
+            run_marks = self.marks[ids[start:end]].tolist()
+            run_numbers = self.numbers[ids[start:end]].tolist()
+            if self.phrase_starts[offsets[start:end]].any():
+                self._apply_phrases(text[start:end], run_marks, run_numbers)
+            marks.extend(run_marks)
+            numbers.extend(run_numbers)
+        return ' '.join(marks), ' '.join(numbers)
+
+    def _apply_phrases(self, run, marks, numbers):
+        """Overwrite default readings with the phrase readings of pypinyin's segmentation of run"""
+        position = 0
+        for word in seg.cut(run):
+            readings = PHRASES_DICT.get(word)
+            if readings is not None and len(readings) == len(word):
+                for i, reading in enumerate(readings):
+                    marks[position + i] = reading[0]
+                    numbers[position + i] = self.tone3(reading[0])
+            position += len(word)
+
+
+_table = None
+_table_lock = threading.Lock()
+
+
+@timed('pinyin.build_table')
+def _build_table():
+    return PinyinTable()
+
+
+def get_pinyin_table():
+    """Process-wide table, built on first use"""
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None:
+                _table = _build_table()
+    return _table
@@ -0,0 +1,121 @@
+import cProfile
+import io
+import marshal
+import pstats
+import threading
+import tracemalloc
+from collections import deque
+from datetime import datetime
+
+# Rows shown in the text reports
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+
+
+class ProfileReport:
+    """cProfile statistics and tracemalloc allocations for one translation"""
+
+    def __init__(self, label, stats, allocations):
+        self.label = label
+        self.created_at = datetime.now().isoformat(timespec='seconds')
+        self.stats = stats
+        self.allocations = allocations
+
+    def profile_bytes(self):
+        """The profile in pstats' on-disk format, loadable with pstats or snakeviz"""
+        return marshal.dumps(self.stats.stats)
+
+    def functions_report(self):
+        out = io.StringIO()
+        self.stats.stream = out
+        self.stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        return out.getvalue()
+
+    def allocations_report(self):
+        lines = [f"Top {len(self.allocations)} allocation sites (growth during the translation)", ""]
+        lines.extend(str(stat) for stat in self.allocations)
+        return "\n".join(lines)
+
+
+def profile_call(label, fn, *args, **kwargs):
+    """Run fn under cProfile and tracemalloc; returns (result, ProfileReport)
+
+    cProfile only sees the calling thread, which is where a job runs the
+    whole pipeline. If fn raises, the report is still produced and the
+    exception is re-raised with it attached as `profile_report`.
+    """
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(10)
+    before = tracemalloc.take_snapshot()
+
+    profiler = cProfile.Profile()
+    error = None
+    result = None
+    profiler.enable()
+    try:
+        result = fn(*args, **kwargs)
+    except Exception as e:
+        error = e
+    finally:
+        profiler.disable()
+        after = tracemalloc.take_snapshot()
+        if started_tracing:
+            tracemalloc.stop()
+
+    report = ProfileReport(
+        label,
+        pstats.Stats(profiler),
+        after.compare_to(before, 'lineno')[:TOP_ALLOCATIONS]
+    )
+    if error is not None:
+        error.profile_report = report
+        raise error
+    return result, report
+
+
+class ProfilingSwitch:
+    """Admin-controlled, process-wide switch that profiles the next translation"""
+
+    def __init__(self, max_reports=5):
+        self._armed = False
+        self._owner = None
+        self._reports = deque(maxlen=max_reports)
+        self._lock = threading.Lock()
+
+    def arm(self, owner=None):
+        """Profile the next translation, optionally only one submitted by owner"""
+        with self._lock:
+            self._armed = True
+            self._owner = owner or None
+
+    def disarm(self):
+        with self._lock:
+            self._armed = False
+            self._owner = None
+
+    def status(self):
+        with self._lock:
+            return self._armed, self._owner
+
+    def take(self, owner):
+        """Consume the switch if it applies to this owner's translation"""
+        with self._lock:
+            if not self._armed or (self._owner and self._owner != owner):
+                return False
+            self._armed = False
+            self._owner = None
+            return True
+
+    def add_report(self, report):
+        with self._lock:
+            self._reports.appendleft(report)
+
+    def reports(self):
+        """Most recent reports first"""
+        with self._lock:
+            return list(self._reports)
+
+
+# Shared by every session in the process
+profiling_switch = ProfilingSwitch()
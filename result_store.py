@@ -0,0 +1,176 @@
+import gzip
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from text_ingest import IngestedText, text_digest
+
+RESULT_SUFFIX = '.html.gz'
+
+
+def make_result_key(text, **options):
+    """Build a stable key from the normalized input text and the translation options
+
+    text is a str or an IngestedText; either way it's identified by its
+    text_digest(), so the same text gets the same key however it was entered.
+    """
+    digest = text.digest if isinstance(text, IngestedText) else text_digest(text)
+    payload = json.dumps({'text': digest, 'options': options}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultStore:
+    """Process-wide LRU store of finished translations, shared by all sessions
+
+    The most recent results are kept in memory, up to max_entries of them
+    and max_memory_bytes in all. With a directory, every result is also
+    written there gzip-compressed under its key, so repeats survive
+    restarts; the least recently used files are removed once they add up to
+    more than max_bytes.
+    """
+
+    def __init__(self, max_entries=200, directory=None, max_bytes=500 * 1024 * 1024,
+                 max_memory_bytes=200 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_memory_bytes = max_memory_bytes
+        # key -> (result, size in memory), least recently used first
+        self._results = OrderedDict()
+        self._memory_bytes = 0
+        # key -> compressed size on disk, least recently used first
+        self._files = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._scan()
+
+    def get(self, key):
+        """Return the stored result for key, or None"""
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None:
+                self._results.move_to_end(key)
+                if key in self._files:
+                    self._files.move_to_end(key)
+                return entry[0]
+
+        if self.directory is None:
+            return None
+        result = self._read(key)
+        if result is not None:
+            with self._lock:
+                self._remember(key, result)
+        return result
+
+    def put(self, key, result):
+        """Store a result, evicting the least recently used ones past the limits"""
+        with self._lock:
+            self._remember(key, result)
+        if self.directory is not None:
+            self._write(key, result)
+
+    def discard(self, key):
+        """Remove a stored result from memory and disk"""
+        with self._lock:
+            _, size = self._results.pop(key, (None, 0))
+            self._memory_bytes -= size
+            self._disk_bytes -= self._files.pop(key, 0)
+        if self.directory is not None:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _remember(self, key, result):
+        _, old_size = self._results.pop(key, (None, 0))
+        size = sys.getsizeof(result)
+        self._results[key] = (result, size)
+        self._memory_bytes += size - old_size
+        # The newest result stays even if it alone is over the budget
+        while len(self._results) > 1 and (len(self._results) > self.max_entries
+                                          or self._memory_bytes > self.max_memory_bytes):
+            _, (_, evicted_size) = self._results.popitem(last=False)
+            self._memory_bytes -= evicted_size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + RESULT_SUFFIX)
+
+    def _scan(self):
+        """Index the files left by earlier runs, oldest use first"""
+        entries = []
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith(RESULT_SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, file_name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, file_name[:-len(RESULT_SUFFIX)], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._files[key] = size
+            self._disk_bytes += size
+
+    def _read(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as result_file:
+                data = result_file.read()
+            result = gzip.decompress(data).decode('utf-8')
+            # The modification time records the last use, for eviction after a restart
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, UnicodeDecodeError) as e:
+            print(f"Error reading stored result {key}: {str(e)}")
+            return None
+
+        with self._lock:
+            # Another process may have written it
+            if key not in self._files:
+                self._files[key] = len(data)
+                self._disk_bytes += len(data)
+            self._files.move_to_end(key)
+        return result
+
+    def _write(self, key, result):
+        path = self._path(key)
+        data = gzip.compress(result.encode('utf-8'))
+        # Unique per thread, so two jobs storing the same result don't collide
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as result_file:
+                result_file.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Error storing result {key}: {str(e)}")
+            return
+
+        with self._lock:
+            self._disk_bytes += len(data) - self._files.pop(key, 0)
+            self._files[key] = len(data)
+            evicted = []
+            # The newest result stays even if it alone is over the limit
+            while self._disk_bytes > self.max_bytes and len(self._files) > 1:
+                old_key, size = self._files.popitem(last=False)
+                self._disk_bytes -= size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._results or key in self._files:
+                return True
+        return self.directory is not None and os.path.exists(self._path(key))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._files) if self.directory is not None else len(self._results)
@@ -0,0 +1,240 @@
+import codecs
+import hashlib
+import os
+import tempfile
+import weakref
+
+# Bytes read from the upload at a time
+READ_SIZE = 64 * 1024
+# Bytes looked at to guess the encoding
+SNIFF_SIZE = 64 * 1024
+# Characters kept for showing the start of a large upload
+PREVIEW_CHARS = 2000
+
+# Byte order marks and the codecs that consume them
+BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+# Tried in order when the text isn't valid UTF-8
+LEGACY_ENCODINGS = ('gb18030', 'big5')
+
+class UndecodableTextError(ValueError):
+    """Raised when an upload isn't text in any encoding we read"""
+
+
+# 常用字（简体和繁体），用来判断哪种编码解出来的文字更像中文
+COMMON_CHARACTERS = frozenset(
+    "的一是不了在人有我他这个们中来上大为和国地到以说时要就出也得里后自之过年生会可下而"
+    "這個們來為國說時裡後過會"
+)
+
+
+def detect_encoding(sample: bytes) -> str:
+    """Guess the encoding of a text file from its first bytes
+
+    A BOM decides it; otherwise UTF-8 is used if the sample is valid UTF-8.
+    GB18030 accepts almost any byte sequence, so between it and Big5 one that
+    decodes the sample without errors is preferred, then the one whose
+    decoding looks more like Chinese.
+    """
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+    if _decodes(sample, 'utf-8'):
+        return 'utf-8'
+    return max(LEGACY_ENCODINGS,
+               key=lambda encoding: (_decodes(sample, encoding), _chinese_score(sample, encoding)))
+
+
+def _decodes(sample, encoding):
+    # The sample may end in the middle of a character, so decode it as a partial stream
+    try:
+        codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def _chinese_score(sample, encoding):
+    """Common characters count for a decoding; replacement and private use characters against it
+
+    Kana, Greek and Cyrillic count slightly against it too: GB18030 turns
+    Big5 bytes into those.
+    """
+    text = sample.decode(encoding, errors='replace')
+    score = 0
+    for char in text:
+        if char in COMMON_CHARACTERS:
+            score += 1
+        elif char == '\ufffd' or '\ue000' <= char <= '\uf8ff':
+            score -= 10
+        elif '\u3040' <= char <= '\u30ff' or '\u0370' <= char <= '\u04ff':
+            score -= 1
+    return score
+
+
+def normalize_text(text: str) -> str:
+    """Text with '\\n' line endings and no leading or trailing whitespace"""
+    return text.replace('\r\n', '\n').replace('\r', '\n').strip()
+
+
+def text_digest(text: str) -> str:
+    """SHA-256 of the normalized text; the same text gives the same digest however it was entered"""
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+def iter_paragraphs(source):
+    """Lines of a str or an IngestedText, without line endings"""
+    if isinstance(source, str):
+        return iter(source.strip().split('\n'))
+    return source.paragraphs()
+
+
+class IngestedText:
+    """An uploaded text decoded to UTF-8 in a temporary file
+
+    Only its size, digest and first characters are held in memory; the text
+    is read back paragraph by paragraph. The file is removed once nothing
+    refers to the object any more.
+    """
+
+    def __init__(self, path, encoding, chars, digest, preview, name=""):
+        self.path = path
+        self.encoding = encoding
+        self.chars = chars
+        # text_digest() of the decoded text
+        self.digest = digest
+        self.preview = preview
+        self.name = name
+        self._cleanup = weakref.finalize(self, _remove_file, path)
+
+    def paragraphs(self):
+        with open(self.path, 'r', encoding='utf-8', newline='\n') as text_file:
+            for line in text_file:
+                yield line.rstrip('\n')
+
+    def read(self) -> str:
+        with open(self.path, 'r', encoding='utf-8', newline='\n') as text_file:
+            return text_file.read()
+
+    def close(self):
+        self._cleanup()
+
+    def __len__(self):
+        return self.chars
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def ingest(source, name="", spool_dir=None) -> IngestedText:
+    """Decode a binary file object into an IngestedText, READ_SIZE bytes at a time
+
+    Line endings are normalized to '\\n'. Decoding is strict: see
+    _decoded_chunks. Raises UndecodableTextError for bytes that don't decode.
+    """
+    sample = source.read(SNIFF_SIZE)
+    encodings = []
+    chunks = _decoded_chunks(source, sample, encodings)
+    digest = _StrippedDigest()
+    chars = 0
+    preview = []
+    preview_chars = 0
+
+    fd, path = tempfile.mkstemp(prefix='upload-', suffix='.txt', dir=spool_dir)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='\n') as spool:
+            pending = ''
+            for text, final in chunks:
+                text = pending + text
+                # A '\r' at the end may be the first half of '\r\n'
+                pending = ''
+                if text.endswith('\r') and not final:
+                    text, pending = text[:-1], '\r'
+                text = text.replace('\r\n', '\n').replace('\r', '\n')
+
+                spool.write(text)
+                digest.update(text)
+                chars += len(text)
+                if preview_chars < PREVIEW_CHARS:
+                    preview.append(text[:PREVIEW_CHARS - preview_chars])
+                    preview_chars += len(preview[-1])
+    except Exception:
+        _remove_file(path)
+        raise
+
+    return IngestedText(path, '+'.join(encodings), chars, digest.hexdigest(), ''.join(preview), name)
+
+
+def _decoded_chunks(source, sample, encodings):
+    """Decode sample and then the rest of source strictly, yielding (text, final)
+
+    The encoding is detected from sample. When UTF-8 hits an invalid byte
+    further on, e.g. GBK text after a long ASCII preamble, the encoding is
+    detected again from that byte, once. Any other invalid byte raises
+    UndecodableTextError. encodings gets the encodings used, in order.
+    """
+    encoding = detect_encoding(sample)
+    encodings.append(encoding)
+    decoder = codecs.getincrementaldecoder(encoding)()
+    chunk = sample
+    # Bytes given to the decoder before chunk
+    position = 0
+    while True:
+        final = not chunk
+        try:
+            text = decoder.decode(chunk, final=final)
+        except UnicodeDecodeError as e:
+            # e.object is the decoder's buffered bytes followed by chunk
+            error_position = position - (len(e.object) - len(chunk)) + e.start
+            if encoding != 'utf-8' or len(encodings) > 1:
+                raise UndecodableTextError(
+                    f"The file isn't valid {encoding} text (at byte {error_position:,}). "
+                    "Please save it as UTF-8 and upload it again."
+                ) from e
+            yield e.object[:e.start].decode(encoding), False
+            rest = e.object[e.start:]
+            if len(rest) < SNIFF_SIZE:
+                rest += source.read(SNIFF_SIZE - len(rest))
+            encoding = detect_encoding(rest)
+            encodings.append(encoding)
+            decoder = codecs.getincrementaldecoder(encoding)()
+            position = error_position
+            chunk = rest
+            continue
+
+        yield text, final
+        if final:
+            return
+        position += len(chunk)
+        chunk = source.read(READ_SIZE)
+
+
+class _StrippedDigest:
+    """Incremental text_digest(): SHA-256 of streamed text as if it had been stripped"""
+
+    def __init__(self):
+        self._sha = hashlib.sha256()
+        self._started = False
+        # Trailing whitespace, hashed only once more text follows it
+        self._held = ''
+
+    def update(self, text):
+        if not self._started:
+            text = text.lstrip()
+            self._started = bool(text)
+        body = text.rstrip()
+        if body:
+            self._sha.update((self._held + body).encode('utf-8'))
+            self._held = text[len(body):]
+        else:
+            self._held += text
+
+    def hexdigest(self):
+        return self._sha.hexdigest()
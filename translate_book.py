@@ -1,7 +1,7 @@
-import pypinyin
+import difflib
 import re
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 from typing import Tuple, List
 from functools import partial
 from tqdm import tqdm
@@ -10,8 +10,30 @@
 import random
 import jieba
 import streamlit as st
-
-
+import requests
+from usage_meter import QuotaExceededError, billable_characters
+from translation_context import (TranslationContext, TranslationCancelled, CancellationToken,
+                                 current_context, use_context, bind_context)
+from perf_stats import timed
+from pinyin_table import get_pinyin_table
+from word_document import WordDocument, PARAGRAPH_BREAK
+from text_ingest import iter_paragraphs
+from word_alignment import sentence_spans, token_glosses
+from html_renderer import (PageWriter, render_page, create_html_block,
+                           create_interactive_html_block)
+
+
+# Shown in place of a translation or pinyin that failed
+TRANSLATION_ERROR = "[Translation Error]"
+PINYIN_ERROR = "[Pinyin Error]"
+
+# Where interactive mode gets word meanings: each word translated on its own,
+# or the aligned part of its sentence's translation
+GLOSS_WORDS = "words"
+GLOSS_ALIGNMENT = "alignment"
+
+
+@timed('segmentation.split_sentence')
 def split_sentence(text: str) -> List[str]:
     """Split text into sentences or meaningful chunks"""
     print("Debug: Starting sentence split")  # 添加调试信息
@@ -64,37 +86,41 @@ def split_sentence(text: str) -> List[str]:
     return [chunk.strip() for chunk in chunks if chunk.strip()]
 
 
+def document_chunks(text) -> List[str]:
+    """Sentence chunks of a str, or of an IngestedText read one paragraph at a time"""
+    if isinstance(text, str):
+        return split_sentence(text.strip())
+    return [chunk for paragraph in text.paragraphs() if paragraph.strip()
+            for chunk in split_sentence(paragraph)]
+
+
+@timed('pinyin.convert')
 def convert_to_pinyin(text: str, style: str = 'tone_marks') -> str:
     """
     Convert Chinese text to pinyin with specified style
     style: 'tone_marks' (default) or 'tone_numbers'
     """
     try:
-        # Select pinyin style based on parameter
-        if style == 'tone_numbers':
-            pinyin_style = pypinyin.TONE3
-        else:  # default to tone marks
-            pinyin_style = pypinyin.TONE
-
-        # Convert to pinyin with selected style
-        pinyin_list = pypinyin.pinyin(text, style=pinyin_style)
-        # Flatten the list and join with spaces
-        return ' '.join([item[0] for item in pinyin_list])
+        # Both styles come out of the same table lookup
+        tone_marks, tone_numbers = get_pinyin_table().convert(text)
+        return tone_numbers if style == 'tone_numbers' else tone_marks
     except Exception as e:
         print(f"Error converting to pinyin: {e}")
-        return "[Pinyin Error]"
+        return PINYIN_ERROR
 
 
 def translate_text(text, target_lang):
     """Translate text using Azure Translator"""
-    if 'translator' not in st.session_state:
-        from translator import Translator
-        st.session_state.translator = Translator()
+    # Translator is a process-wide singleton, so this also works from
+    # background job threads that have no Streamlit session
+    from translator import Translator
     
     try:
-        translation = st.session_state.translator.translate_text(text, target_lang)
+        translation = Translator().translate_text(text, target_lang)
         # print(f"Azure translated '{text}' to '{translation}'")  # Commented out for debugging
         return translation
+    except (QuotaExceededError, TranslationCancelled):
+        raise
     except Exception as e:
         print(f"Translation error: {str(e)}")
         return ""
@@ -105,59 +131,72 @@ def process_chunk(chunk: str, index: int, executor: ThreadPoolExecutor, include_
         # Get pinyin with specified style
         pinyin = convert_to_pinyin(chunk, pinyin_style)
 
-        # Get translations using Azure
+        # Get translations using Azure; a failed one is marked so it can be retried
         translations = []
         if include_english:
             english = translate_text(chunk, 'en')
-            if english:
-                # print(f"English translation: {english}")  # Commented out for debugging
-                translations.append(english or "[Translation Error]")
+            # print(f"English translation: {english}")  # Commented out for debugging
+            translations.append(english or TRANSLATION_ERROR)
 
         second_trans = translate_text(chunk, second_language)
-        if second_trans:
-            # print(f"Second language translation: {second_trans}")  # Commented out for debugging
-            translations.append(second_trans or "[Translation Error]")
+        # print(f"Second language translation: {second_trans}")  # Commented out for debugging
+        translations.append(second_trans or TRANSLATION_ERROR)
 
         return (index, chunk, pinyin, *translations)
 
+    except (QuotaExceededError, TranslationCancelled):
+        raise
     except Exception as e:
         print(f"\nError processing chunk {index}: {e}")
-        error_translations = ["[Translation Error]"] * (1 + int(include_english))
-        return (index, chunk, "[Pinyin Error]", *error_translations)
-
-
-def create_html_block(results: tuple, include_english: bool) -> str:
-    speak_button = '''
-        <button class="speak-button" onclick="speakSentence(this.parentElement.textContent.replace('🔊', ''))">
-            <svg viewBox="0 0 24 24">
-                <path d="M3 9v6h4l5 5V4L7 9H3zm13.5 3c0-1.77-1.02-3.29-2.5-4.03v8.05c1.48-.73 2.5-2.25 2.5-4.02zM14 3.23v2.06c2.89.86 5 3.54 5 6.71s-2.11 5.85-5 6.71v2.06c4.01-.91 7-4.49 7-8.77s-2.99-7.86-7-8.77z"/>
-            </svg>
-        </button>
-    '''
-    
-    if include_english:
-        index, chunk, pinyin, english, second = results
-        return f'''
-            <div class="sentence-part responsive">
-                <div class="original">{index + 1}. {chunk}{speak_button}</div>
-                <div class="pinyin">{pinyin}</div>
-                <div class="english">{english}</div>
-                <div class="second-language">{second}</div>
-            </div>
-        '''
-    else:
-        index, chunk, pinyin, second = results
-        return f'''
-            <div class="sentence-part responsive">
-                <div class="original">{index + 1}. {chunk}{speak_button}</div>
-                <div class="pinyin">{pinyin}</div>
-                <div class="second-language">{second}</div>
-            </div>
-        '''
-
-
-def process_text(file_path, include_english=True, second_language="vi", pinyin_style='tone_marks'):
-    """Process text with language options and pinyin style"""
+        error_translations = [TRANSLATION_ERROR] * (1 + int(include_english))
+        return (index, chunk, PINYIN_ERROR, *error_translations)
+
+
+def has_translation_errors(html_content: str) -> bool:
+    """Whether a rendered document shows a failed translation; such pages aren't kept"""
+    return TRANSLATION_ERROR in html_content
+
+
+def chunk_failed(result: tuple) -> bool:
+    """Whether a process_chunk result has a failed translation or pinyin"""
+    return TRANSLATION_ERROR in result or PINYIN_ERROR in result
+
+
+def retry_failed_chunks(results: dict, include_english: bool, second_language: str,
+                        pinyin_style: str = 'tone_marks') -> int:
+    """Translate failed chunks again at the end of a job
+
+    results maps keys to process_chunk results; failed ones are replaced in
+    place. Waits for Azure's circuit breaker first, so a short outage doesn't
+    fail the same chunks twice. Returns how many chunks still failed.
+    """
+    from translator import Translator
+    failed = [key for key, result in results.items() if chunk_failed(result)]
+    if not failed:
+        return 0
+
+    print(f"\nRetrying {len(failed)} failed chunks")
+    Translator().wait_for_azure()
+    context = current_context()
+    still_failed = 0
+    for key in failed:
+        context.raise_if_cancelled()
+        index, chunk = results[key][:2]
+        results[key] = process_chunk(chunk, index, None, include_english, second_language, pinyin_style)
+        still_failed += chunk_failed(results[key])
+    if still_failed:
+        print(f"{still_failed} chunks still failed after retrying")
+    return still_failed
+
+
+def process_text(file_path, include_english=True, second_language="vi", pinyin_style='tone_marks',
+                 deadline=None):
+    """Process text with language options and pinyin style
+
+    Chunks are collected as they finish. With a deadline (in seconds), or
+    when the caller's translation is cancelled, unfinished chunks stop and
+    are left out.
+    """
     print("\nCounting total chunks...")
     with open(file_path, 'r', encoding='utf-8') as file:
         total_chunks = sum(len(split_sentence(line.strip()))
@@ -169,10 +208,7 @@ def process_text(file_path, include_english=True, second_language="vi", pinyin_s
     with open(file_path, 'r', encoding='utf-8') as file:
         lines = file.readlines()
 
-    with open('template.html', 'r', encoding='utf-8') as template_file:
-        html_content = template_file.read()
-
-    translation_content = ''
+    page = PageWriter()
     global_index = 0
 
     max_workers = 3
@@ -187,15 +223,21 @@ def process_text(file_path, include_english=True, second_language="vi", pinyin_s
 
     all_results = []
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = []
+    # Workers run under the caller's context, so one token stops all of them
+    context = current_context()
+    if context.cancel_token is None:
+        context = TranslationContext(context.client_id, context.tier, context.meter,
+                                     cancel_token=CancellationToken(deadline))
+
+    with use_context(context), ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
 
         for line_idx, line in enumerate(lines):
             if line.strip():
                 chunks = split_sentence(line.strip())
                 for chunk_idx, chunk in enumerate(chunks):
                     future = executor.submit(
-                        process_chunk,
+                        bind_context(process_chunk),
                         chunk,
                         global_index,
                         executor,
@@ -203,115 +245,347 @@ def process_text(file_path, include_english=True, second_language="vi", pinyin_s
                         second_language,
                         pinyin_style
                     )
-                    futures.append((global_index, line_idx, chunk_idx, future))
+                    futures[future] = (line_idx, chunk_idx)
                     global_index += 1
 
-        for global_idx, line_idx, chunk_idx, future in futures:
-            try:
-                result = future.result(timeout=60)
-                all_results.append((line_idx, chunk_idx, result))
-                pbar.update(1)
-            except Exception as e:
-                print(f"\nError getting result: {e}")
-                continue
+        try:
+            for future in as_completed(futures, timeout=context.remaining()):
+                line_idx, chunk_idx = futures[future]
+                try:
+                    all_results.append((line_idx, chunk_idx, future.result()))
+                    pbar.update(1)
+                except TranslationCancelled as e:
+                    print(f"\nTranslation stopped: {e}")
+                    break
+                except Exception as e:
+                    print(f"\nError getting result: {e}")
+                    continue
+        except FuturesTimeoutError:
+            print("\nDeadline reached; unfinished chunks are left out")
+        finally:
+            if len(all_results) < len(futures):
+                # Stop running chunks at their next request and drop queued ones
+                context.cancel_token.cancel("Stopped")
+                for future in futures:
+                    future.cancel()
 
     pbar.close()
 
+    # Failed chunks get a second chance once the rest are done
+    if len(all_results) == len(futures):
+        results = {(line_idx, chunk_idx): result for line_idx, chunk_idx, result in all_results}
+        try:
+            with use_context(context):
+                retry_failed_chunks(results, include_english, second_language, pinyin_style)
+        except TranslationCancelled as e:
+            print(f"\nRetry stopped: {e}")
+        all_results = [(line_idx, chunk_idx, result) for (line_idx, chunk_idx), result in results.items()]
+
     all_results.sort(key=lambda x: (x[0], x[1]))
 
     current_line = -1
     for line_idx, chunk_idx, result in all_results:
         if line_idx != current_line:
             if current_line != -1:
-                translation_content += '</div>'
-            translation_content += '<div class="translation-block">'
+                page.write('</div>')
+            page.write('<div class="translation-block">')
             current_line = line_idx
 
         # Pass include_english to create_html_block
-        translation_content += create_html_block(result, include_english)
+        page.write(create_html_block(result, include_english))
 
     if all_results:
-        translation_content += '</div>'
+        page.write('</div>')
 
-    html_content = html_content.replace('{{content}}', translation_content)
-    return html_content
+    return page.getvalue()
 
 
 def process_interactive_chunk(chunk: str, index: int, executor: ThreadPoolExecutor, include_english: bool, second_language: str, pinyin_style: str = 'tone_marks') -> tuple:
     """Process chunk for interactive word-by-word translation"""
     try:
         # 使用 translator 处理文本
-        if 'translator' not in st.session_state:
-            from translator import Translator
-            st.session_state.translator = Translator()
+        from translator import Translator
         
         # 直接使用 translator 的处理结果
-        processed_words = st.session_state.translator.process_chinese_text(chunk, second_language)
+        processed_words = Translator().process_chinese_text(chunk, second_language)
         if not processed_words:
             return (index, chunk, [])
             
         return (index, chunk, processed_words)
 
+    except (QuotaExceededError, TranslationCancelled):
+        raise
     except Exception as e:
         print(f"\nError processing interactive chunk {index}: {str(e)}")
         return (index, chunk, [])
 
-def create_interactive_html_block(results: tuple, include_english: bool) -> str:
-    """Create HTML for interactive word-by-word translation"""
-    chunk, word_data = results
-    
-    # 初始化HTML内容
-    content_html = '<div class="interactive-text">'
-    
-    # 跟踪当前段落
-    current_paragraph = []
-    paragraphs = []
-    
-    # 按段落分组词语
-    for word in word_data:
-        if word.get('word') == '\n':
-            if current_paragraph:
-                paragraphs.append(current_paragraph)
-                current_paragraph = []
+@timed('segmentation.jieba')
+def segment_paragraphs(text) -> List[str]:
+    """Segment text once with jieba, marking empty lines with a '\\n' token
+
+    text is a str or an IngestedText, which is read one paragraph at a time.
+    """
+    all_words = []
+    for paragraph in iter_paragraphs(text):
+        if paragraph.strip():
+            # jieba.tokenize yields (word, start, end); keep document order
+            tokens = sorted(jieba.tokenize(paragraph), key=lambda x: x[1])
+            all_words.extend(token[0] for token in tokens)
         else:
-            current_paragraph.append(word)
-    
-    if current_paragraph:
-        paragraphs.append(current_paragraph)
-    
-    # 生成每个段落的HTML
-    for paragraph in paragraphs:
-        content_html += '<p class="interactive-paragraph">'
-        for word_data in paragraph:
-            if word_data.get('translations'):
-                tooltip_content = f"{word_data['pinyin']}\n{word_data['translations'][-1]}"
-                content_html += f'''
-                    <span class="interactive-word" 
-                          onclick="speak('{word_data['word']}')"
-                          data-tooltip="{tooltip_content}">
-                        {word_data['word']}
-                    </span>'''
-            else:
-                content_html += f'<span class="non-chinese">{word_data["word"]}</span>'
-        content_html += '</p>'
-    
-    content_html += '</div>'
-    return content_html
+            all_words.append('\n')
+    return all_words
+
+
+def process_interactive_text(text, second_language: str, progress_callback=None,
+                             vocabulary=None, glosses=GLOSS_WORDS) -> WordDocument:
+    """Build word-by-word data for a whole document
+
+    The document is segmented once, pinyin and translations are resolved for
+    its unique vocabulary in bulk, and the results are mapped back onto the
+    token stream, so the work grows with vocabulary size rather than length.
+    Words already in `vocabulary` are reused; new ones are added to it.
+    text is a str or an IngestedText.
+
+    With glosses=GLOSS_ALIGNMENT, each sentence is translated once with word
+    alignment and words take their meaning from the part of the sentence
+    translation they align with; only words left unaligned somewhere are
+    looked up on their own.
+    """
+    from translator import Translator, is_chinese_word
+    translator = Translator()
+    if vocabulary is None:
+        vocabulary = {}
+
+    all_words = segment_paragraphs(text)
+    if progress_callback:
+        progress_callback(10)
+
+    # Per-token meanings from sentence translations; None means word lookups only
+    contextual = None
+    lookup = None
+    if effective_glosses(glosses, second_language) == GLOSS_ALIGNMENT:
+        contextual = align_glosses(all_words, second_language)
+        lookup = {word for word, gloss in zip(all_words, contextual) if is_chinese_word(word) and not gloss}
+        if progress_callback:
+            progress_callback(40)
+
+    vocabulary_start = 40 if contextual is not None else 10
+    vocabulary.update(translator.process_vocabulary(
+        (word for word in all_words if word != '\n' and word.strip() and word not in vocabulary),
+        second_language,
+        progress_callback=(
+            lambda p: progress_callback(vocabulary_start + p * (80 - vocabulary_start))
+        ) if progress_callback else None,
+        lookup=lookup
+    ))
+
+    # Words whose translation failed are retried once the rest are done
+    failed = [word for word in dict.fromkeys(all_words)
+              if is_chinese_word(word) and (lookup is None or word in lookup)
+              and not vocabulary[word]['translations']]
+    if failed:
+        print(f"Retrying {len(failed)} failed words")
+        translator.wait_for_azure()
+        vocabulary.update(translator.process_vocabulary(failed, second_language))
+
+    document = WordDocument()
+    for index, word in enumerate(all_words):
+        if word == PARAGRAPH_BREAK:
+            document.append(PARAGRAPH_BREAK)
+        elif word.strip():
+            translations = vocabulary[word]['translations']
+            if contextual is not None and contextual[index] and is_chinese_word(word):
+                translations = (contextual[index],)
+            elif not translations and is_chinese_word(word):
+                # Shown as failed; the vocabulary keeps it empty so it's tried again next time
+                translations = (TRANSLATION_ERROR,)
+            document.append(word, vocabulary[word]['pinyin'], translations)
+        else:
+            document.append('')
+    return document
+
+
+def effective_glosses(glosses: str, second_language: str) -> str:
+    """GLOSS_ALIGNMENT only for languages Azure aligns with Chinese; word lookups otherwise"""
+    from translator import ALIGNMENT_LANGUAGES
+    if glosses == GLOSS_ALIGNMENT and second_language not in ALIGNMENT_LANGUAGES:
+        return GLOSS_WORDS
+    return glosses
+
+
+def align_glosses(all_words: List[str], second_language: str) -> List[str]:
+    """A meaning for each token from its sentence's aligned translation, '' where there is none"""
+    from translator import Translator, is_chinese_word
+    spans = [(start, end) for start, end in sentence_spans(all_words)
+             if any(is_chinese_word(word) for word in all_words[start:end])]
+    sentences = [''.join(all_words[start:end]) for start, end in spans]
+    aligned = Translator().translate_aligned(sentences, second_language)
+
+    glosses = [''] * len(all_words)
+    for (start, end), (translation, alignment) in zip(spans, aligned):
+        if translation and alignment:
+            glosses[start:end] = token_glosses(all_words[start:end], translation, alignment)
+    return glosses
+
+
+def speech_texts(input_text, translation_mode="Standard Translation") -> List[str]:
+    """The texts a rendered page will ask the speech server for"""
+    from translator import is_chinese_word
+    if translation_mode == "Interactive Word-by-Word":
+        return list(dict.fromkeys(word for word in segment_paragraphs(input_text) if is_chinese_word(word)))
+    # Sentence buttons read the numbered sentence, e.g. "1. 你好。"
+    return [f"{index + 1}. {chunk}" for index, chunk in enumerate(document_chunks(input_text))]
+
+
+def speech_pregeneration_enabled() -> bool:
+    """Whether a speech server and its token are configured"""
+    tts_settings = st.secrets.get("tts_server", {})
+    return bool((tts_settings.get("internal_url") or tts_settings.get("url")) and tts_settings.get("token"))
+
+
+def request_speech_pregeneration(texts: List[str]):
+    """Ask the speech server to synthesize clips for a finished document"""
+    tts_settings = st.secrets.get("tts_server", {})
+    # The app may reach the server on an internal address the browser can't use
+    tts_url = (tts_settings.get("internal_url") or tts_settings.get("url", "")).rstrip('/')
+    if not speech_pregeneration_enabled() or not texts:
+        return
+    try:
+        requests.post(f"{tts_url}/pregenerate", json={'texts': texts}, timeout=5,
+                      headers={'Authorization': f"Bearer {tts_settings['token']}"})
+    except requests.exceptions.RequestException as e:
+        print(f"Speech pregeneration request failed: {str(e)}")
+
+
+def estimate_billable_characters(input_text, include_english=True, second_language="vi",
+                                 translation_mode="Standard Translation", glosses=GLOSS_WORDS) -> int:
+    """Estimate the characters a translation will send to Azure, skipping cached text
+
+    With aligned glosses, words that end up unaligned are looked up as well;
+    they aren't known in advance and aren't counted.
+    """
+    from translator import Translator, is_chinese_word
+    translator = Translator()
+
+    if translation_mode == "Interactive Word-by-Word":
+        all_words = segment_paragraphs(input_text)
+        if effective_glosses(glosses, second_language) == GLOSS_ALIGNMENT:
+            sentences = set(
+                ''.join(all_words[start:end]) for start, end in sentence_spans(all_words)
+                if any(is_chinese_word(word) for word in all_words[start:end])
+            )
+            return sum(
+                billable_characters(sentence) for sentence in sentences
+                if f"{sentence}_{second_language}" not in translator.aligned_sentences
+            )
+        vocabulary = set(word for word in all_words if is_chinese_word(word))
+        return sum(
+            billable_characters(word) for word in vocabulary
+            if not translator.is_cached(word, second_language)
+        )
+
+    target_langs = [second_language]
+    if include_english and second_language != "en":
+        target_langs.insert(0, 'en')
+
+    total = 0
+    for chunk in set(document_chunks(input_text)):
+        for target_lang in target_langs:
+            if not translator.is_cached(chunk, target_lang):
+                total += billable_characters(chunk)
+    return total
+
+class DocumentResults:
+    """Per-chunk results of a translated document
+
+    Kept by the session so that translating an edited text only translates
+    the sentences that changed; unchanged ones are spliced back in.
+    """
+
+    def __init__(self, options):
+        # Results can only be reused with the options they were produced with
+        self.options = options
+        # Standard mode: sentence chunks, (chunk, pinyin, *translations) and rendered blocks
+        self.chunks = []
+        self.results = []
+        self.blocks = []
+        # Interactive mode: word -> {'pinyin', 'translations'}
+        self.vocabulary = {}
+        # Chunks or words that still failed after retrying; such a document isn't stored
+        self.failures = 0
+
+    def unchanged_chunks(self, chunks: List[str]) -> dict:
+        """Map positions in chunks to the positions of the same sentences in this document"""
+        matcher = difflib.SequenceMatcher(None, self.chunks, chunks, autojunk=False)
+        unchanged = {}
+        for tag, old_start, old_end, new_start, _ in matcher.get_opcodes():
+            if tag == 'equal':
+                for offset in range(old_end - old_start):
+                    unchanged[new_start + offset] = old_start + offset
+        return unchanged
+
+    def reusable_vocabulary(self) -> dict:
+        """Words whose lookup succeeded; failed ones are tried again"""
+        from translator import is_chinese_word
+        return {
+            word: data for word, data in self.vocabulary.items()
+            if data['translations'] or not is_chinese_word(word)
+        }
+
 
 def translate_file(input_text: str, progress_callback=None, include_english=True, 
                   second_language="vi", pinyin_style='tone_marks', 
-                  translation_mode="Standard Translation", processed_words=None):
+                  translation_mode="Standard Translation", processed_words=None, glosses=GLOSS_WORDS):
     """Translate text with progress updates"""
+    html_content, _ = translate_document(
+        input_text, progress_callback, include_english, second_language,
+        pinyin_style, translation_mode, processed_words, glosses=glosses
+    )
+    return html_content
+
+
+@timed('pipeline.translate_file')
+def translate_document(input_text, progress_callback=None, include_english=True,
+                       second_language="vi", pinyin_style='tone_marks',
+                       translation_mode="Standard Translation", processed_words=None,
+                       previous=None, glosses=GLOSS_WORDS) -> Tuple[str, DocumentResults]:
+    """Translate text, reusing the results of `previous` for unchanged sentences
+
+    Returns the HTML and the DocumentResults to pass as `previous` when the
+    same document is translated again after an edit. glosses chooses where
+    interactive mode gets word meanings (GLOSS_WORDS or GLOSS_ALIGNMENT).
+    """
+    glosses = effective_glosses(glosses, second_language)
+    options = {
+        'include_english': include_english,
+        'second_language': second_language,
+        'pinyin_style': pinyin_style,
+        'translation_mode': translation_mode,
+        'glosses': glosses
+    }
+    document = DocumentResults(options)
+    if previous is not None and previous.options != options:
+        previous = None
+
     try:
-        text = input_text.strip()
+        # A large upload arrives as an IngestedText and is read paragraph by paragraph
+        text = input_text.strip() if isinstance(input_text, str) else input_text
         
-        if translation_mode == "Interactive Word-by-Word" and processed_words:
-            with open('template.html', 'r', encoding='utf-8') as template_file:
-                html_content = template_file.read()
-            
-            if progress_callback:
-                progress_callback(0)
-            
+        if translation_mode == "Interactive Word-by-Word":
+            if previous is not None:
+                document.vocabulary = previous.reusable_vocabulary()
+            if processed_words is None:
+                processed_words = process_interactive_text(
+                    text, second_language, progress_callback, vocabulary=document.vocabulary,
+                    glosses=glosses
+                )
+
+            if not isinstance(processed_words, WordDocument):
+                processed_words = WordDocument.from_records(processed_words)
+            document.failures = sum(
+                1 for translations in processed_words.translations if translations == (TRANSLATION_ERROR,)
+            )
+
             # 先创建内容
             translation_content = create_interactive_html_block(
                 (text, processed_words),
@@ -321,40 +595,61 @@ def translate_file(input_text: str, progress_callback=None, include_english=True
             if progress_callback:
                 progress_callback(100)
                 
-            return html_content.replace('{{content}}', translation_content)
+            return render_page(translation_content), document
         else:
-            # 保持标准翻译模式的代码完全不变
-            chunks = split_sentence(text)
+            chunks = document_chunks(text)
             total_chunks = len(chunks)
-            chunks_processed = 0
+            unchanged = previous.unchanged_chunks(chunks) if previous is not None else {}
 
-            translation_content = ""
-            
             if progress_callback:
                 progress_callback(0)
-                print(f"Total chunks: {total_chunks}")
+                print(f"Total chunks: {total_chunks} ({len(unchanged)} unchanged)")
+
+            context = current_context()
+            failed = {}
+            for index, chunk in enumerate(chunks):
+                # Stop between chunks too, even when they would come from the cache
+                context.raise_if_cancelled()
+                old_index = unchanged.get(index)
+                result = previous.results[old_index] if old_index is not None else None
+                if result is None:
+                    result = process_chunk(
+                        chunk, index, None,
+                        include_english, second_language, pinyin_style
+                    )[1:]
+                    block = create_html_block((index, *result), include_english)
+                    # Failed translations are retried below and never kept for reuse
+                    if chunk_failed(result):
+                        failed[index] = (index, *result)
+                        result = None
+                elif old_index == index:
+                    block = previous.blocks[old_index]
+                else:
+                    # Same sentence at a new position: only its number changes
+                    block = create_html_block((index, *result), include_english)
+
+                document.chunks.append(chunk)
+                document.results.append(result)
+                document.blocks.append(block)
 
-            for chunk in chunks:
-                result = process_chunk(
-                    chunk, chunks_processed, None, 
-                    include_english, second_language, pinyin_style
-                )
-                
-                translation_content += create_html_block(result, include_english)
-                
-                chunks_processed += 1
                 if progress_callback:
-                    current_progress = min(100, (chunks_processed / total_chunks) * 100)
-                    print(f"Processing chunk {chunks_processed}/{total_chunks} ({current_progress:.1f}%)")
+                    current_progress = min(100, ((index + 1) / total_chunks) * 100)
+                    print(f"Processing chunk {index + 1}/{total_chunks} ({current_progress:.1f}%)")
                     progress_callback(current_progress)
 
-            with open('template.html', 'r', encoding='utf-8') as template_file:
-                html_content = template_file.read()
-                
+            # Failed chunks go to the back of the queue instead of rendering as errors
+            if failed:
+                retry_failed_chunks(failed, include_english, second_language, pinyin_style)
+                for index, result in failed.items():
+                    document.blocks[index] = create_html_block(result, include_english)
+                    if not chunk_failed(result):
+                        document.results[index] = result[1:]
+            document.failures = sum(1 for result in document.results if result is None)
+
             if progress_callback:
                 progress_callback(100)
                 
-            return html_content.replace('{{content}}', translation_content)
+            return render_page(''.join(document.blocks)), document
 
     except Exception as e:
         print(f"Translation error: {str(e)}")
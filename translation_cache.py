@@ -0,0 +1,68 @@
+import os
+import sqlite3
+import threading
+
+# Texts per query; stays under SQLite's limit on bound parameters
+LOOKUP_CHUNK = 500
+
+
+class TranslationCache:
+    """Translations kept in a local SQLite database, so they survive restarts
+
+    The Translator's in-memory dict stays the first level; this is consulted
+    on a miss and written through whenever Azure returns a translation.
+    """
+
+    def __init__(self, path="data/translations.db"):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS translations (
+                    text TEXT NOT NULL,
+                    target_lang TEXT NOT NULL,
+                    translation TEXT NOT NULL,
+                    PRIMARY KEY (text, target_lang)
+                ) WITHOUT ROWID
+                """
+            )
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, texts, target_lang):
+        """Cached translations for texts, as {text: translation}"""
+        texts = list(texts)
+        found = {}
+        conn = self._connection()
+        for start in range(0, len(texts), LOOKUP_CHUNK):
+            chunk = texts[start:start + LOOKUP_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            found.update(conn.execute(
+                f"SELECT text, translation FROM translations "
+                f"WHERE target_lang = ? AND text IN ({placeholders})",
+                (target_lang, *chunk)
+            ).fetchall())
+        return found
+
+    def put_many(self, translations, target_lang):
+        """Store {text: translation}; empty translations are skipped"""
+        rows = [(text, target_lang, translation) for text, translation in translations.items() if translation]
+        if not rows:
+            return
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO translations (text, target_lang, translation) VALUES (?, ?, ?)",
+                rows
+            )
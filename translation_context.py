@@ -0,0 +1,119 @@
+import threading
+import time
+from contextlib import contextmanager
+
+_local = threading.local()
+
+DEADLINE_EXCEEDED = "Deadline exceeded"
+
+
+class TranslationCancelled(Exception):
+    """Raised inside translation work that was cancelled or ran past its deadline"""
+
+
+class CancellationToken:
+    """Shared flag that tells every thread working on a translation to stop
+
+    A token can also carry a deadline (seconds from now, or set later with
+    start_deadline), after which it counts as cancelled.
+    """
+
+    def __init__(self, timeout=None):
+        self._event = threading.Event()
+        self.reason = None
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+
+    def cancel(self, reason="Cancelled"):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    def start_deadline(self, timeout):
+        """Give the token a deadline timeout seconds from now"""
+        self.deadline = time.monotonic() + timeout
+
+    @property
+    def cancelled(self):
+        if not self._event.is_set() and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel(DEADLINE_EXCEEDED)
+        return self._event.is_set()
+
+    @property
+    def expired(self):
+        """Whether the token was cancelled by its deadline"""
+        return self.cancelled and self.reason == DEADLINE_EXCEEDED
+
+    def remaining(self):
+        """Seconds left before the deadline, or None without one"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise TranslationCancelled(self.reason)
+
+    def wait(self, seconds):
+        """Sleep up to seconds, waking early on cancellation; returns whether cancelled"""
+        remaining = self.remaining()
+        if remaining is not None:
+            seconds = min(seconds, remaining)
+        self._event.wait(seconds)
+        return self.cancelled
+
+
+class TranslationContext:
+    """Who the translation work running on the current thread is being done for"""
+
+    def __init__(self, client_id="anonymous", tier="default", meter=None, cancel_token=None):
+        self.client_id = client_id
+        self.tier = tier
+        # Optional UsageMeter charged for every character sent to Azure
+        self.meter = meter
+        # Optional CancellationToken checked before every Azure request
+        self.cancel_token = cancel_token
+
+    def raise_if_cancelled(self):
+        if self.cancel_token is not None:
+            self.cancel_token.raise_if_cancelled()
+
+    def remaining(self):
+        """Seconds left before the deadline, or None without one"""
+        return self.cancel_token.remaining() if self.cancel_token is not None else None
+
+    def wait(self, seconds):
+        """Sleep up to seconds, waking early if the translation is cancelled"""
+        if self.cancel_token is not None:
+            self.cancel_token.wait(seconds)
+        else:
+            time.sleep(seconds)
+
+
+# Used for work that runs without a user, e.g. the command line tool
+DEFAULT_CONTEXT = TranslationContext()
+
+
+def current_context():
+    """Return the context bound to this thread, or the anonymous default"""
+    return getattr(_local, 'context', None) or DEFAULT_CONTEXT
+
+
+@contextmanager
+def use_context(context):
+    """Bind a context to the current thread for the duration of the block"""
+    previous = getattr(_local, 'context', None)
+    _local.context = context
+    try:
+        yield context
+    finally:
+        _local.context = previous
+
+
+def bind_context(fn):
+    """Wrap fn so it runs under the caller's context, e.g. inside a thread pool"""
+    context = current_context()
+
+    def wrapper(*args, **kwargs):
+        with use_context(context):
+            return fn(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,171 @@
+import re
+import threading
+import unicodedata
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+from perf_stats import timed
+
+# Characters ignored when comparing sentences (whitespace and punctuation)
+_IGNORED = re.compile(
+    r'[\s!-/:-@\[-`{-~\u2010-\u206f\u3000-\u303f\uff00-\uff0f\uff1a-\uff20\uff3b-\uff40\uff5b-\uff65]+'
+)
+# Characters that change a sentence's meaning on their own: numbers and negations.
+# A fuzzy match is only served when the sentence has the same ones.
+_MEANING_CHARACTERS = frozenset('0123456789零〇一二两三四五六七八九十百千万亿不没沒无無非未别別莫勿否')
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_FNV_PRIME = np.uint64(0x01000193)
+
+
+def normalize_sentence(text):
+    """Form used for matching: NFKC, lower case, without whitespace and punctuation"""
+    return _IGNORED.sub('', unicodedata.normalize('NFKC', text).lower())
+
+
+def meaning_characters(normalized):
+    """The numbers and negations of a normalized sentence, in order"""
+    return ''.join(char for char in normalized if char in _MEANING_CHARACTERS)
+
+
+class MemoryMatch:
+    """Best fuzzy match for a sentence"""
+
+    __slots__ = ('similarity', 'source', 'translation', 'same_meaning_characters')
+
+    def __init__(self, similarity, source, translation, same_meaning_characters=True):
+        self.similarity = similarity
+        self.source = source
+        self.translation = translation
+        # Whether both sentences have the same numbers and negations
+        self.same_meaning_characters = same_meaning_characters
+
+
+class TranslationMemory:
+    """Fuzzy index of past sentence translations, one per target language
+
+    Sentences are compared as sets of character n-grams. MinHash signatures
+    split into LSH bands find candidates without scanning the memory; the
+    candidates are then scored by exact Jaccard similarity. A match at or
+    above flag_threshold is reported. Serving is off unless serve_threshold
+    is set: then a match at or above it, with the same numbers and
+    negations, can be used instead of calling Azure. The oldest entries are
+    evicted past max_entries.
+    """
+
+    def __init__(self, serve_threshold=None, flag_threshold=0.75, ngram=2, num_perm=32, bands=8,
+                 min_chars=8, max_entries=1_000_000, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.serve_threshold = serve_threshold
+        self.flag_threshold = flag_threshold
+        self.ngram = ngram
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.min_chars = min_chars
+        self.max_entries = max_entries
+
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 61, size=num_perm, dtype=np.uint64)[:, None]
+        self._b = rng.randint(0, 1 << 61, size=num_perm, dtype=np.uint64)[:, None]
+
+        self._entries = OrderedDict()  # id -> (target_lang, normalized, source, translation, band keys)
+        self._keys = {}                # (target_lang, normalized) -> id
+        self._buckets = [defaultdict(set) for _ in range(bands)]
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _grams(self, normalized):
+        n = self.ngram
+        if len(normalized) <= n:
+            return {normalized}
+        return {normalized[i:i + n] for i in range(len(normalized) - n + 1)}
+
+    def _band_keys(self, normalized, target_lang):
+        """MinHash signature of the sentence's n-grams, cut into LSH band keys"""
+        codes = np.frombuffer(normalized.encode('utf-32-le'), dtype='<u4').astype(np.uint64)
+        n = min(self.ngram, len(codes))
+        hashes = codes[:len(codes) - n + 1].copy()
+        for offset in range(1, n):
+            hashes = ((hashes * _FNV_PRIME) ^ codes[offset:len(codes) - n + 1 + offset]) & _MAX_HASH
+        hashes = np.unique(hashes)
+
+        # Universal hashing; uint64 overflow just wraps, which is fine for MinHash
+        signature = (((self._a * hashes + self._b) % _MERSENNE_PRIME) & _MAX_HASH).min(axis=1)
+        return [
+            hash((target_lang, band, signature[band * self.rows:(band + 1) * self.rows].tobytes()))
+            for band in range(self.bands)
+        ]
+
+    def _usable(self, normalized):
+        return len(normalized) >= self.min_chars
+
+    @timed('memory.lookup')
+    def lookup(self, text, target_lang):
+        """Most similar remembered sentence at or above flag_threshold, or None"""
+        normalized = normalize_sentence(text)
+        if not self._usable(normalized):
+            return None
+
+        band_keys = self._band_keys(normalized, target_lang)
+        with self._lock:
+            entry_id = self._keys.get((target_lang, normalized))
+            if entry_id is not None:
+                entry = self._entries[entry_id]
+                return MemoryMatch(1.0, entry[2], entry[3])
+
+            candidates = set()
+            for band, key in enumerate(band_keys):
+                candidates.update(self._buckets[band].get(key, ()))
+            candidates = [self._entries[candidate] for candidate in candidates]
+
+        grams = self._grams(normalized)
+        best = None
+        for _, other, source, translation, _ in candidates:
+            other_grams = self._grams(other)
+            similarity = len(grams & other_grams) / len(grams | other_grams)
+            if similarity >= self.flag_threshold and (best is None or similarity > best.similarity):
+                # An inserted 不 or a changed number barely moves the similarity
+                best = MemoryMatch(similarity, source, translation,
+                                   meaning_characters(other) == meaning_characters(normalized))
+        return best
+
+    def should_serve(self, match):
+        return (
+            match is not None and self.serve_threshold is not None
+            and match.similarity >= self.serve_threshold and match.same_meaning_characters
+        )
+
+    def add(self, text, target_lang, translation):
+        """Remember a sentence and its translation"""
+        normalized = normalize_sentence(text)
+        if not translation or not self._usable(normalized):
+            return
+        band_keys = self._band_keys(normalized, target_lang)
+
+        with self._lock:
+            if (target_lang, normalized) in self._keys:
+                return
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (target_lang, normalized, text, translation, band_keys)
+            self._keys[(target_lang, normalized)] = entry_id
+            for band, key in enumerate(band_keys):
+                self._buckets[band][key].add(entry_id)
+
+            while len(self._entries) > self.max_entries:
+                self._evict_oldest()
+
+    def _evict_oldest(self):
+        entry_id, (target_lang, normalized, _, _, band_keys) = self._entries.popitem(last=False)
+        del self._keys[(target_lang, normalized)]
+        for band, key in enumerate(band_keys):
+            bucket = self._buckets[band][key]
+            bucket.discard(entry_id)
+            if not bucket:
+                del self._buckets[band][key]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -2,10 +2,51 @@
 import requests
 import uuid
 import time
-from pypinyin import pinyin, Style
 import jieba
 from datetime import datetime
 import plotly.graph_objects as go
+from azure_governor import AzureGovernor
+from azure_ledger import AzureLedger
+from circuit_breaker import CircuitBreaker
+from translation_context import current_context, TranslationCancelled
+from usage_meter import QuotaExceededError, billable_characters
+from perf_stats import perf_stats, timed
+from pinyin_table import get_pinyin_table
+from translation_memory import TranslationMemory
+from translation_cache import TranslationCache
+from word_document import WordDocument
+
+# Second languages offered in the app, by display name
+LANGUAGES = {
+    "Arabic": "ar",
+    "English": "en",
+    "French": "fr",
+    "Indonesian": "id",
+    "Italian": "it",
+    "Japanese": "ja",
+    "Korean": "ko",
+    "Persian": "fa",
+    "Portuguese": "pt",
+    "Russian": "ru",
+    "Spanish": "es",
+    "Thai": "th",
+    "Uzbek": "uz",
+    "Vietnamese": "vi"
+}
+
+# Statuses that count against Azure's health besides 5xx: bad key, throttling
+BREAKER_FAILURE_STATUSES = (401, 403, 429)
+# Longest wait for Azure to recover before failed items are retried
+RETRY_MAX_WAIT = 30
+# Seconds an Azure request may take (connect, read) when the job's deadline doesn't cut it shorter
+REQUEST_TIMEOUT = (5, 30)
+
+# Targets Azure returns word alignment for when translating from zh-Hans
+ALIGNMENT_LANGUAGES = ('en', 'ja')
+
+# Azure Translator request limits (elements per request / characters per request)
+MAX_BATCH_ELEMENTS = 100
+MAX_BATCH_CHARS = 10000
 
 class Translator:
     _instance = None
@@ -24,41 +65,233 @@ def __init__(self):
                 'region': st.secrets.get("azure_translator", {}).get("region", "southeastasia"),
                 'endpoint': st.secrets.get("azure_translator", {}).get("endpoint", "https://api.cognitive.microsofttranslator.com")
             }
+            # All sessions share one limit on concurrent Azure requests
+            self.governor = AzureGovernor(
+                max_concurrent=st.secrets.get("azure_translator", {}).get("max_concurrent_requests", 6),
+                tier_weights=st.secrets.get("tier_weights", None)
+            )
+            # Consecutive Azure failures open the breaker so callers fail fast
+            translator_settings = st.secrets.get("azure_translator", {})
+            self.breaker = CircuitBreaker(
+                failure_threshold=translator_settings.get("breaker_failure_threshold", 5),
+                reset_timeout=translator_settings.get("breaker_reset_timeout", 30)
+            )
+            # Every outbound request is recorded for offline cost analysis
+            ledger_settings = st.secrets.get("azure_ledger", {})
+            self.ledger = AzureLedger(
+                path=ledger_settings.get("path", "data/azure_ledger.jsonl"),
+                max_bytes=ledger_settings.get("max_bytes", 20 * 1024 * 1024),
+                backup_count=ledger_settings.get("backup_count", 10),
+                enabled=ledger_settings.get("enabled", True)
+            )
+            # Near-duplicate sentences can reuse an earlier translation
+            memory_settings = st.secrets.get("translation_memory", {})
+            self.memory = TranslationMemory(
+                # Fuzzy matches are only reported unless serving is switched on
+                serve_threshold=memory_settings.get("serve_threshold"),
+                flag_threshold=memory_settings.get("flag_threshold", 0.75),
+                max_entries=memory_settings.get("max_entries", 1_000_000)
+            ) if memory_settings.get("enabled", True) else None
+            # Translations are also kept on disk so a restart doesn't start cold
+            cache_settings = st.secrets.get("translation_cache", {})
+            self.cache = TranslationCache(
+                path=cache_settings.get("path", "data/translations.db")
+            ) if cache_settings.get("enabled", True) else None
             # 将缓存移到类级别
             self.translated_words = {}
+            # Sentence translations with their word alignment, keyed like translated_words
+            self.aligned_sentences = {}
             self.initialized = True
 
+    @timed('translator.translate_text')
     def translate_text(self, text, target_lang):
         """Translate text using Azure Translator"""
         cache_key = f"{text}_{target_lang}"
         
         # Check cache first
         if cache_key in self.translated_words:
+            perf_stats.increment('cache_hits')
             translation = self.translated_words[cache_key]
             # print(f"[Cache] '{text}' -> '{translation}'")  # Commented out for debugging
             return translation
+
+        persisted = self._load_persisted([text], target_lang)
+        if text in persisted:
+            perf_stats.increment('cache_hits')
+            return persisted[text]
         
+        perf_stats.increment('cache_misses')
         try:
+            match = self.memory.lookup(text, target_lang) if self.memory is not None else None
+            if match is not None:
+                if self.memory.should_serve(match):
+                    # Not written to the exact cache: it's another sentence's translation
+                    perf_stats.increment('memory_served')
+                    return match.translation
+                perf_stats.increment('memory_flagged')
+                print(f"[Memory] '{text[:30]}' is {match.similarity:.0%} similar to '{match.source[:30]}'")
+
             # Only call Azure if not in cache
             translation = self._call_azure_translate(text, target_lang)  # Actual API call
-            self.translated_words[cache_key] = translation  # Update cache
+            if translation:
+                # Failed translations aren't cached so they can be retried
+                self.translated_words[cache_key] = translation  # Update cache
+                self._persist({text: translation}, target_lang)
+                if self.memory is not None:
+                    self.memory.add(text, target_lang, translation)
             # print(f"[Azure] '{text}' -> '{translation}'")  # Commented out for debugging
             return translation
+        except (QuotaExceededError, TranslationCancelled):
+            raise
         except Exception as e:
             print(f"Translation error: {str(e)}")
             return ""
 
+    def is_cached(self, text, target_lang):
+        """Check whether a translation would be served without calling Azure"""
+        if f"{text}_{target_lang}" in self.translated_words:
+            return True
+        if self._load_persisted([text], target_lang):
+            return True
+        return self.memory is not None and self.memory.should_serve(self.memory.lookup(text, target_lang))
+
+    @timed('translator.translate_batch')
+    def translate_batch(self, texts, target_lang, progress_callback=None):
+        """Translate a list of texts, sending only cache misses to Azure in bulk"""
+        results = [None] * len(texts)
+        pending = {}
+        for i, text in enumerate(texts):
+            cache_key = f"{text}_{target_lang}"
+            if cache_key in self.translated_words:
+                results[i] = self.translated_words[cache_key]
+            else:
+                pending.setdefault(text, []).append(i)
+        for text, translation in self._load_persisted(list(pending), target_lang).items():
+            for i in pending.pop(text):
+                results[i] = translation
+        misses = sum(len(indexes) for indexes in pending.values())
+        perf_stats.increment('cache_hits', len(texts) - misses)
+        perf_stats.increment('cache_misses', misses)
+
+        batches = list(self._make_batches(list(pending)))
+        for batch_index, batch in enumerate(batches):
+            translations = self._call_azure_translate_batch(batch, target_lang)
+            for text, translation in zip(batch, translations):
+                if translation:
+                    self.translated_words[f"{text}_{target_lang}"] = translation
+                for i in pending[text]:
+                    results[i] = translation
+            self._persist(dict(zip(batch, translations)), target_lang)
+            if progress_callback:
+                progress_callback((batch_index + 1) / len(batches))
+
+        return results
+
+    def translate_aligned(self, texts, target_lang):
+        """Translate sentences with word alignment, as (translation, alignment) pairs
+
+        Failed translations come back as ("", ""), and so does every
+        sentence for a language outside ALIGNMENT_LANGUAGES, without a request.
+        """
+        if target_lang not in ALIGNMENT_LANGUAGES:
+            return [("", "")] * len(texts)
+
+        results = {}
+        pending = []
+        for text in dict.fromkeys(texts):
+            cached = self.aligned_sentences.get(f"{text}_{target_lang}")
+            if cached is not None:
+                results[text] = cached
+            else:
+                pending.append(text)
+        perf_stats.increment('cache_hits', len(texts) - len(pending))
+        perf_stats.increment('cache_misses', len(pending))
+
+        for batch in self._make_batches(pending):
+            for text, (translation, alignment) in zip(batch, self._call_azure_translate_batch(
+                    batch, target_lang, include_alignment=True)):
+                results[text] = (translation, alignment)
+                if translation:
+                    self.aligned_sentences[f"{text}_{target_lang}"] = (translation, alignment)
+
+        return [results.get(text, ("", "")) for text in texts]
+
+    def _load_persisted(self, texts, target_lang):
+        """Translations found in the persistent cache, copied into memory"""
+        if self.cache is None or not texts:
+            return {}
+        try:
+            found = self.cache.get_many(texts, target_lang)
+        except Exception as e:
+            print(f"Error reading translation cache: {str(e)}")
+            return {}
+        for text, translation in found.items():
+            self.translated_words[f"{text}_{target_lang}"] = translation
+        return found
+
+    def _persist(self, translations, target_lang):
+        if self.cache is None:
+            return
+        try:
+            self.cache.put_many(translations, target_lang)
+        except Exception as e:
+            print(f"Error writing translation cache: {str(e)}")
+
+    def _record_outcome(self, status):
+        """Feed a request's status code (or exception name) to the circuit breaker"""
+        if isinstance(status, int) and status < 500 and status not in BREAKER_FAILURE_STATUSES:
+            self.breaker.record_success()
+        elif status is not None:
+            self.breaker.record_failure()
+
+    def wait_for_azure(self, max_wait=RETRY_MAX_WAIT):
+        """Wait until the circuit breaker lets requests through, up to max_wait seconds
+
+        Used before retrying failed items; returns early if the translation
+        is cancelled.
+        """
+        context = current_context()
+        wait = min(self.breaker.retry_in(), max_wait)
+        remaining = context.remaining()
+        if remaining is not None:
+            wait = min(wait, remaining)
+        if wait > 0:
+            context.wait(wait)
+
+    def _request_timeout(self, context):
+        """requests timeout for the next Azure call: the default, cut to the deadline"""
+        remaining = context.remaining()
+        if remaining is None:
+            return REQUEST_TIMEOUT
+        connect, read = REQUEST_TIMEOUT
+        return (min(connect, remaining), min(read, remaining))
+
+    def _make_batches(self, texts):
+        """Group texts into request-sized batches within Azure's element and character limits"""
+        batch, batch_chars = [], 0
+        for text in texts:
+            if batch and (len(batch) >= MAX_BATCH_ELEMENTS or batch_chars + len(text) > MAX_BATCH_CHARS):
+                yield batch
+                batch, batch_chars = [], 0
+            batch.append(text)
+            batch_chars += len(text)
+        if batch:
+            yield batch
+
     def _call_azure_translate(self, text, target_lang):
         """Translate text using Azure Translator API"""
+        return self._call_azure_translate_batch([text], target_lang)[0]
+
+    def _call_azure_translate_batch(self, texts, target_lang, include_alignment=False):
+        """Translate several texts in a single Azure Translator API request
+
+        With include_alignment, each result is a (translation, alignment)
+        pair, the alignment being Azure's 'proj' string ('' when missing).
+        """
         endpoint = self.azure_config['endpoint']
         location = self.azure_config['region']
         key = self.azure_config['key']
         
-        # Debug logging
-        # print(f"Endpoint: {endpoint}")  # Commented out for debugging
-        # print(f"Location: {location}")  # Commented out for debugging
-        # print(f"Key exists: {bool(key)}")  # Commented out for debugging
-        
         path = '/translate'
         constructed_url = endpoint + path
         
@@ -69,138 +302,165 @@ def _call_azure_translate(self, text, target_lang):
             'X-ClientTraceId': str(uuid.uuid4())
         }
         
-        body = [{
-            'text': text
-        }]
+        body = [{'text': text} for text in texts]
         
         params = {
             'api-version': '3.0',
             'from': 'zh-Hans',
             'to': target_lang
         }
+        if include_alignment:
+            params['includeAlignment'] = 'true'
+        
+        # Abandoned work stops here instead of issuing more requests
+        context = current_context()
+        context.raise_if_cancelled()
+
+        empty = [("", "") if include_alignment else ""] * len(texts)
+        # While Azure is failing, fail fast instead of sending more requests
+        if not self.breaker.allow_request():
+            return empty
+
+        # Charge the user's quota before anything is sent; this raises
+        # QuotaExceededError and stops the job when the limit is reached
+        charge = None
+        if context.meter is not None:
+            chars = sum(billable_characters(text) for text in texts)
+            charge = (chars, context.meter.charge(chars))
+        # Set once Azure accepts the request; anything short of that is refunded
+        billed = False
         
         try:
-            # Make the request
-            response = requests.post(constructed_url, params=params, headers=headers, json=body)
+            # Make the request once the governor grants this client a slot
+            with timed('azure.governor_wait'):
+                acquired = self.governor.acquire(context.client_id, context.tier,
+                                                 cancel_token=context.cancel_token)
+            if not acquired:
+                # Cancelled, or past the deadline, while waiting for a slot
+                context.raise_if_cancelled()
+            if context.cancel_token is not None and context.cancel_token.cancelled:
+                # Cancelled just as the slot was granted
+                self.governor.release()
+                context.raise_if_cancelled()
+            started = time.perf_counter()
+            status = None
+            try:
+                with timed('azure.request'):
+                    # The request can't outlive the job's deadline
+                    response = requests.post(constructed_url, params=params, headers=headers, json=body,
+                                             timeout=self._request_timeout(context))
+                status = response.status_code
+            except requests.exceptions.RequestException as e:
+                status = type(e).__name__
+                raise
+            finally:
+                self.governor.release()
+                self.ledger.record(target_lang, texts, time.perf_counter() - started, status, context.client_id)
+                self._record_outcome(status)
             response.raise_for_status()  # This will raise an exception for bad status codes
-            
-            # Debug logging
-            # print(f"Response status: {response.status_code}")  # Commented out for debugging
-            # print(f"Response content: {response.text}")  # Commented out for debugging
+            billed = True
             
             # Parse response with proper error checking
             response_json = response.json()
-            if not response_json or not isinstance(response_json, list) or len(response_json) == 0:
+            if not response_json or not isinstance(response_json, list) or len(response_json) != len(texts):
                 print("Invalid response format")
-                return ""
+                return empty
             
-            translations = response_json[0].get('translations', [])
-            if not translations:
+            results = []
+            for item in response_json:
+                translations = item.get('translations', [])
+                translation = translations[0] if translations else {}
+                if include_alignment:
+                    results.append((translation.get('text', ''), translation.get('alignment', {}).get('proj', '')))
+                else:
+                    results.append(translation.get('text', ''))
+            if not any(result[0] if include_alignment else result for result in results):
                 print("No translations in response")
-                return ""
-            
-            translation = translations[0].get('text', '')
-            if translation:
-                # print(f"Azure translated '{text}' to '{translation}'")  # Commented out for debugging
-                return translation
-            else:
-                # print("No translated text found")  # Commented out for debugging
-                return ""
+            return results
             
+        except TranslationCancelled:
+            raise
         except requests.exceptions.RequestException as e:
+            if context.cancel_token is not None and context.cancel_token.cancelled:
+                # Timed out at the deadline
+                context.raise_if_cancelled()
             print(f"Request error: {str(e)}")
-            return ""
-        except (KeyError, IndexError, ValueError) as e:
+            return empty
+        except (KeyError, IndexError, ValueError, AttributeError) as e:
             print(f"Response parsing error: {str(e)}")
-            return ""
+            return empty
         except Exception as e:
             print(f"Azure translation error: {str(e)}")
-            return ""
+            return empty
+        finally:
+            if charge is not None and not billed:
+                context.meter.refund(*charge)
+
+    @timed('pinyin.word')
+    def get_word_pinyin(self, word):
+        """Get tone-marked pinyin for a word, one syllable per character"""
+        table = get_pinyin_table()
+        return ' '.join(table.char_pinyin(char) for char in word)
 
+    @timed('translator.process_vocabulary')
+    def process_vocabulary(self, words, target_lang="en", progress_callback=None, lookup=None):
+        """Resolve pinyin and translation once for each unique word
+
+        Returns a dict mapping every word to {'pinyin', 'translations'}. Only
+        Chinese words get pinyin and a translation; translations are fetched
+        in bulk through translate_batch, so cached words cost nothing. With
+        lookup, only the words in it are translated.
+        """
+        vocabulary = {}
+        chinese_words = []
+        for word in dict.fromkeys(words):
+            if is_chinese_word(word):
+                chinese_words.append(word)
+            else:
+                vocabulary[word] = {'pinyin': '', 'translations': []}
+
+        pinyins = [self.get_word_pinyin(word) for word in chinese_words]
+        if progress_callback:
+            progress_callback(0.3)
+
+        lookup_words = chinese_words if lookup is None else [word for word in chinese_words if word in lookup]
+        translations = dict(zip(lookup_words, self.translate_batch(
+            lookup_words,
+            target_lang,
+            progress_callback=(lambda p: progress_callback(0.3 + 0.7 * p)) if progress_callback else None
+        )))
+        if progress_callback:
+            progress_callback(1.0)
+
+        for word, pinyin_text in zip(chinese_words, pinyins):
+            translation = translations.get(word)
+            vocabulary[word] = {
+                'pinyin': pinyin_text,
+                'translations': [translation] if translation else []
+            }
+        return vocabulary
+
+    @timed('translator.process_chinese_text')
     def process_chinese_text(self, text, target_lang="en"):
         """Process Chinese text for word-by-word translation"""
         try:
             # Segment the text using jieba
             words = list(jieba.cut(text))
             
-            # Get pinyin for each word
-            word_pinyins = []
+            # Resolve each distinct word once, then map back onto the token stream
+            vocabulary = self.process_vocabulary(words, target_lang)
+            document = WordDocument()
             for word in words:
-                try:
-                    char_pinyins = []
-                    for char in word:
-                        try:
-                            char_pinyin = pinyin(char, style=Style.TONE)[0][0]
-                            char_pinyins.append(char_pinyin)
-                        except Exception as e:
-                            print(f"Error getting pinyin for char '{char}': {str(e)}")
-                            char_pinyins.append("")
-                    word_pinyins.append(' '.join(char_pinyins))
-                except Exception as e:
-                    print(f"Error processing word '{word}' for pinyin: {str(e)}")
-                    word_pinyins.append("")
-            
-            # Get translations using Azure
-            word_translations = []
-            
-            # 使用类级别的缓存
-            cache_key = f"{word}_{target_lang}"
-            for word in words:
-                try:
-                    # Skip translation for punctuation and numbers
-                    if (len(word.strip()) == 1 and not '\u4e00' <= word <= '\u9fff') or word.isdigit():
-                        word_translations.append("")
-                        continue
-                    
-                    # 检查缓存
-                    cache_key = f"{word}_{target_lang}"
-                    if cache_key in self.translated_words:
-                        translation = self.translated_words[cache_key]
-                        print(f"Cache hit: '{word}' -> '{translation}'")
-                    else:
-                        # Add delay between requests
-                        time.sleep(0.5)
-                        
-                        # Translate using Azure
-                        translation = self.translate_text(word, target_lang)
-                        self.translated_words[cache_key] = translation  # 更新缓存
-                        print(f"New translation: '{word}' -> '{translation}'")
-                    
-                    if translation:
-                        word_translations.append(translation)
-                    else:
-                        word_translations.append("")
-                    
-                except Exception as e:
-                    print(f"Translation error for word '{word}': {str(e)}")
-                    word_translations.append("")
-            
-            # Combine results
-            processed_words = []
-            for i, (word, pinyin_text, translation) in enumerate(zip(words, word_pinyins, word_translations)):
-                try:
-                    if '\u4e00' <= word <= '\u9fff':
-                        processed_words.append({
-                            'word': word,
-                            'pinyin': pinyin_text,
-                            'translations': [translation] if translation else []
-                        })
-                    else:
-                        processed_words.append({
-                            'word': word,
-                            'pinyin': '',
-                            'translations': []
-                        })
-                except Exception as e:
-                    print(f"Error combining results for word at index {i}: {str(e)}")
-                    processed_words.append({
-                        'word': word,
-                        'pinyin': '',
-                        'translations': []
-                    })
-            
-            return processed_words
+                document.append(word, vocabulary[word]['pinyin'], vocabulary[word]['translations'])
+            return document
             
+        except (QuotaExceededError, TranslationCancelled):
+            raise
         except Exception as e:
             print(f"Error processing text: {str(e)}")
-            return None
\ No newline at end of file
+            return None
+
+
+def is_chinese_word(word):
+    """Check whether a segmented word should get pinyin and a translation"""
+    return '\u4e00' <= word <= '\u9fff'
@@ -1 +1,433 @@
- 
\ No newline at end of file
+"""Text-to-speech service for the translation pages
+
+Run with:
+    python tts_server.py
+
+Configuration comes from environment variables:
+    TTS_BACKEND          "azure" (Azure Speech) or "tone" (local stand-in, default)
+    AZURE_SPEECH_KEY     Azure Speech key, for the azure backend
+    AZURE_SPEECH_REGION  Azure Speech region (default: southeastasia)
+    TTS_VOICE            Default voice (default: zh-CN-YunjianNeural)
+    TTS_CACHE_DIR        Where clips are stored (default: data/tts)
+    TTS_CACHE_MAX_MB     Size of the clip store; least recently used clips go first (default: 2000)
+    TTS_TOKEN            Shared secret the app sends to /pregenerate; without it /pregenerate is off
+    TTS_ALLOWED_ORIGINS  Comma-separated origins of the app, e.g. https://translator.example.com,
+                         or "*" for any; /tts only synthesizes new clips for pages from these
+                         (default: none, so only clips made by /pregenerate are served)
+    TTS_HOST / TTS_PORT  Listen address (default: 0.0.0.0:8765)
+
+Endpoints:
+    GET  /tts?text=...&voice=...   audio for text; cached clips support Range requests
+    POST /pregenerate              {"texts": [...], "voice": "..."} synthesize in the background;
+                                   needs "Authorization: Bearer <TTS_TOKEN>"
+    GET  /health
+"""
+import asyncio
+import hashlib
+import hmac
+import io
+import math
+import os
+import struct
+import wave
+from collections import OrderedDict
+from urllib.parse import urlsplit
+import re
+from xml.sax.saxutils import escape, quoteattr
+
+from aiohttp import web, ClientSession, ClientTimeout
+
+# Longest text accepted for one clip
+MAX_TEXT_CHARS = 1000
+# Clips synthesized at the same time by /pregenerate
+PREGENERATE_CONCURRENCY = 4
+# Texts accepted by one /pregenerate request
+MAX_PREGENERATE_TEXTS = 5000
+# Azure voice short names, e.g. zh-CN-YunjianNeural
+VOICE_PATTERN = re.compile(r'[A-Za-z]{2,3}(-[A-Za-z0-9]+)+')
+
+
+def normalize_text(text):
+    """Collapse whitespace so the page and the pregeneration job hit the same clip"""
+    return ' '.join(text.split())
+
+
+class SynthesisBackend:
+    """Turns text into audio; stream() yields the encoded audio in chunks"""
+
+    name = "base"
+    content_type = "application/octet-stream"
+    extension = "bin"
+
+    async def stream(self, text, voice):
+        raise NotImplementedError
+        yield b""
+
+
+class AzureSpeechBackend(SynthesisBackend):
+    """Azure Speech neural voices over the REST API"""
+
+    name = "azure"
+    content_type = "audio/mpeg"
+    extension = "mp3"
+
+    def __init__(self, key, region):
+        self.key = key
+        self.url = f"https://{region}.tts.speech.microsoft.com/cognitiveservices/v1"
+        self._session = None
+
+    async def _get_session(self):
+        if self._session is None:
+            self._session = ClientSession(timeout=ClientTimeout(total=30))
+        return self._session
+
+    async def stream(self, text, voice):
+        ssml = (
+            "<speak version='1.0' xml:lang='zh-CN'>"
+            f"<voice name={quoteattr(voice)}>{escape(text)}</voice>"
+            "</speak>"
+        )
+        headers = {
+            'Ocp-Apim-Subscription-Key': self.key,
+            'Content-Type': 'application/ssml+xml',
+            'X-Microsoft-OutputFormat': 'audio-24khz-48kbitrate-mono-mp3',
+            'User-Agent': 'translator-tts'
+        }
+        session = await self._get_session()
+        async with session.post(self.url, data=ssml.encode('utf-8'), headers=headers) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(16 * 1024):
+                yield chunk
+
+
+class ToneBackend(SynthesisBackend):
+    """Local stand-in that renders one short tone per character, for testing"""
+
+    name = "tone"
+    content_type = "audio/wav"
+    extension = "wav"
+
+    def __init__(self, sample_rate=16000, char_seconds=0.18):
+        self.sample_rate = sample_rate
+        self.char_seconds = char_seconds
+
+    async def stream(self, text, voice):
+        # Rendering is CPU bound; keep it off the event loop
+        yield await asyncio.to_thread(self._render, text)
+
+    def _render(self, text):
+        samples_per_char = int(self.sample_rate * self.char_seconds)
+        frames = bytearray()
+        for char in text:
+            frequency = 220 + (ord(char) % 24) * 20
+            for n in range(samples_per_char):
+                # Short fade in/out so characters don't click
+                envelope = min(1.0, n / 200, (samples_per_char - n) / 200)
+                value = 0.3 * envelope * math.sin(2 * math.pi * frequency * n / self.sample_rate)
+                frames += struct.pack('<h', int(value * 32767))
+
+        out = io.BytesIO()
+        with wave.open(out, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(self.sample_rate)
+            wav.writeframes(bytes(frames))
+        return out.getvalue()
+
+
+class ClipStore:
+    """Content-addressed clip cache on disk: one file per (backend, voice, text)
+
+    Once the clips add up to more than max_bytes, the least recently used
+    ones are removed.
+    """
+
+    def __init__(self, cache_dir, backend, max_bytes=2000 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.backend = backend
+        self.max_bytes = max_bytes
+        self._in_flight = {}
+        # clip id -> size, least recently used first
+        self._clips = OrderedDict()
+        self._total_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        """Index the clips left by earlier runs, oldest use first"""
+        entries = []
+        suffix = f".{self.backend.extension}"
+        for directory, _, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                if not file_name.endswith(suffix):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(directory, file_name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, file_name[:-len(suffix)], stat.st_size))
+        for _, clip_id, size in sorted(entries):
+            self._clips[clip_id] = size
+            self._total_bytes += size
+
+    def touch(self, clip_id):
+        """Mark a clip as used; the modification time keeps the order across restarts"""
+        if clip_id in self._clips:
+            self._clips.move_to_end(clip_id)
+        try:
+            os.utime(self.path(clip_id))
+        except OSError:
+            pass
+
+    def _add(self, clip_id, size):
+        self._total_bytes += size - self._clips.pop(clip_id, 0)
+        self._clips[clip_id] = size
+        # The newest clip stays even if it alone is over the limit
+        while self._total_bytes > self.max_bytes and len(self._clips) > 1:
+            old_id, old_size = self._clips.popitem(last=False)
+            self._total_bytes -= old_size
+            try:
+                os.remove(self.path(old_id))
+            except OSError:
+                pass
+
+    def clip_id(self, text, voice):
+        key = f"{self.backend.name}\n{voice}\n{text}"
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def path(self, clip_id):
+        return os.path.join(self.cache_dir, clip_id[:2], f"{clip_id}.{self.backend.extension}")
+
+    def has(self, clip_id):
+        return os.path.exists(self.path(clip_id))
+
+    def in_flight(self, clip_id):
+        """Future for a clip currently being synthesized, or None"""
+        return self._in_flight.get(clip_id)
+
+    async def synthesize(self, text, voice, on_chunk=None):
+        """Synthesize a clip into the store, passing chunks to on_chunk as they arrive
+
+        Concurrent requests for the same clip share one synthesis.
+        """
+        clip_id = self.clip_id(text, voice)
+        if self.has(clip_id):
+            self.touch(clip_id)
+            return self.path(clip_id)
+        pending = self._in_flight.get(clip_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[clip_id] = future
+        path = self.path(clip_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as clip_file:
+                async for chunk in self.backend.stream(text, voice):
+                    clip_file.write(chunk)
+                    if on_chunk is not None:
+                        try:
+                            await on_chunk(chunk)
+                        except ConnectionError:
+                            # The listener went away; still finish the clip for the cache
+                            on_chunk = None
+            os.replace(tmp_path, path)
+            self._add(clip_id, os.path.getsize(path))
+            future.set_result(path)
+            return path
+        except asyncio.CancelledError:
+            self._discard(tmp_path)
+            future.cancel()
+            raise
+        except Exception as e:
+            self._discard(tmp_path)
+            future.set_exception(e)
+            # Nobody else may be waiting; mark the exception as retrieved
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[clip_id]
+
+    def _discard(self, tmp_path):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def clip_response(store, clip_id):
+    """Serve a stored clip; FileResponse handles Range requests and streams from disk"""
+    store.touch(clip_id)
+    return web.FileResponse(
+        store.path(clip_id),
+        headers={
+            'Content-Type': store.backend.content_type,
+            'Cache-Control': 'public, max-age=31536000, immutable',
+            'ETag': f'"{clip_id}"'
+        }
+    )
+
+
+async def handle_tts(request):
+    store = request.app['store']
+    text = normalize_text(request.query.get('text', ''))
+    voice = request.query.get('voice') or request.app['default_voice']
+    if not VOICE_PATTERN.fullmatch(voice):
+        raise web.HTTPBadRequest(text="unknown voice")
+    if not text:
+        raise web.HTTPBadRequest(text="text is required")
+    if len(text) > MAX_TEXT_CHARS:
+        raise web.HTTPRequestEntityTooLarge(max_size=MAX_TEXT_CHARS, actual_size=len(text))
+
+    clip_id = store.clip_id(text, voice)
+    if store.has(clip_id):
+        return clip_response(store, clip_id)
+
+    pending = store.in_flight(clip_id)
+    if pending is not None:
+        await asyncio.shield(pending)
+        return clip_response(store, clip_id)
+
+    # Synthesis spends the speech key, so only the app's own pages may ask for new clips
+    if not origin_allowed(request):
+        raise web.HTTPForbidden(text="origin not allowed")
+
+    # First request for this clip: stream audio to the client while it is synthesized
+    response = web.StreamResponse(headers={
+        'Content-Type': store.backend.content_type,
+        'Cache-Control': 'no-cache'
+    })
+    await response.prepare(request)
+    try:
+        await store.synthesize(text, voice, on_chunk=response.write)
+    except Exception as e:
+        # Headers are already sent; the page falls back to browser speech
+        print(f"Synthesis failed for '{text[:20]}': {str(e)}")
+        return response
+    await response.write_eof()
+    return response
+
+
+async def handle_pregenerate(request):
+    store = request.app['store']
+    token = request.app['token']
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not token or not hmac.compare_digest(supplied.encode('utf-8'), token.encode('utf-8')):
+        raise web.HTTPForbidden(text="a valid token is required")
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="expected a JSON body")
+
+    voice = payload.get('voice') or request.app['default_voice']
+    if not isinstance(voice, str) or not VOICE_PATTERN.fullmatch(voice):
+        raise web.HTTPBadRequest(text="unknown voice")
+    texts = []
+    for text in payload.get('texts', [])[:MAX_PREGENERATE_TEXTS]:
+        text = normalize_text(str(text))
+        if text and len(text) <= MAX_TEXT_CHARS and not store.has(store.clip_id(text, voice)):
+            texts.append(text)
+    texts = list(dict.fromkeys(texts))
+
+    if texts:
+        task = asyncio.create_task(pregenerate(store, texts, voice, request.app['pregenerate_limit']))
+        request.app['background_tasks'].add(task)
+        task.add_done_callback(request.app['background_tasks'].discard)
+    return web.json_response({'queued': len(texts)}, status=202)
+
+
+async def pregenerate(store, texts, voice, limit):
+    async def synthesize(text):
+        async with limit:
+            try:
+                await store.synthesize(text, voice)
+            except Exception as e:
+                print(f"Pregeneration failed for '{text[:20]}': {str(e)}")
+    await asyncio.gather(*(synthesize(text) for text in texts))
+
+
+async def handle_health(request):
+    return web.json_response({'status': 'ok', 'backend': request.app['store'].backend.name})
+
+
+def request_origin(request):
+    """Origin of the page making the request; audio elements only send a Referer"""
+    origin = request.headers.get('Origin')
+    if origin:
+        return origin
+    referer = urlsplit(request.headers.get('Referer', ''))
+    return f"{referer.scheme}://{referer.netloc}" if referer.netloc else None
+
+
+def origin_allowed(request):
+    allowed = request.app['allowed_origins']
+    return '*' in allowed or request_origin(request) in allowed
+
+
+@web.middleware
+async def cors_middleware(request, handler):
+    # Translation pages are shown in Streamlit iframes of the app
+    if request.method == 'OPTIONS':
+        response = web.Response()
+    else:
+        response = await handler(request)
+    allowed = request.app['allowed_origins']
+    origin = request_origin(request)
+    if '*' in allowed:
+        response.headers['Access-Control-Allow-Origin'] = '*'
+    elif origin in allowed:
+        response.headers['Access-Control-Allow-Origin'] = origin
+        response.headers['Vary'] = 'Origin'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Range'
+    response.headers['Access-Control-Expose-Headers'] = 'Content-Length, Content-Range, Accept-Ranges'
+    return response
+
+
+def create_backend():
+    if os.environ.get("TTS_BACKEND", "tone") == "azure":
+        return AzureSpeechBackend(
+            os.environ["AZURE_SPEECH_KEY"],
+            os.environ.get("AZURE_SPEECH_REGION", "southeastasia")
+        )
+    return ToneBackend()
+
+
+def create_app(backend=None, cache_dir=None, default_voice=None):
+    app = web.Application(middlewares=[cors_middleware])
+    app['store'] = ClipStore(
+        cache_dir or os.environ.get("TTS_CACHE_DIR", "data/tts"),
+        backend or create_backend(),
+        max_bytes=int(os.environ.get("TTS_CACHE_MAX_MB", "2000")) * 1024 * 1024
+    )
+    app['default_voice'] = default_voice or os.environ.get("TTS_VOICE", "zh-CN-YunjianNeural")
+    app['token'] = os.environ.get("TTS_TOKEN", "")
+    app['allowed_origins'] = {
+        origin.strip().rstrip('/') for origin in os.environ.get("TTS_ALLOWED_ORIGINS", "").split(',')
+        if origin.strip()
+    }
+    if not app['token']:
+        print("TTS_TOKEN is not set; /pregenerate is disabled")
+    if not app['allowed_origins']:
+        print("TTS_ALLOWED_ORIGINS is not set; /tts only serves clips that already exist")
+    app['background_tasks'] = set()
+
+    async def on_startup(app):
+        app['pregenerate_limit'] = asyncio.Semaphore(PREGENERATE_CONCURRENCY)
+
+    app.on_startup.append(on_startup)
+    app.router.add_get('/tts', handle_tts)
+    app.router.add_post('/pregenerate', handle_pregenerate)
+    app.router.add_get('/health', handle_health)
+    return app
+
+
+def main():
+    web.run_app(
+        create_app(),
+        host=os.environ.get("TTS_HOST", "0.0.0.0"),
+        port=int(os.environ.get("TTS_PORT", "8765"))
+    )
+
+
+if __name__ == "__main__":
+    main()
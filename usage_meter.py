@@ -0,0 +1,45 @@
+import threading
+from datetime import datetime
+
+
+class QuotaExceededError(Exception):
+    """Raised when a translation would go past the user's daily limit"""
+
+
+def billable_characters(text):
+    """Count characters according to Azure Translator rules (spaces and newlines are free)"""
+    return len(text.replace(" ", "").replace("\n", ""))
+
+
+class UsageMeter:
+    """Charges a user's daily quota as characters are actually sent to Azure
+
+    Cache hits never reach the meter. Each charge is an atomic conditional
+    increment in the shared usage store, so concurrent jobs of the same user
+    can't overshoot the limit together. Once it is used up, charge() raises
+    QuotaExceededError and the running job stops before the next request.
+    """
+
+    def __init__(self, usage_store, key_name, daily_limit):
+        self.usage_store = usage_store
+        self.key_name = key_name
+        self.daily_limit = daily_limit
+        self.charged = 0
+        self._lock = threading.Lock()
+
+    def charge(self, chars):
+        """Charge chars before a request; returns the day charged, for refund()"""
+        today = datetime.now().date().isoformat()
+        if not self.usage_store.try_increment(self.key_name, today, chars, self.daily_limit):
+            raise QuotaExceededError(
+                f"Daily translation limit reached after {self.charged:,} characters"
+            )
+        with self._lock:
+            self.charged += chars
+        return today
+
+    def refund(self, chars, day):
+        """Give back a charge whose request failed, so retrying it isn't billed twice"""
+        self.usage_store.increment(self.key_name, day, -chars)
+        with self._lock:
+            self.charged -= chars
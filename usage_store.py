@@ -0,0 +1,336 @@
+import os
+import re
+import sqlite3
+import threading
+from collections import defaultdict
+
+
+def like_pattern(search):
+    """LIKE pattern (with ESCAPE '\\') matching search as a plain substring"""
+    escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+
+class UsageStore:
+    """Daily character usage per key name, shared by every session
+
+    Backends only need to provide atomic increments and per key/day lookups;
+    everything else in the app goes through this interface.
+    """
+
+    def increment(self, key_name, day, chars):
+        """Add chars to a user's usage for a day"""
+        raise NotImplementedError
+
+    def try_increment(self, key_name, day, chars, limit):
+        """Atomically add chars unless that would take the day's usage past limit
+
+        Returns True if the usage was recorded.
+        """
+        raise NotImplementedError
+
+    def get_usage(self, key_name, day):
+        """Characters used by a user on a day"""
+        raise NotImplementedError
+
+    # Rollups, maintained on every increment so the dashboard never scans raw usage
+
+    def get_daily_totals(self):
+        """Characters used by everyone, as {day: chars}"""
+        raise NotImplementedError
+
+    def count_users(self, search=""):
+        """Number of key names matching search"""
+        raise NotImplementedError
+
+    def get_user_totals(self, search="", offset=0, limit=20):
+        """One page of (key_name, total_chars, last_day), heaviest users first"""
+        raise NotImplementedError
+
+    def get_user_usage(self, key_name):
+        """One user's usage as {day: chars}"""
+        raise NotImplementedError
+
+
+class MemoryUsageStore(UsageStore):
+    """In-process stand-in, for local runs and tests"""
+
+    def __init__(self):
+        self._usage = defaultdict(dict)
+        self._daily_totals = defaultdict(int)
+        self._user_totals = {}
+        self._lock = threading.Lock()
+
+    def increment(self, key_name, day, chars):
+        with self._lock:
+            self._add(key_name, day, chars)
+
+    def try_increment(self, key_name, day, chars, limit):
+        with self._lock:
+            if self._usage[key_name].get(day, 0) + chars > limit:
+                return False
+            self._add(key_name, day, chars)
+            return True
+
+    def _add(self, key_name, day, chars):
+        self._usage[key_name][day] = self._usage[key_name].get(day, 0) + chars
+        self._daily_totals[day] += chars
+        total, last_day = self._user_totals.get(key_name, (0, day))
+        self._user_totals[key_name] = (total + chars, max(last_day, day))
+
+    def get_usage(self, key_name, day):
+        with self._lock:
+            return self._usage.get(key_name, {}).get(day, 0)
+
+    def get_daily_totals(self):
+        with self._lock:
+            return dict(sorted(self._daily_totals.items()))
+
+    def count_users(self, search=""):
+        with self._lock:
+            return sum(1 for key_name in self._user_totals if search.lower() in key_name.lower())
+
+    def get_user_totals(self, search="", offset=0, limit=20):
+        with self._lock:
+            rows = [
+                (key_name, total, last_day)
+                for key_name, (total, last_day) in self._user_totals.items()
+                if search.lower() in key_name.lower()
+            ]
+        rows.sort(key=lambda row: row[1], reverse=True)
+        return rows[offset:offset + limit]
+
+    def get_user_usage(self, key_name):
+        with self._lock:
+            return dict(sorted(self._usage.get(key_name, {}).items()))
+
+
+class SQLiteUsageStore(UsageStore):
+    """Usage kept in a local SQLite database, safe across threads and processes"""
+
+    def __init__(self, path="data/usage.db"):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS usage (
+                    key_name TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    chars INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (key_name, day)
+                )
+                """
+            )
+            has_rollups = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'usage_daily_totals'"
+            ).fetchone()
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS usage_daily_totals (
+                    day TEXT PRIMARY KEY,
+                    chars INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS usage_user_totals (
+                    key_name TEXT PRIMARY KEY,
+                    chars INTEGER NOT NULL DEFAULT 0,
+                    last_day TEXT NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS usage_user_totals_chars ON usage_user_totals (chars DESC)"
+            )
+            if not has_rollups:
+                # Backfill rollups for databases created before they existed
+                conn.execute(
+                    "INSERT INTO usage_daily_totals (day, chars) "
+                    "SELECT day, SUM(chars) FROM usage GROUP BY day"
+                )
+                conn.execute(
+                    "INSERT INTO usage_user_totals (key_name, chars, last_day) "
+                    "SELECT key_name, SUM(chars), MAX(day) FROM usage GROUP BY key_name"
+                )
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def increment(self, key_name, day, chars):
+        with self._connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO usage (key_name, day, chars) VALUES (?, ?, ?)
+                ON CONFLICT (key_name, day) DO UPDATE SET chars = chars + excluded.chars
+                """,
+                (key_name, day, chars)
+            )
+            self._update_rollups(conn, key_name, day, chars)
+
+    def try_increment(self, key_name, day, chars, limit):
+        if chars > limit:
+            return False
+        with self._connection() as conn:
+            cursor = conn.execute(
+                """
+                INSERT INTO usage (key_name, day, chars) VALUES (?, ?, ?)
+                ON CONFLICT (key_name, day) DO UPDATE SET chars = chars + excluded.chars
+                WHERE chars + excluded.chars <= ?
+                """,
+                (key_name, day, chars, limit)
+            )
+            if cursor.rowcount != 1:
+                return False
+            self._update_rollups(conn, key_name, day, chars)
+            return True
+
+    def _update_rollups(self, conn, key_name, day, chars):
+        # Runs in the same transaction as the usage update
+        conn.execute(
+            """
+            INSERT INTO usage_daily_totals (day, chars) VALUES (?, ?)
+            ON CONFLICT (day) DO UPDATE SET chars = chars + excluded.chars
+            """,
+            (day, chars)
+        )
+        conn.execute(
+            """
+            INSERT INTO usage_user_totals (key_name, chars, last_day) VALUES (?, ?, ?)
+            ON CONFLICT (key_name) DO UPDATE SET
+                chars = chars + excluded.chars,
+                last_day = MAX(last_day, excluded.last_day)
+            """,
+            (key_name, chars, day)
+        )
+
+    def get_usage(self, key_name, day):
+        row = self._connection().execute(
+            "SELECT chars FROM usage WHERE key_name = ? AND day = ?",
+            (key_name, day)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_daily_totals(self):
+        return dict(self._connection().execute(
+            "SELECT day, chars FROM usage_daily_totals ORDER BY day"
+        ).fetchall())
+
+    def count_users(self, search=""):
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM usage_user_totals WHERE key_name LIKE ? ESCAPE '\\'",
+            (like_pattern(search),)
+        ).fetchone()[0]
+
+    def get_user_totals(self, search="", offset=0, limit=20):
+        return self._connection().execute(
+            """
+            SELECT key_name, chars, last_day FROM usage_user_totals
+            WHERE key_name LIKE ? ESCAPE '\\'
+            ORDER BY chars DESC LIMIT ? OFFSET ?
+            """,
+            (like_pattern(search), limit, offset)
+        ).fetchall()
+
+    def get_user_usage(self, key_name):
+        return dict(self._connection().execute(
+            "SELECT day, chars FROM usage WHERE key_name = ? ORDER BY day",
+            (key_name,)
+        ).fetchall())
+
+
+class MongoUsageStore(UsageStore):
+    """Usage kept in MongoDB, for deployments running several app servers"""
+
+    def __init__(self, uri, database="translator", collection="usage"):
+        from pymongo import MongoClient, ASCENDING, DESCENDING
+        db = MongoClient(uri)[database]
+        self._collection = db[collection]
+        self._daily_totals = db[f"{collection}_daily_totals"]
+        self._user_totals = db[f"{collection}_user_totals"]
+        self._collection.create_index(
+            [("key_name", ASCENDING), ("day", ASCENDING)],
+            unique=True
+        )
+        self._user_totals.create_index([("chars", DESCENDING)])
+
+    def increment(self, key_name, day, chars):
+        self._collection.update_one(
+            {'key_name': key_name, 'day': day},
+            {'$inc': {'chars': chars}},
+            upsert=True
+        )
+        self._update_rollups(key_name, day, chars)
+
+    def _update_rollups(self, key_name, day, chars):
+        self._daily_totals.update_one({'_id': day}, {'$inc': {'chars': chars}}, upsert=True)
+        self._user_totals.update_one(
+            {'_id': key_name},
+            {'$inc': {'chars': chars}, '$max': {'last_day': day}},
+            upsert=True
+        )
+
+    def try_increment(self, key_name, day, chars, limit):
+        from pymongo.errors import DuplicateKeyError
+        if chars > limit:
+            return False
+        try:
+            # If the existing document is over the limit the filter doesn't
+            # match, the upsert collides with the unique index and we refuse
+            self._collection.update_one(
+                {'key_name': key_name, 'day': day, 'chars': {'$lte': limit - chars}},
+                {'$inc': {'chars': chars}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        self._update_rollups(key_name, day, chars)
+        return True
+
+    def get_usage(self, key_name, day):
+        doc = self._collection.find_one({'key_name': key_name, 'day': day}, {'chars': 1})
+        return doc['chars'] if doc else 0
+
+    def get_daily_totals(self):
+        return {doc['_id']: doc['chars'] for doc in self._daily_totals.find().sort('_id', 1)}
+
+    def _user_filter(self, search):
+        # Escaped, so search is a plain substring as in the other stores
+        return {'_id': {'$regex': re.escape(search), '$options': 'i'}} if search else {}
+
+    def count_users(self, search=""):
+        return self._user_totals.count_documents(self._user_filter(search))
+
+    def get_user_totals(self, search="", offset=0, limit=20):
+        cursor = self._user_totals.find(self._user_filter(search)).sort('chars', -1).skip(offset).limit(limit)
+        return [(doc['_id'], doc['chars'], doc.get('last_day', '')) for doc in cursor]
+
+    def get_user_usage(self, key_name):
+        cursor = self._collection.find({'key_name': key_name}, {'day': 1, 'chars': 1}).sort('day', 1)
+        return {doc['day']: doc['chars'] for doc in cursor}
+
+
+def create_usage_store(settings):
+    """Build the usage store described by the [usage_store] secrets section"""
+    backend = settings.get("backend", "sqlite")
+    if backend == "mongodb":
+        return MongoUsageStore(
+            settings["mongo_uri"],
+            database=settings.get("database", "translator"),
+            collection=settings.get("collection", "usage")
+        )
+    if backend == "memory":
+        return MemoryUsageStore()
+    return SQLiteUsageStore(settings.get("path", "data/usage.db"))
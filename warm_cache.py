@@ -0,0 +1,143 @@
+"""Warm the persistent translation cache with high-frequency vocabulary
+
+Usage:
+    python warm_cache.py --top 5000                        # jieba's dictionary, every language
+    python warm_cache.py --words hsk.txt --languages vi en   # a word list, two languages
+    python warm_cache.py --top 20000 --report-only           # coverage only, no translation
+
+Word lists have one word per line, optionally followed by a frequency;
+without frequencies, earlier lines count as more frequent. Words already in
+the cache are skipped, so an interrupted run picks up where it stopped.
+Translations are paced to stay under --chars-per-minute and stop at
+--max-chars.
+"""
+import argparse
+import sys
+import time
+
+import jieba
+
+from translator import Translator, LANGUAGES, MAX_BATCH_ELEMENTS, is_chinese_word
+from translation_context import TranslationContext, use_context
+from usage_meter import billable_characters
+
+
+def load_jieba_frequencies():
+    """(word, frequency) pairs from jieba's dictionary"""
+    with jieba.dt.get_dict_file() as dict_file:
+        for line in dict_file:
+            parts = line.decode('utf-8').split()
+            if len(parts) >= 2:
+                yield parts[0], int(parts[1])
+
+
+def load_word_list(path):
+    """(word, frequency) pairs from a word list such as an HSK list"""
+    with open(path, 'r', encoding='utf-8-sig') as word_file:
+        lines = [line.split() for line in word_file if line.strip()]
+    for rank, parts in enumerate(lines):
+        if len(parts) >= 2 and parts[1].isdigit():
+            yield parts[0], int(parts[1])
+        else:
+            yield parts[0], len(lines) - rank
+
+
+def top_words(pairs, top):
+    """The top most frequent Chinese words, as {word: frequency}"""
+    frequencies = {}
+    for word, frequency in pairs:
+        if is_chinese_word(word):
+            frequencies[word] = max(frequency, frequencies.get(word, 0))
+    ranked = sorted(frequencies.items(), key=lambda item: -item[1])[:top]
+    return dict(ranked)
+
+
+def resolve_languages(names):
+    """Language codes from display names or codes; every app language by default"""
+    if not names:
+        return list(dict.fromkeys(LANGUAGES.values()))
+    codes = []
+    for name in names:
+        code = LANGUAGES.get(name, name)
+        if code not in LANGUAGES.values():
+            raise ValueError(f"Unknown language '{name}'")
+        codes.append(code)
+    return list(dict.fromkeys(codes))
+
+
+def coverage(translator, words, target_lang):
+    """(words cached, share of the total frequency they account for)"""
+    cached = translator.cache.get_many(words, target_lang)
+    total = sum(words.values())
+    covered = sum(frequency for word, frequency in words.items() if word in cached)
+    return len(cached), covered / total if total else 0.0
+
+
+def warm_language(translator, words, target_lang, chars_per_minute, budget):
+    """Translate the uncached words for one language; returns characters sent"""
+    cached = translator.cache.get_many(words, target_lang)
+    missing = [word for word in words if word not in cached]
+    sent = 0
+    started = time.monotonic()
+    for start in range(0, len(missing), MAX_BATCH_ELEMENTS):
+        batch = missing[start:start + MAX_BATCH_ELEMENTS]
+        chars = sum(billable_characters(word) for word in batch)
+        if budget is not None and sent + chars > budget:
+            print(f"  {target_lang}: character budget reached")
+            break
+
+        # Sleep until this batch fits under the rate budget
+        wait = (sent + chars) / chars_per_minute * 60 - (time.monotonic() - started)
+        if wait > 0:
+            time.sleep(wait)
+        translator.translate_batch(batch, target_lang)
+        sent += chars
+        print(f"  {target_lang}: {min(start + len(batch), len(missing)):,}/{len(missing):,} words")
+    return sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", help="Word list file (default: jieba's dictionary frequencies)")
+    parser.add_argument("--top", type=int, default=5000, help="Most frequent words to warm (default: 5000)")
+    parser.add_argument("--languages", nargs="*", help="Language names or codes (default: every app language)")
+    parser.add_argument("--chars-per-minute", type=int, default=30000,
+                        help="Rate budget for Azure (default: 30000)")
+    parser.add_argument("--max-chars", type=int, help="Stop after sending this many characters")
+    parser.add_argument("--report-only", action="store_true", help="Only report cache coverage")
+    args = parser.parse_args()
+
+    try:
+        languages = resolve_languages(args.languages)
+    except ValueError as e:
+        print(f"Error: {str(e)}")
+        sys.exit(1)
+
+    translator = Translator()
+    if translator.cache is None:
+        print("Error: the persistent translation cache is disabled ([translation_cache] enabled = false)")
+        sys.exit(1)
+
+    pairs = load_word_list(args.words) if args.words else load_jieba_frequencies()
+    words = top_words(pairs, args.top)
+    print(f"Warming {len(words):,} words into {', '.join(languages)}")
+
+    sent = 0
+    if not args.report_only:
+        # Azure spend shows up in the ledger under this name
+        with use_context(TranslationContext("warm_cache")):
+            for target_lang in languages:
+                budget = args.max_chars - sent if args.max_chars is not None else None
+                sent += warm_language(translator, words, target_lang, args.chars_per_minute, budget)
+                if budget is not None and sent >= args.max_chars:
+                    break
+        print(f"Characters sent: {sent:,}")
+
+    print("\nCoverage (words cached, share of word frequency):")
+    for target_lang in languages:
+        cached, weighted = coverage(translator, words, target_lang)
+        print(f"  {target_lang:6} {cached:>7,}/{len(words):,}  {weighted:6.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import re
+
+# Tokens that end a sentence in segmented text
+SENTENCE_END = frozenset('。！？!?；;…')
+# Trimmed from the ends of a gloss
+GLOSS_PUNCTUATION = ' \t,.;:!?"\'()[]«»“”‘’，。；：！？、（）'
+
+
+def sentence_spans(tokens):
+    """(start, end) token ranges of the sentences in a segmented document
+
+    tokens is the output of segment_paragraphs: a sentence ends after
+    sentence-final punctuation and at every '\\n' token, which is left out.
+    """
+    start = 0
+    for index, token in enumerate(tokens):
+        if token == '\n':
+            if index > start:
+                yield start, index
+            start = index + 1
+        elif token in SENTENCE_END:
+            yield start, index + 1
+            start = index + 1
+    if start < len(tokens):
+        yield start, len(tokens)
+
+
+def parse_alignment(proj):
+    """Azure's alignment string as (source start, source end, target start, target end), ends inclusive"""
+    spans = []
+    for pair in proj.split():
+        match = re.fullmatch(r'(\d+):(\d+)-(\d+):(\d+)', pair)
+        if match:
+            spans.append(tuple(int(group) for group in match.groups()))
+    return spans
+
+
+def token_glosses(tokens, translation, proj):
+    """The part of translation aligned with each token, or '' where nothing is
+
+    Target spans of a token are joined in order; spans separated only by
+    whitespace are read as one piece.
+    """
+    spans = parse_alignment(proj)
+    glosses = []
+    offset = 0
+    for token in tokens:
+        start, end = offset, offset + len(token) - 1
+        offset += len(token)
+        targets = sorted(
+            (target_start, target_end) for source_start, source_end, target_start, target_end in spans
+            if source_start <= end and source_end >= start
+        )
+        pieces = []
+        last_end = None
+        for target_start, target_end in targets:
+            if last_end is not None and target_start <= last_end + 1:
+                # Overlapping or adjacent span: extend the current piece
+                pieces[-1] = (pieces[-1][0], max(last_end, target_end))
+            elif last_end is not None and not translation[last_end + 1:target_start].strip():
+                pieces[-1] = (pieces[-1][0], target_end)
+            else:
+                pieces.append((target_start, target_end))
+            last_end = pieces[-1][1]
+        gloss = ' '.join(translation[piece_start:piece_end + 1] for piece_start, piece_end in pieces)
+        glosses.append(gloss.strip(GLOSS_PUNCTUATION))
+    return glosses
@@ -0,0 +1,75 @@
+from array import array
+
+# Token that separates paragraphs in an interactive document
+PARAGRAPH_BREAK = '\n'
+
+
+class WordDocument:
+    """A segmented document stored as token ids into a table of unique words
+
+    Each token costs four bytes in an array; a word's pinyin and
+    translations are stored once, however often it occurs. A word glossed
+    differently in different sentences gets one entry per gloss. Iterating
+    yields the familiar {'word', 'pinyin', 'translations'} dicts, built on
+    the fly.
+    """
+
+    __slots__ = ('words', 'pinyins', 'translations', 'tokens', '_ids')
+
+    def __init__(self):
+        self.words = []
+        self.pinyins = []
+        self.translations = []
+        self.tokens = array('I')
+        self._ids = {}
+
+    @classmethod
+    def from_records(cls, records):
+        """Build from a list of {'word', 'pinyin', 'translations'} dicts"""
+        document = cls()
+        for record in records:
+            document.append(record.get('word', ''), record.get('pinyin', ''), record.get('translations') or ())
+        return document
+
+    def word_id(self, word, pinyin='', translations=()):
+        """Id of word with these translations, adding it to the word table on first sight"""
+        translations = tuple(translations)
+        word_id = self._ids.get((word, translations))
+        if word_id is None:
+            word_id = self._ids[(word, translations)] = len(self.words)
+            self.words.append(word)
+            self.pinyins.append(pinyin)
+            self.translations.append(translations)
+        return word_id
+
+    def append(self, word, pinyin='', translations=()):
+        self.tokens.append(self.word_id(word, pinyin, translations))
+
+    def paragraphs(self):
+        """Token ids grouped into paragraphs; empty paragraphs are skipped"""
+        break_id = self._ids.get((PARAGRAPH_BREAK, ()))
+        paragraph = []
+        for word_id in self.tokens:
+            if word_id == break_id:
+                if paragraph:
+                    yield paragraph
+                    paragraph = []
+            else:
+                paragraph.append(word_id)
+        if paragraph:
+            yield paragraph
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __iter__(self):
+        for word_id in self.tokens:
+            word = self.words[word_id]
+            if word == PARAGRAPH_BREAK:
+                yield {'word': PARAGRAPH_BREAK}
+            else:
+                yield {
+                    'word': word,
+                    'pinyin': self.pinyins[word_id],
+                    'translations': list(self.translations[word_id])
+                }